@@ -1,21 +1,25 @@
 # take image as parameter for the function and return the text
-import pytesseract
 from PIL import Image
-import google.generativeai as genai
 import os
 import base64
-from io import BytesIO
+import logging
 from dotenv import load_dotenv
+import extraction_cache
+import image_preprocessing
+import document_pages
+import llm_client
+import ocr_engine
+import instrumentation
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("Please set the GOOGLE_API_KEY in your .env file")
+logger = logging.getLogger("ai-tally-agent.ocr_ai")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Gemini is configured from GOOGLE_API_KEY by llm_client on first use
+
+# Pages of a multi-page document OCR'd concurrently
+OCR_PAGE_WORKERS = int(os.getenv('OCR_PAGE_WORKERS', str(min(4, os.cpu_count() or 1))))
 
 SYSTEM_PROMPT = """     
 You will get the extracted OCR text from a document like invoice and you need to return the data[in list datatype] in a structured form for relevant further processing or data entry using python. NO irrelevant context is required the response will be not read bu anny
@@ -24,12 +28,21 @@ You will get the extracted OCR text from a document like invoice and you need to
 def process_with_gemini(text, system_prompt = SYSTEM_PROMPT, useModel = 'gemini-2.5-flash'):
     """
     Send text to Gemini 2.0 API for processing with a system prompt
+
+    Results are cached by (text, prompt, model), so a retried upload or a
+    repeated invoice does not call Gemini again.
     """
+    cache = extraction_cache.get_cache()
+    cache_key = extraction_cache.llm_key(text, system_prompt, useModel)
+    if cache is not None:
+        cached = cache.get(extraction_cache.LLM, cache_key)
+        if cached is not None:
+            return cached
     try:
         # Model can be changed.
 
-        model = genai.GenerativeModel(useModel)
-        response = model.generate_content(
+        response = llm_client.get_llm_client().generate(
+            useModel,
             f"{system_prompt}\n\nDocument Text:\n{text}",
             generation_config={
                 "temperature": 0.2,
@@ -38,74 +51,148 @@ def process_with_gemini(text, system_prompt = SYSTEM_PROMPT, useModel = 'gemini-
                 "max_output_tokens": 2048,
             },
         )
-        print(response)
+        logger.debug("Gemini %s returned %d characters", useModel, len(response.text or ""))
+        if cache is not None and response.text and response.text.strip():
+            cache.set(extraction_cache.LLM, cache_key, response.text)
+        return response.text
+    except Exception as e:
+        logger.warning("Error calling Gemini API: %s", e)
+        return None
+
+def process_image_with_gemini(image_bytes, system_prompt = SYSTEM_PROMPT, useModel = 'gemini-2.5-flash'):
+    """
+    Send the invoice image itself to Gemini, skipping local OCR
+
+    Results are cached by (image bytes, prompt, model).
+    """
+    cache = extraction_cache.get_cache()
+    cache_key = extraction_cache.llm_key(extraction_cache.content_hash(image_bytes), system_prompt,
+                                         f"image:{useModel}")
+    if cache is not None:
+        cached = cache.get(extraction_cache.LLM, cache_key)
+        if cached is not None:
+            return cached
+    try:
+        if document_pages.is_pdf(image_bytes):
+            mime_type = "application/pdf"
+        else:
+            image_format = Image.open(document_pages.open_buffer(image_bytes)).format or "JPEG"
+            mime_type = Image.MIME.get(image_format, "image/jpeg")
+        response = llm_client.get_llm_client().generate(
+            useModel,
+            [
+                f"{system_prompt}\n\nThe document is the attached image.",
+                {"mime_type": mime_type, "data": bytes(image_bytes)},
+            ],
+            generation_config={
+                "temperature": 0.2,
+                "top_p": 0.95,
+                "top_k": 40,
+                "max_output_tokens": 2048,
+            },
+        )
+        logger.debug("Gemini %s returned %d characters", useModel, len(response.text or ""))
+        if cache is not None and response.text and response.text.strip():
+            cache.set(extraction_cache.LLM, cache_key, response.text)
         return response.text
     except Exception as e:
-        print(f"Error calling Gemini API: {str(e)}")
+        logger.warning("Error calling Gemini API: %s", e)
         return None
 
+def _ocr_image(image, preprocess_config):
+    """Preprocess one decoded page and run Tesseract on it"""
+    pixels, timings = image_preprocessing.preprocess(image, preprocess_config)
+    for step, seconds in timings.items():
+        instrumentation.record(f"preprocess.{step}", seconds)
+    # Long-lived Tesseract workers instead of a tesseract process per call
+    with instrumentation.span("tesseract", height=pixels.shape[0], width=pixels.shape[1]) as span:
+        text = ocr_engine.image_to_string(pixels)
+        if not text.strip():
+            span.outcome = "empty"
+    return text
+
+def extract_text(image_data, is_base64=False, preprocess_config=None):
+    """
+    Run Tesseract OCR on image data
+
+    Multi-page TIFF/GIF and PDF documents are OCR'd page by page.
+
+    Args:
+        image_data: Image data as bytes (or a buffer such as an mmap) or base64 string
+        is_base64: Whether the image_data is base64 encoded
+        preprocess_config: image_preprocessing.PreprocessConfig
+            (default: from OCR_PREPROCESS_* environment variables)
+
+    Returns:
+        Extracted text, or None if no text could be extracted
+    """
+    # Handle base64 encoded data
+    if is_base64:
+        image_bytes = base64.b64decode(image_data)
+    else:
+        image_bytes = image_data
+
+    preprocess_config = preprocess_config or image_preprocessing.PreprocessConfig.from_env()
+    cache = extraction_cache.get_cache()
+    cache_key = extraction_cache.ocr_key(image_bytes, preprocess_config.cache_tag())
+    if cache is not None:
+        cached = cache.get(extraction_cache.OCR, cache_key)
+        if cached is not None:
+            return cached
+
+    if document_pages.is_pdf(image_bytes) or document_pages.page_count(image_bytes) > 1:
+        # Multi-page PDF/TIFF: OCR pages in parallel, merged in page order
+        extracted_text = document_pages.ocr_pages(
+            image_bytes,
+            lambda page: _ocr_image(page, preprocess_config),
+            max_workers=OCR_PAGE_WORKERS
+        ) or ""
+    else:
+        # Decode from a stream over the data (an mmap of large uploads is not copied)
+        image_file = document_pages.open_buffer(image_bytes)
+        # Perform OCR on the image
+        image = Image.open(image_file)
+        logger.debug("Decoded %s image, %sx%s", image.format, image.width, image.height)
+        extracted_text = _ocr_image(image, preprocess_config)
+
+    # Check if any text was extracted from the image
+    if not extracted_text.strip():
+        logger.debug("No text could be extracted from the image")
+        return None
+    # Only the size: the text is the customer's invoice
+    logger.debug("Extracted %d characters of text", len(extracted_text))
+    if cache is not None:
+        cache.set(extraction_cache.OCR, cache_key, extracted_text)
+    return extracted_text
+
 def ocr_ai(image_data, system_prompt = SYSTEM_PROMPT, useModel = 'gemini-2.5-flash', is_base64=False):
     """
     Process image data from Firestore (bytes or base64 encoded) for OCR
     
     Args:
-        image_data: Image data as bytes or base64 string
+        image_data: Image data as bytes (or a buffer such as an mmap) or base64 string
         system_prompt: System prompt for Gemini AI
         useModel: Gemini model to use
         is_base64: Whether the image_data is base64 encoded
     """
     try:
-        # Handle base64 encoded data
-        if is_base64:
-            image_bytes = base64.b64decode(image_data)
-        else:
-            image_bytes = image_data
-        # print("image_bytes",image_bytes)
-        # print("image_bytes type",type(image_bytes))
-        # print("image_data", image_data)
-        # print("image_data type",type(image_data))
-        # Create a file-like object from bytes
-        image_file = BytesIO(image_bytes)
-        # print(image_file)
-        # print(image_file.read())
-        #Show image
-        image_file.seek(0)
-        # image = Image.open(image_file)
-        # image.show()
-        # Perform OCR on the image
-        image = Image.open(image_file)
-        # print("image",image)
-
-        print("image type",type(image))
-        extracted_text = pytesseract.image_to_string(image, config='--psm 6')
-        
-        # Check if any text was extracted from the image
-        if not extracted_text.strip():
-            print("❌ Error: No text could be extracted from the image.")
+        extracted_text = extract_text(image_data, is_base64=is_base64)
+        if extracted_text is None:
             return None
-        print(extracted_text)
-        print("✅ Successfully extracted text from the image")
-        print("🔍 Processing text with Gemini AI...")
+        logger.debug("Processing text with Gemini")
         
         # Process the extracted text with Gemini
-        response = process_with_gemini(extracted_text,
-            system_prompt=(
-                            "This is extracted OCR text i need a 2d array of with 0th index of the index(0 based) "
-                            "is item name and 1st index is quantity and 2nd is 'um'(present in the invoice), 3rd being net price, "
-                            "4th being the net_worth, 5th being vat, 6th being gross, return a '\\n' sepreated string for each item "
-                            "and '|' sepreated values, no additional context or text formatiing is required just the required "
-                        ), useModel = 'gemini-2.5-flash-lite'
-        )
+        response = process_with_gemini(extracted_text, system_prompt=system_prompt, useModel=useModel)
         
         if response:
-            print("✅ Successfully processed text with Gemini AI")
+            logger.debug("Gemini returned %d characters", len(response))
             return response
         else:
-            print("❌ Failed to process text with Gemini AI")
+            logger.debug("Gemini returned no text")
             return None
             
     except Exception as e:
-        print(f"Error processing image data: {str(e)}")
+        logger.warning("Error processing image data: %s", e)
         return None
 
 
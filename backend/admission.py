@@ -0,0 +1,257 @@
+"""
+Admission Module
+Memory-aware admission control for invoice uploads: a maximum upload
+size, large uploads decoded from an mmap of their spooled temp file, and
+a budget of estimated decoded-image bytes shared by in-flight requests
+"""
+import io
+import math
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Union
+
+import document_pages
+import instrumentation
+
+# Peak working memory per decoded pixel and band: the decoded page and
+# its NumPy copy, plus a grayscale working copy per pixel (see
+# image_preprocessing.preprocess)
+_COPIES_PER_BAND = 2
+_GRAY_BYTES_PER_PIXEL = 2
+
+# Input that is neither an image nor a PDF (e.g. text for the stub backend)
+_UNKNOWN_EXPANSION = 4
+
+# Uploads at least this large are mmapped instead of read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeds the maximum upload size"""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"Upload of {size} bytes exceeds the {limit} byte limit")
+        self.size = size
+        self.limit = limit
+
+
+class Overloaded(Exception):
+    """No memory budget became free in time; retry after retry_after seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def estimate_cost(data, page_workers: Optional[int] = None) -> int:
+    """
+    Estimated peak memory, in bytes, of decoding and OCR'ing a document
+
+    Only the headers are read. Multi-page documents hold at most
+    page_workers + 1 pages at once (see document_pages.ocr_pages).
+
+    Args:
+        data: Encoded image or PDF (bytes or a buffer such as an mmap)
+        page_workers: Pages OCR'd concurrently (default: OCR_PAGE_WORKERS)
+    """
+    if page_workers is None:
+        page_workers = int(os.environ.get("OCR_PAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+    try:
+        width, height, bands, pages = document_pages.page_geometry(data)
+    except Exception:
+        return len(data) * _UNKNOWN_EXPANSION
+    per_page = width * height * (bands * _COPIES_PER_BAND + _GRAY_BYTES_PER_PIXEL)
+    return len(data) + per_page * min(max(1, pages), page_workers + 1)
+
+
+@contextmanager
+def open_upload(file, max_bytes: Optional[int] = None,
+                mmap_threshold: int = MMAP_THRESHOLD) -> Iterator[Union[bytes, mmap.mmap]]:
+    """
+    Contents of an uploaded file without holding large uploads in memory
+
+    Uploads smaller than mmap_threshold are read as bytes. Larger ones
+    (which Werkzeug has already spooled to a temp file) are mapped
+    read-only and the map is closed on exit, so the data must not be used
+    after the with block.
+
+    Args:
+        file: Werkzeug FileStorage or a binary file object
+        max_bytes: Largest upload accepted (optional)
+        mmap_threshold: Smallest upload that is mapped
+
+    Raises:
+        UploadTooLarge: If the upload is larger than max_bytes
+    """
+    stream = getattr(file, "stream", file)
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if max_bytes is not None and size > max_bytes:
+        raise UploadTooLarge(size, max_bytes)
+
+    mapped = None
+    if size >= mmap_threshold:
+        try:
+            stream.flush()
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # In-memory stream (no file descriptor): read it instead
+            mapped = None
+    if mapped is None:
+        yield stream.read()
+        return
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A buffer view is still exported; the map is freed with it
+            pass
+
+
+class AdmissionController:
+    """
+    Shares a memory budget between in-flight requests
+
+    Each request reserves its estimated cost before decoding and releases
+    it when done. Requests that do not fit wait in FIFO order for up to
+    queue_timeout seconds (at most max_queue of them) and are otherwise
+    shed with Overloaded. A request larger than the whole budget is
+    clamped to it, so it runs once nothing else is in flight.
+    """
+
+    def __init__(self, budget_bytes: int, queue_timeout: float = 10.0, max_queue: int = 16,
+                 retry_after: float = 5.0):
+        """
+        Initialize controller
+
+        Args:
+            budget_bytes: Estimated bytes that may be reserved at once
+            queue_timeout: Longest wait for budget before shedding
+            max_queue: Most requests waiting at once; further ones are shed
+            retry_after: Initial Retry-After; afterwards the average time
+                requests hold their reservation
+        """
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._hold_average = retry_after
+        self._reserved = 0
+        self._in_flight = 0
+        self._waiters: Deque[object] = deque()
+        self._condition = threading.Condition()
+        self._counters = {"admitted": 0, "queued": 0, "shed": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @contextmanager
+    def admit(self, cost: int) -> Iterator[None]:
+        """
+        Reserve cost bytes of the budget for the duration of the with block
+
+        Raises:
+            Overloaded: If the budget did not free up within queue_timeout
+        """
+        cost = max(0, min(cost, self.budget_bytes))
+        self._reserve(cost)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(cost, time.monotonic() - start)
+
+    def metrics(self) -> Dict[str, float]:
+        """Budget use, queue depth, counters and wait times"""
+        with self._condition:
+            admitted = self._counters["admitted"] or 1
+            return {
+                "budget_bytes": self.budget_bytes,
+                "reserved_bytes": self._reserved,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                **self._counters,
+                "wait_seconds_avg": round(self._wait_total / admitted, 3),
+                "wait_seconds_max": round(self._wait_max, 3),
+            }
+
+    def _reserve(self, cost: int) -> None:
+        start = time.monotonic()
+        with self._condition:
+            if not self._waiters and self._reserved + cost <= self.budget_bytes:
+                self._admit(cost, 0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                self._counters["shed"] += 1
+                raise Overloaded(self._retry_after())
+            # Only the head of the queue may take budget, so a large
+            # request is not starved by a stream of small ones
+            ticket = object()
+            self._waiters.append(ticket)
+            self._counters["queued"] += 1
+            deadline = start + self.queue_timeout
+            try:
+                while self._waiters[0] is not ticket or self._reserved + cost > self.budget_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["shed"] += 1
+                        raise Overloaded(self._retry_after())
+                    self._condition.wait(remaining)
+                self._admit(cost, time.monotonic() - start)
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may now be at the head of the queue
+                self._condition.notify_all()
+        instrumentation.record("admission.wait", time.monotonic() - start)
+
+    def _admit(self, cost: int, waited: float) -> None:
+        """Take the reservation (call with the condition held)"""
+        self._reserved += cost
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def _retry_after(self) -> int:
+        """Seconds a shed client should wait: the average reservation time"""
+        return max(1, min(60, math.ceil(self._hold_average)))
+
+    def _release(self, cost: int, held: float) -> None:
+        with self._condition:
+            self._reserved -= cost
+            self._in_flight -= 1
+            # Exponentially weighted average of how long reservations last
+            self._hold_average = 0.8 * self._hold_average + 0.2 * held
+            self._condition.notify_all()
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def max_upload_bytes() -> int:
+    """Largest accepted upload, from MAX_UPLOAD_MB"""
+    return int(float(os.environ.get("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+
+
+def get_controller() -> AdmissionController:
+    """
+    Process-wide controller configured from ADMISSION_MEMORY_BUDGET_MB,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_MAX_QUEUE and ADMISSION_RETRY_AFTER
+    """
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    budget_bytes=int(float(os.environ.get("ADMISSION_MEMORY_BUDGET_MB", "512")) * 1024 * 1024),
+                    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10")),
+                    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "16")),
+                    retry_after=float(os.environ.get("ADMISSION_RETRY_AFTER", "5")),
+                )
+    return _controller
@@ -0,0 +1,171 @@
+"""
+Batch Extraction Module
+Packs the OCR text of several invoices into one Gemini request and splits
+the reply back into per-invoice line items
+"""
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import extraction_cache
+
+logger = logging.getLogger("ai-tally-agent.batch_extraction")
+
+# Marker line that starts each invoice in the request and in the reply
+INVOICE_MARKER = "=== INVOICE {number} ==="
+_MARKER_RE = re.compile(r"^\s*=+\s*INVOICE\s+(\d+)\s*=+\s*$", re.IGNORECASE | re.MULTILINE)
+
+# Output tokens budgeted per invoice in a batched reply
+OUTPUT_TOKENS_PER_INVOICE = 1024
+MAX_OUTPUT_TOKENS = 8192
+
+# Defaults for batch packing
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", "8"))
+LLM_BATCH_MAX_TOKENS = int(os.environ.get("LLM_BATCH_MAX_TOKENS", "24000"))
+
+_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.95,
+    "top_k": 40,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def pack_batches(texts: List[str], prompt: str, max_invoices: int = LLM_BATCH_SIZE,
+                 max_tokens: int = LLM_BATCH_MAX_TOKENS) -> List[List[int]]:
+    """
+    Group invoice indexes into batches under an invoice count and token budget
+
+    The budget covers the prompt once plus each invoice's text and reply.
+    An invoice that alone exceeds the budget gets a batch of its own.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    used = estimate_tokens(prompt)
+    for index, text in enumerate(texts):
+        cost = estimate_tokens(text) + OUTPUT_TOKENS_PER_INVOICE
+        if current and (len(current) >= max_invoices or used + cost > max_tokens):
+            batches.append(current)
+            current = []
+            used = estimate_tokens(prompt)
+        current.append(index)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_prompt(prompt: str, texts: List[str]) -> str:
+    """Prompt asking for each invoice's items under its own marker"""
+    sections = "\n\n".join(
+        f"{INVOICE_MARKER.format(number=number)}\n{text.strip()}"
+        for number, text in enumerate(texts, start=1)
+    )
+    return (
+        f"{prompt}\n\n"
+        f"The document text below contains {len(texts)} separate invoices, each starting with a "
+        f"line like '{INVOICE_MARKER.format(number=1)}'. Process every invoice on its own. In your "
+        f"answer, repeat each invoice's marker line exactly, followed only by that invoice's items "
+        f"in the format above. Include every marker, in order, even if an invoice has no items."
+        f"\n\nDocument Text:\n{sections}"
+    )
+
+
+def split_batch_reply(reply: str, count: int) -> Dict[int, str]:
+    """
+    Split a batched reply into per-invoice sections
+
+    Returns:
+        Map of 0-based invoice index to its section, for sections that
+        contain at least one '|' separated row
+    """
+    sections: Dict[int, str] = {}
+    matches = list(_MARKER_RE.finditer(reply or ""))
+    for position, match in enumerate(matches):
+        number = int(match.group(1))
+        if not 1 <= number <= count or (number - 1) in sections:
+            continue
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(reply)
+        rows = [line.strip() for line in reply[match.end():end].strip().splitlines()
+                if line.count("|") >= 6]
+        if rows:
+            sections[number - 1] = "\n".join(rows)
+    return sections
+
+
+def extract_batch(texts: List[str], prompt: str, model: str,
+                  max_invoices: int = LLM_BATCH_SIZE, max_tokens: int = LLM_BATCH_MAX_TOKENS,
+                  max_workers: int = 1) -> List[Optional[str]]:
+    """
+    Extract line items for many OCR texts with as few requests as possible
+
+    Cached results are reused; the rest are packed into batched requests.
+    Invoices whose section is missing or unparseable in the reply are
+    retried with a single-invoice request.
+
+    Args:
+        texts: OCR text per invoice
+        prompt: Line-item prompt
+        model: Gemini model name
+        max_invoices: Most invoices per request
+        max_tokens: Estimated token budget per request
+        max_workers: Batched requests sent concurrently
+
+    Returns:
+        '|' separated line items per invoice, None where extraction failed
+    """
+    import OCR_AI
+    import llm_client
+
+    results: List[Optional[str]] = [None] * len(texts)
+    cache = extraction_cache.get_cache()
+    todo: List[int] = []
+    for index, text in enumerate(texts):
+        cached = cache.get(extraction_cache.LLM, extraction_cache.llm_key(text, prompt, model)) if cache else None
+        if cached is not None:
+            results[index] = cached
+        else:
+            todo.append(index)
+
+    def run(batch: List[int]) -> None:
+        if len(batch) > 1:
+            batch_texts = [texts[index] for index in batch]
+            try:
+                response = llm_client.get_llm_client().generate(
+                    model,
+                    build_batch_prompt(prompt, batch_texts),
+                    generation_config={
+                        **_GENERATION_CONFIG,
+                        "max_output_tokens": min(MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_PER_INVOICE * len(batch)),
+                    },
+                )
+                sections = split_batch_reply(response.text, len(batch))
+            except Exception as e:
+                logger.warning("Batched Gemini request failed, retrying invoices one by one: %s", e)
+                sections = {}
+            for position, index in enumerate(batch):
+                section = sections.get(position)
+                if section is not None:
+                    results[index] = section
+                    if cache is not None:
+                        cache.set(extraction_cache.LLM, extraction_cache.llm_key(texts[index], prompt, model), section)
+            batch = [index for position, index in enumerate(batch) if position not in sections]
+        # Single-invoice requests for anything the batch did not cover
+        for index in batch:
+            results[index] = OCR_AI.process_with_gemini(texts[index], system_prompt=prompt, useModel=model)
+
+    batches = [[todo[i] for i in batch] for batch in
+               pack_batches([texts[index] for index in todo], prompt, max_invoices, max_tokens)]
+    if max_workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(run, batches))
+    else:
+        for batch in batches:
+            run(batch)
+    return results
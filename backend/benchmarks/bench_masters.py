@@ -0,0 +1,100 @@
+"""
+Tally Masters Benchmark
+Times a full master export from a fake Tally (streamed and parsed as it
+arrives), the trigram index build, and fuzzy lookups of OCR-damaged names
+
+Run from the backend directory:
+    python -m benchmarks.bench_masters [--masters 1000 50000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.fake_tally import FakeTally, FakeTallyServer
+from tally_client import TallyClient
+
+_BRANDS = ("Tata", "Aashirvaad", "Fortune", "Saffola", "Amul", "Britannia", "Parle", "Surf",
+           "Lifebuoy", "Everest", "MDH", "Catch", "Nestle", "Dabur", "Patanjali", "Haldiram")
+_PRODUCTS = ("Basmati Rice", "Sunflower Oil", "Toor Dal", "Sugar", "Tea Powder", "Wheat Flour",
+             "Detergent", "Bath Soap", "Biscuits", "Masala Mix", "Ghee", "Paneer", "Milk Powder",
+             "Salt", "Chana Dal", "Mustard Oil", "Coffee", "Noodles", "Ketchup", "Jaggery")
+_SIZES = ("100g", "200g", "500g", "1kg", "2kg", "5kg", "10kg", "500ml", "1L", "5L", "Family Pack")
+_PARTIES = ("Traders", "Enterprises", "Wholesale", "Agencies", "Distributors", "Stores", "& Sons")
+_CITIES = ("Pune", "Nagpur", "Indore", "Surat", "Mysore", "Kochi", "Vizag", "Rajkot", "Agra")
+
+
+def synthetic_masters(count: int, rng: random.Random) -> Tuple[List[str], List[str]]:
+    """count distinct stock item names and count / 5 distinct ledger names"""
+    items, ledgers = set(), set()
+    while len(items) < count:
+        items.add(f"{rng.choice(_BRANDS)} {rng.choice(_PRODUCTS)} {rng.choice(_SIZES)} "
+                  f"{rng.randrange(1000)}")
+    while len(ledgers) < max(1, count // 5):
+        ledgers.add(f"{rng.choice(_CITIES)} {rng.choice(_PARTIES)} {rng.randrange(10_000)}")
+    return sorted(items), sorted(ledgers)
+
+
+def damage(name: str, rng: random.Random) -> str:
+    """name as OCR might read it: case changed, a character dropped or swapped, punctuation added"""
+    chars = list(name.upper() if rng.random() < 0.3 else name)
+    position = rng.randrange(len(chars))
+    if rng.random() < 0.5:
+        del chars[position]
+    else:
+        chars[position] = rng.choice("0O1lI5S.")
+    if rng.random() < 0.3:
+        chars.append(".")
+    return "".join(chars)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--masters", type=int, nargs="+", default=[1_000, 50_000])
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'items':>7} {'ledgers':>8} {'sync s':>8} {'peak MB':>8} {'lookup p50 us':>14} "
+          f"{'p99 us':>8} {'resolved':>9} {'correct':>8}")
+    for count in args.masters:
+        items, ledgers = synthetic_masters(count, rng)
+        tally = FakeTally(latency=0)
+        tally.add_masters("Bench", ledgers, items)
+        with FakeTallyServer(tally) as server:
+            client = TallyClient(server.url, masters_refresh_interval=3600)
+            start = time.perf_counter()
+            masters = client.masters.refresh("Bench")
+            sync_seconds = time.perf_counter() - start
+            # Second, traced export for the peak allocation
+            client.masters.invalidate()
+            tracemalloc.start()
+            client.masters.refresh("Bench")
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            client.close()
+
+        queries = [rng.choice(items) for _ in range(args.lookups)]
+        latencies, resolved, correct = [], 0, 0
+        for original in queries:
+            query = damage(original, rng)
+            start = time.perf_counter()
+            match = masters.stock_items.match(query)
+            latencies.append(time.perf_counter() - start)
+            resolved += match is not None
+            correct += match == original
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+        print(f"{len(masters.stock_items):>7} {len(masters.ledgers):>8} {sync_seconds:>8.2f} "
+              f"{peak / 1e6:>8.1f} {p50:>14.0f} {p99:>8.0f} {resolved / len(queries):>9.1%} "
+              f"{correct / len(queries):>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+End-to-end Pipeline Benchmark
+Runs upload, folder and XML build scenarios against a local fake Tally
+server and a fake Gemini model, and writes the results as JSON
+
+Run from the backend directory:
+    python -m benchmarks.bench_pipeline [--scenarios upload_single folder_100 ...]
+        [--output results.json] [--baseline previous.json]
+
+Tesseract is used when it is installed (--ocr auto); --ocr fake replaces
+it with a stand-in that returns synthetic invoice text after a delay.
+With --baseline, headline metrics are compared with an earlier run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import requests
+
+from benchmarks.fake_gemini import FakeGemini, FakeTesseract, tesseract_available
+from benchmarks.fake_tally import FakeTally, FakeTallyServer
+from benchmarks.synthetic_invoices import synthetic_invoice
+
+SCENARIOS = ("xml_build", "upload_single", "upload_concurrent", "folder_10", "folder_100", "folder_1000")
+
+# Metrics compared against --baseline, and whether higher is better
+HEADLINE_METRICS = {
+    "seconds": False,
+    "latency_p50": False,
+    "latency_p95": False,
+    "requests_per_second": True,
+    "images_per_second": True,
+    "vouchers_per_second": True,
+    "peak_mb": False,
+}
+
+
+class Context:
+    """Stand-ins and inputs shared by the scenarios"""
+
+    def __init__(self, args: argparse.Namespace, server: FakeTallyServer, gemini: FakeGemini,
+                 images: List[bytes], work_dir: str):
+        self.args = args
+        self.server = server
+        self.gemini = gemini
+        self.images = images
+        self.work_dir = work_dir
+        self._app_url: Optional[str] = None
+
+    def app_url(self) -> str:
+        """URL of the Flask app served on a background thread (started once)"""
+        if self._app_url is None:
+            from werkzeug.serving import make_server
+            import main
+
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            server = make_server("127.0.0.1", 0, main.app, threaded=True)
+            threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+            self._app_url = f"http://127.0.0.1:{server.server_port}"
+        return self._app_url
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    return {
+        "latency_mean": round(float(values.mean()), 4),
+        "latency_p50": round(float(np.percentile(values, 50)), 4),
+        "latency_p95": round(float(np.percentile(values, 95)), 4),
+        "latency_max": round(float(values.max()), 4),
+    }
+
+
+def stage_totals() -> Dict[str, List[float]]:
+    """[count, seconds] per stage, summed over outcomes"""
+    import instrumentation
+
+    totals: Dict[str, List[float]] = {}
+    for (stage, _), (count, seconds) in instrumentation.stage_seconds.totals().items():
+        entry = totals.setdefault(stage, [0, 0.0])
+        entry[0] += count
+        entry[1] += seconds
+    return totals
+
+
+def stage_breakdown(before: Dict[str, List[float]], after: Dict[str, List[float]]) -> Dict[str, dict]:
+    """Spans recorded in this process between two stage_totals() snapshots"""
+    breakdown = {}
+    for stage, (count, seconds) in sorted(after.items()):
+        prev_count, prev_seconds = before.get(stage, (0, 0.0))
+        if count > prev_count:
+            calls = count - prev_count
+            breakdown[stage] = {
+                "count": int(calls),
+                "seconds_total": round(seconds - prev_seconds, 4),
+                "seconds_mean": round((seconds - prev_seconds) / calls, 4),
+            }
+    return breakdown
+
+
+def counter_delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {name: after[name] - before.get(name, 0) for name in after if after[name] != before.get(name, 0)}
+
+
+def run_xml_build(ctx: Context) -> dict:
+    """Streamed envelope build (parse, validate, serialise) per voucher count"""
+    from benchmarks.bench_xml_builder import measure, run_streaming, synthetic_items
+    from tally_client import TallyClient
+
+    client = TallyClient()
+    sizes = {}
+    for count in ctx.args.xml_sizes:
+        result = measure(run_streaming, client, synthetic_items(count))
+        result["vouchers_per_second"] = round(count / result["seconds"], 1) if result["seconds"] else None
+        sizes[str(count)] = result
+    return {"sizes": sizes}
+
+
+def _post_invoice(url: str, session: requests.Session, image: bytes, name: str) -> tuple:
+    start = time.perf_counter()
+    try:
+        response = session.post(f"{url}/upload-invoice", files={"file": (name, image, "image/jpeg")},
+                                timeout=600)
+        ok = response.status_code == 200 and bool(response.json().get("status"))
+    except requests.RequestException:
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run_upload_single(ctx: Context) -> dict:
+    """Sequential /upload-invoice requests, one at a time"""
+    url = ctx.app_url()
+    latencies, failures = [], 0
+    with requests.Session() as session:
+        for i in range(ctx.args.single_requests):
+            ok, seconds = _post_invoice(url, session, ctx.images[i % len(ctx.images)], f"single-{i}.jpg")
+            latencies.append(seconds)
+            failures += not ok
+    return {"requests": len(latencies), "failures": failures, **latency_stats(latencies)}
+
+
+def run_upload_concurrent(ctx: Context) -> dict:
+    """/upload-invoice requests from --concurrency clients at once"""
+    url = ctx.app_url()
+    local = threading.local()
+
+    def post(i: int) -> tuple:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        return _post_invoice(url, session, ctx.images[i % len(ctx.images)], f"concurrent-{i}.jpg")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=ctx.args.concurrency) as executor:
+        outcomes = list(executor.map(post, range(ctx.args.concurrent_requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for _, seconds in outcomes]
+    return {
+        "requests": len(outcomes),
+        "concurrency": ctx.args.concurrency,
+        "failures": sum(1 for ok, _ in outcomes if not ok),
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(len(outcomes) / elapsed, 3),
+        **latency_stats(latencies),
+    }
+
+
+def _fill_folder(ctx: Context, count: int) -> str:
+    """Folder of count invoice images, hard-linked from the image pool where possible"""
+    folder = os.path.join(ctx.work_dir, f"folder-{count}")
+    os.makedirs(folder, exist_ok=True)
+    pool_dir = os.path.join(ctx.work_dir, "pool")
+    for i in range(count):
+        source = os.path.join(pool_dir, f"invoice-{i % len(ctx.images)}.jpg")
+        target = os.path.join(folder, f"invoice-{i:05d}.jpg")
+        if os.path.exists(target):
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+    return folder
+
+
+def run_folder(count: int) -> Callable[[Context], dict]:
+    def run(ctx: Context) -> dict:
+        """InvoiceProcessor.process over a folder of count images"""
+        from invoice_processor import InvoiceProcessor
+
+        folder = _fill_folder(ctx, count)
+        processor = InvoiceProcessor(company_name=ctx.args.company, ledger_name="Bench Ledger",
+                                     tally_url=ctx.server.url, ocr_workers=ctx.args.ocr_workers)
+        finished = threading.Event()
+        outcome = {"error": None, "last_status": None}
+
+        def on_error(message: str) -> None:
+            outcome["error"] = message
+            finished.set()
+
+        def on_status(message: str) -> None:
+            outcome["last_status"] = message
+
+        tally_before = ctx.server.tally.stats()
+        start = time.perf_counter()
+        processor.process(folder, on_status, on_error, finished.set)
+        if not finished.wait(ctx.args.timeout):
+            outcome["error"] = f"Timed out after {ctx.args.timeout:.0f}s"
+        elapsed = time.perf_counter() - start
+        # Copies of the same pool image share voucher identities, so later
+        # import batches alter vouchers rather than create them
+        tally_after = ctx.server.tally.stats()
+        imported = sum(tally_after[name] - tally_before[name] for name in ("vouchers_created", "vouchers_altered"))
+        return {
+            "images": count,
+            "seconds": round(elapsed, 4),
+            "images_per_second": round(count / elapsed, 3),
+            "vouchers_imported": imported,
+            "vouchers_per_second": round(imported / elapsed, 3),
+            **outcome,
+        }
+
+    return run
+
+
+RUNNERS: Dict[str, Callable[[Context], dict]] = {
+    "xml_build": run_xml_build,
+    "upload_single": run_upload_single,
+    "upload_concurrent": run_upload_concurrent,
+    "folder_10": run_folder(10),
+    "folder_100": run_folder(100),
+    "folder_1000": run_folder(1000),
+}
+
+
+def run_scenario(name: str, ctx: Context) -> dict:
+    """Run one scenario with its stand-in counters and per-stage spans attached"""
+    tally_before = ctx.server.tally.stats()
+    gemini_before = ctx.gemini.model.stats()
+    stages_before = stage_totals()
+    output = io.StringIO()
+    redirect = contextlib.nullcontext() if ctx.args.verbose else contextlib.redirect_stdout(output)
+    with redirect:
+        result = RUNNERS[name](ctx)
+    result["stages"] = stage_breakdown(stages_before, stage_totals())
+    result["tally"] = counter_delta(tally_before, ctx.server.tally.stats())
+    result["gemini"] = counter_delta(gemini_before, ctx.gemini.model.stats())
+    return result
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """Print headline metrics next to the baseline's; regressions are flagged"""
+    print(f"{'scenario':<28} {'metric':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        pairs = [(name, result, previous)]
+        if "sizes" in result:
+            pairs = [(f"{name}[{size}]", result["sizes"][size], previous.get("sizes", {}).get(size, {}))
+                     for size in result["sizes"]]
+        for label, now, before in pairs:
+            for metric, higher_is_better in HEADLINE_METRICS.items():
+                old, new = before.get(metric), now.get(metric)
+                if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old:
+                    continue
+                change = (new - old) / old * 100
+                worse = change < 0 if higher_is_better else change > 0
+                flag = "  <-- regression" if worse and abs(change) >= 10 else ""
+                print(f"{label:<28} {metric:<20} {old:>10} {new:>10} {change:>+7.1f}%{flag}")
+
+
+def metadata(args: argparse.Namespace, ocr: str) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ocr": ocr,
+        "settings": {name: value for name, value in vars(args).items()
+                     if name not in ("output", "baseline", "verbose")},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS,
+                        default=[name for name in SCENARIOS if name != "folder_1000"])
+    parser.add_argument("--output", default="bench_pipeline.json", help="JSON results file")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--ocr", choices=("auto", "tesseract", "fake"), default="auto")
+    parser.add_argument("--ocr-latency", type=float, default=0.3, help="Fake OCR seconds per page")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="Folder mode OCR processes")
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--gemini-token-latency", type=float, default=0.002)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="Fraction of calls answered 429")
+    parser.add_argument("--gemini-concurrency", type=int, default=8)
+    parser.add_argument("--tally-latency", type=float, default=0.05)
+    parser.add_argument("--tally-voucher-latency", type=float, default=0.0005)
+    parser.add_argument("--tally-error-rate", type=float, default=0.0)
+    parser.add_argument("--company", default="Bench Co")
+    parser.add_argument("--distinct-images", type=int, default=16)
+    parser.add_argument("--items-per-invoice", type=int, default=8)
+    parser.add_argument("--phone-photos", action="store_true", help="Degrade images like phone photos")
+    parser.add_argument("--single-requests", type=int, default=10)
+    parser.add_argument("--concurrent-requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--xml-sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--timeout", type=float, default=3600, help="Longest folder run")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own output")
+    args = parser.parse_args()
+
+    if args.ocr == "tesseract" and not tesseract_available():
+        sys.exit("Tesseract is not installed; use --ocr fake")
+    ocr = "tesseract" if args.ocr == "tesseract" or (args.ocr == "auto" and tesseract_available()) else "fake"
+
+    # Measure the pipeline itself: no cached extractions, no skipping of
+    # vouchers pushed by earlier runs, Tally pushed inline, no persistence
+    os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+    os.environ["VOUCHER_INDEX_ENABLED"] = "false"
+    os.environ["TALLY_OUTBOX_ENABLED"] = "false"
+    os.environ["PERSIST_INVOICES"] = "false"
+    os.environ.setdefault("PREWARM_SERVICES", "none")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    tally = FakeTally(latency=args.tally_latency, per_voucher_latency=args.tally_voucher_latency,
+                      error_rate=args.tally_error_rate)
+    with FakeTallyServer(tally) as server, tempfile.TemporaryDirectory(prefix="bench-pipeline-") as work_dir:
+        os.environ["TALLY_URL"] = server.url
+        os.environ["TALLY_COMPANY"] = args.company
+
+        import llm_client
+        import ocr_engine
+
+        gemini = FakeGemini(latency=args.gemini_latency, token_latency=args.gemini_token_latency,
+                            failure_rate=args.gemini_failure_rate, rows_per_invoice=args.items_per_invoice)
+        llm_client.set_llm_client(llm_client.LLMClient(
+            max_concurrency=args.gemini_concurrency, requests_per_minute=1_000_000,
+            tokens_per_minute=1_000_000_000, backoff_base=0.1, model_factory=gemini,
+        ))
+        if ocr == "fake":
+            # Folder mode forks its OCR processes, which inherit the stand-in
+            ocr_engine.image_to_string = FakeTesseract(latency=args.ocr_latency,
+                                                       rows_per_invoice=args.items_per_invoice)
+
+        print(f"Generating {args.distinct_images} synthetic invoice(s)...")
+        pool_dir = os.path.join(work_dir, "pool")
+        os.makedirs(pool_dir)
+        images = []
+        for seed in range(args.distinct_images):
+            data, _, _ = synthetic_invoice(args.items_per_invoice, seed=seed, phone_photo=args.phone_photos)
+            with open(os.path.join(pool_dir, f"invoice-{seed}.jpg"), "wb") as f:
+                f.write(data)
+            images.append(data)
+
+        ctx = Context(args, server, gemini, images, work_dir)
+        results = {"meta": metadata(args, ocr), "scenarios": {}}
+        for name in args.scenarios:
+            print(f"Running {name}...")
+            result = run_scenario(name, ctx)
+            results["scenarios"][name] = result
+            for label, values in (result["sizes"].items() if "sizes" in result else [("", result)]):
+                headline = {metric: values[metric] for metric in HEADLINE_METRICS if metric in values}
+                print(f"  {f'[{label}] ' if label else ''}{json.dumps(headline)}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
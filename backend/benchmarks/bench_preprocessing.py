@@ -0,0 +1,105 @@
+"""
+OCR Preprocessing Benchmark
+Reports Tesseract latency and character accuracy with no preprocessing,
+all steps, and all steps minus each one
+
+Run from the backend directory:
+    python -m benchmarks.bench_preprocessing [--synthetic 5] [--images DIR]
+
+With --images, every image needs a ground-truth text file next to it with
+the same name and a .txt extension.
+"""
+import argparse
+import difflib
+import io
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytesseract
+from PIL import Image
+
+from benchmarks.synthetic_invoices import synthetic_invoice
+from image_preprocessing import PreprocessConfig, preprocess
+
+STEPS = ("grayscale", "downscale", "deskew", "binarize", "crop_table")
+
+
+def variants() -> Dict[str, PreprocessConfig]:
+    """Configs to compare: raw, all steps, and all steps without each one"""
+    configs = {"raw": PreprocessConfig(enabled=False), "all": PreprocessConfig(crop_table=True)}
+    for step in STEPS:
+        options = {name: True for name in STEPS}
+        options[step] = False
+        configs[f"all-{step}"] = PreprocessConfig(**options)
+    return configs
+
+
+def char_accuracy(truth: str, text: str) -> float:
+    """Similarity of whitespace-normalised OCR output to the ground truth (0..1)"""
+    truth = " ".join(truth.split())
+    text = " ".join(text.split())
+    return difflib.SequenceMatcher(None, truth, text, autojunk=False).ratio()
+
+
+def load_images(folder: str) -> List[Tuple[str, bytes, str]]:
+    samples = []
+    for name in sorted(os.listdir(folder)):
+        base, ext = os.path.splitext(name)
+        truth_path = os.path.join(folder, base + ".txt")
+        if ext.lower() == ".txt" or not os.path.isfile(truth_path):
+            continue
+        with open(os.path.join(folder, name), "rb") as f, open(truth_path, encoding="utf-8") as t:
+            samples.append((name, f.read(), t.read()))
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", help="Folder of images with .txt ground truth")
+    parser.add_argument("--synthetic", type=int, default=3, help="Synthetic phone photos to generate")
+    args = parser.parse_args()
+
+    if args.images:
+        samples = load_images(args.images)
+    else:
+        samples = []
+        for seed in range(args.synthetic):
+            data, truth, _ = synthetic_invoice(item_count=10, seed=seed)
+            samples.append((f"synthetic-{seed}.jpg", data, truth))
+    if not samples:
+        sys.exit("No samples to benchmark")
+
+    try:
+        pytesseract.get_tesseract_version()
+        have_tesseract = True
+    except pytesseract.TesseractNotFoundError:
+        have_tesseract = False
+        print("tesseract not found: reporting preprocessing time only\n")
+
+    print(f"{'variant':>16} {'preprocess s':>13} {'ocr s':>8} {'total s':>8} {'accuracy':>9} {'pixels':>10}")
+    for name, config in variants().items():
+        prep_time = ocr_time = accuracy = 0.0
+        pixels = 0
+        for _, data, truth in samples:
+            image = Image.open(io.BytesIO(data))
+            start = time.perf_counter()
+            array, _ = preprocess(image, config)
+            prep_time += time.perf_counter() - start
+            pixels += array.shape[0] * array.shape[1]
+            if have_tesseract:
+                start = time.perf_counter()
+                text = pytesseract.image_to_string(array, config='--psm 6')
+                ocr_time += time.perf_counter() - start
+                accuracy += char_accuracy(truth, text)
+        n = len(samples)
+        accuracy_cell = f"{accuracy / n:>9.3f}" if have_tesseract else f"{'-':>9}"
+        print(f"{name:>16} {prep_time / n:>13.3f} {ocr_time / n:>8.3f} "
+              f"{(prep_time + ocr_time) / n:>8.3f} {accuracy_cell} {pixels // n:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Voucher XML Builder Benchmark
+Compares build time and peak memory of the original f-string envelope
+builder with the streaming fragment builder in TallyClient
+
+Run from the backend directory:
+    python -m benchmarks.bench_xml_builder [--sizes 100 10000 100000]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from line_items import LineItemBatch
+from tally_client import TallyClient, _coalesce
+from voucher_index import voucher_keys
+
+
+def legacy_build(client: TallyClient, company_name: str, party_ledger: str,
+                 items: List[List[str]], contra_ledger: str = "Purchase") -> str:
+    """The envelope builder TallyClient used before streaming (kept for comparison)"""
+    messages = []
+    for i, item in enumerate(items):
+        try:
+            if not item or len(item) < 7 or item[1] == "":
+                continue
+            qty = int(client._parse_number(item[1]))
+            if qty == 0:
+                continue
+            um = item[2]
+            net_price = float(client._parse_number(item[3]))
+            amt = client._parse_number(item[6])
+            dt = client._edu_safe_date_yyyyMMdd()
+            vno = f"INV-{i+100:03d}"
+            narration = f"{item[0]} | Qty: {qty} {um} | Rate: {net_price}"
+            guid = str(uuid.uuid4()).upper()
+            messages.append(f"""
+                <TALLYMESSAGE xmlns:UDF="TallyUDF">
+      <VOUCHER VCHTYPE="Receipt" ACTION="Create" GUID="{guid}">
+        <DATE>{dt}</DATE>
+        <EFFECTIVEDATE>{dt}</EFFECTIVEDATE>
+        <VOUCHERNUMBER>{vno}</VOUCHERNUMBER>
+        <VOUCHERTYPENAME>Receipt</VOUCHERTYPENAME>
+        <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
+        <NARRATION>{narration}</NARRATION>
+        <PARTYLEDGERNAME>{party_ledger}</PARTYLEDGERNAME>
+
+        <!-- Party ledger (Credit) -->
+        <ALLLEDGERENTRIES.LIST>
+          <LEDGERNAME>{party_ledger}</LEDGERNAME>
+          <ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE>
+          <AMOUNT>-{amt}</AMOUNT>
+        </ALLLEDGERENTRIES.LIST>
+
+        <!-- Cash/Bank (Debit) -->
+        <ALLLEDGERENTRIES.LIST>
+          <LEDGERNAME>{contra_ledger}</LEDGERNAME>
+          <ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE>
+          <AMOUNT>{amt}</AMOUNT>
+        </ALLLEDGERENTRIES.LIST>
+      </VOUCHER>
+    </TALLYMESSAGE>
+        """)
+        except (IndexError, ValueError, TypeError):
+            continue
+    return f"""
+<ENVELOPE>
+  <HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>
+  <BODY>
+    <IMPORTDATA>
+      <REQUESTDESC>
+        <REPORTNAME>Vouchers</REPORTNAME>
+        <STATICVARIABLES>
+          <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+        </STATICVARIABLES>
+      </REQUESTDESC>
+      <REQUESTDATA>
+        {''.join(messages)}
+      </REQUESTDATA>
+    </IMPORTDATA>
+  </BODY>
+</ENVELOPE>
+"""
+
+
+def synthetic_items(count: int) -> List[List[str]]:
+    """Line items shaped like the LLM output"""
+    items = []
+    for i in range(count):
+        qty = 1 + i % 9
+        worth = qty * 1125.50
+        items.append([f"Item {i} & Sons", str(qty), "pcs", "1,125.50", f"{worth:,.2f}", "10%",
+                      f"{worth * 1.1:,.2f}"])
+    return items
+
+
+def run_legacy(client: TallyClient, items: List[List[str]]) -> int:
+    """Build the legacy envelope and encode it, as send_request did"""
+    return len(legacy_build(client, "A", "New Fresh Ledger", items).encode("utf-8"))
+
+
+def run_streaming(client: TallyClient, items: List[List[str]]) -> int:
+    """
+    Parse and validate as a LineItemBatch, derive voucher keys, then
+    consume the streamed envelope in send-sized chunks
+    """
+    batch = LineItemBatch.coerce(items)
+    valid, _ = batch.validate()
+    keys = voucher_keys(batch)
+    vouchers = (client._prepare_voucher(batch[i], i, keys[i]) for i in np.flatnonzero(valid))
+    fragments = client._iter_vouchers_envelope("A", "New Fresh Ledger", "Purchase", vouchers)
+    return sum(len(chunk) for chunk in _coalesce(fragments))
+
+
+def measure(func: Callable[[TallyClient, List[List[str]]], int], client: TallyClient,
+            items: List[List[str]]) -> dict:
+    """Wall time (untraced run) and peak traced allocation (second run)"""
+    gc.collect()
+    start = time.perf_counter()
+    size = func(client, items)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    func(client, items)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(elapsed, 4), "peak_mb": round(peak / 1e6, 2), "bytes": size}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    args = parser.parse_args()
+
+    client = TallyClient()
+    print(f"{'vouchers':>9} {'builder':>10} {'seconds':>9} {'peak MB':>9} {'payload MB':>11}")
+    for count in args.sizes:
+        items = synthetic_items(count)
+        for name, func in (("legacy", run_legacy), ("streaming", run_streaming)):
+            result = measure(func, client, items)
+            print(f"{count:>9} {name:>10} {result['seconds']:>9} {result['peak_mb']:>9} "
+                  f"{result['bytes'] / 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
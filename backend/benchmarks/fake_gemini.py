@@ -0,0 +1,141 @@
+"""
+Fake Gemini
+Local stand-ins for the Gemini model and for Tesseract, so the pipeline
+can be benchmarked without an API key or a Tesseract install
+"""
+import hashlib
+import random
+import re
+import shutil
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+from benchmarks.synthetic_invoices import invoice_text, line_items
+
+# A row as printed by synthetic_invoices: "No. Description Qty UM price worth VAT gross"
+_ROW_RE = re.compile(
+    r"^\s*\d+\s+(.+?)\s+(\d+)\s+(\S+)\s+(\d[\d.,]*)\s+(\d[\d.,]*)\s+(\d[\d.,]*)\s+(\d[\d.,]*)\s*$",
+    re.MULTILINE,
+)
+_MARKER_RE = re.compile(r"^\s*(=+\s*INVOICE\s+\d+\s*=+)\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+class FakeResponse:
+    """The part of a generate_content response the pipeline reads"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiError(Exception):
+    """Provider error carrying an HTTP status, like google.api_core errors"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeGeminiModel:
+    """
+    Answers line-item prompts with '|' separated rows
+
+    Rows printed by the synthetic invoice generator are read back from the
+    prompt's document text; text without such rows (real OCR noise, or an
+    image part) gets synthetic rows seeded from its hash. Batched prompts
+    are answered per invoice marker. Latency is latency plus
+    token_latency per output token; failure_rate of calls raise a 429.
+    """
+
+    def __init__(self, latency: float = 0.5, token_latency: float = 0.002,
+                 failure_rate: float = 0.0, rows_per_invoice: int = 8, seed: int = 0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.failure_rate = failure_rate
+        self.rows_per_invoice = rows_per_invoice
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "throttled": 0, "output_tokens": 0}
+
+    def generate_content(self, contents, generation_config: Optional[dict] = None) -> FakeResponse:
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        text = "\n".join(part for part in parts if isinstance(part, str))
+        images = [part for part in parts if not isinstance(part, str)]
+        with self._lock:
+            self._counters["calls"] += 1
+            throttled = self._rng.random() < self.failure_rate
+            if throttled:
+                self._counters["throttled"] += 1
+        if throttled:
+            time.sleep(self.latency / 4)
+            raise FakeGeminiError(429, "Resource has been exhausted, retry after 1s")
+
+        document = text.split("Document Text:", 1)[-1]
+        if _MARKER_RE.search(document):
+            sections = _MARKER_RE.split(document)[1:]
+            reply = "\n".join(f"{marker}\n{self._rows(body)}"
+                              for marker, body in zip(sections[::2], sections[1::2]))
+        else:
+            seed = repr(images[0])[:256] if images and not _ROW_RE.search(document) else document
+            reply = self._rows(document, seed)
+        tokens = len(reply) // 4 + 1
+        with self._lock:
+            self._counters["output_tokens"] += tokens
+        time.sleep(self.latency + self.token_latency * tokens)
+        return FakeResponse(reply)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def _rows(self, document: str, seed: Optional[str] = None) -> str:
+        rows = ["|".join(match) for match in _ROW_RE.findall(document)]
+        if not rows:
+            rng = random.Random(hashlib.sha256((seed or document).encode("utf-8")).hexdigest())
+            rows = ["|".join(item) for item in line_items(self.rows_per_invoice, rng)]
+        return "\n".join(rows)
+
+
+class FakeGemini:
+    """Model factory for LLMClient that hands out one FakeGeminiModel for every name"""
+
+    def __init__(self, **model_options):
+        self.model = FakeGeminiModel(**model_options)
+
+    def __call__(self, name: str) -> FakeGeminiModel:
+        return self.model
+
+
+class FakeTesseract:
+    """
+    Stand-in for ocr_engine.image_to_string
+
+    Returns the text of a synthetic invoice seeded from a checksum of the
+    page, so different images give different (but repeatable) text, after
+    latency seconds plus per_megapixel seconds per million pixels.
+    """
+
+    def __init__(self, latency: float = 0.3, per_megapixel: float = 0.2, rows_per_invoice: int = 8):
+        self.latency = latency
+        self.per_megapixel = per_megapixel
+        self.rows_per_invoice = rows_per_invoice
+
+    def __call__(self, pixels: np.ndarray) -> str:
+        pixels = np.ascontiguousarray(pixels)
+        seed = zlib.crc32(pixels[::17].tobytes())
+        time.sleep(self.latency + self.per_megapixel * pixels.shape[0] * pixels.shape[1] / 1e6)
+        rng = random.Random(seed)
+        items = line_items(self.rows_per_invoice, rng)
+        return invoice_text(items, invoice_no=str(1000 + seed % 9000))
+
+
+def tesseract_available() -> bool:
+    """Whether real OCR can run (tesserocr or the tesseract binary)"""
+    try:
+        import tesserocr  # noqa: F401
+        return True
+    except ImportError:
+        return shutil.which("tesseract") is not None
@@ -0,0 +1,253 @@
+"""
+Fake Tally Server
+Local HTTP stand-in for Tally's XML server: parses import and export
+envelopes and answers with CREATED/ALTERED/ERRORS counts and LINEERRORs
+like Tally does, after a configurable delay
+"""
+import hashlib
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Set
+from xml.sax.saxutils import escape, quoteattr
+
+# Ledgers every company starts with
+DEFAULT_LEDGERS = ("Cash", "Purchase", "Sales", "Profit & Loss A/c")
+
+
+class FakeTally:
+    """
+    In-memory Tally company data and the import/export rules
+
+    Vouchers are keyed by REMOTEID: a known id is reported as ALTERED, a
+    new one as CREATED. A voucher naming a ledger the company does not
+    have fails with Tally's "Ledger 'X' does not exist!" line error, and
+    error_rate of vouchers (chosen by id, so re-sends fail the same way)
+    fail with a totals mismatch.
+    """
+
+    def __init__(self, latency: float = 0.05, per_voucher_latency: float = 0.0005,
+                 error_rate: float = 0.0, serialize: bool = True):
+        """
+        Initialize fake
+
+        Args:
+            latency: Seconds added to every request
+            per_voucher_latency: Seconds added per voucher in an import
+            error_rate: Fraction of vouchers rejected with a line error
+            serialize: Handle one request at a time, as Tally does
+        """
+        self.latency = latency
+        self.per_voucher_latency = per_voucher_latency
+        self.error_rate = error_rate
+        self._serial = threading.Lock() if serialize else None
+        self._lock = threading.Lock()
+        self._ledgers: Dict[str, Set[str]] = {}
+        self._masters: Dict[str, Dict[str, List[str]]] = {}
+        self._vouchers: Dict[str, Set[str]] = {}
+        self._counters = {"requests": 0, "exports": 0, "imports": 0, "ledgers_created": 0,
+                          "vouchers_created": 0, "vouchers_altered": 0, "voucher_errors": 0,
+                          "bad_requests": 0, "bytes_received": 0}
+
+    def handle(self, body: bytes) -> str:
+        """Response XML for one request envelope"""
+        if self._serial is None:
+            return self._handle(body)
+        with self._serial:
+            return self._handle(body)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def add_masters(self, company: str, ledgers: Iterable[str] = (), stock_items: Iterable[str] = ()) -> None:
+        """Give a company extra ledgers and stock items (exported with their original case)"""
+        with self._lock:
+            masters = self._masters.setdefault(company, {"Ledger": [], "StockItem": []})
+            masters["Ledger"].extend(ledgers)
+            masters["StockItem"].extend(stock_items)
+            self._company_ledgers(company).update(name.lower() for name in masters["Ledger"])
+
+    def reset(self) -> None:
+        """Forget all companies and counters"""
+        with self._lock:
+            self._ledgers.clear()
+            self._masters.clear()
+            self._vouchers.clear()
+            self._counters = dict.fromkeys(self._counters, 0)
+
+    def _handle(self, body: bytes) -> str:
+        self._count("requests")
+        self._count("bytes_received", len(body))
+        try:
+            root = ET.fromstring(body)
+        except ET.ParseError as e:
+            self._count("bad_requests")
+            time.sleep(self.latency)
+            return _response(errors=1, line_errors=[f"Could not parse request: {str(e)}"])
+        company = root.findtext(".//SVCURRENTCOMPANY") or ""
+        request_type = (root.findtext("HEADER/TALLYREQUEST") or "").strip().lower()
+        if request_type == "export":
+            self._count("exports")
+            time.sleep(self.latency)
+            return self._export(company, (root.findtext(".//COLLECTION/TYPE") or "Ledger").strip())
+        self._count("imports")
+        vouchers = list(root.iter("VOUCHER"))
+        time.sleep(self.latency + self.per_voucher_latency * len(vouchers))
+        created = altered = errors = 0
+        line_errors = []
+        for ledger in root.iter("LEDGER"):
+            name = ledger.get("NAME") or ledger.findtext("NAME") or ""
+            with self._lock:
+                known = self._company_ledgers(company)
+                if name.lower() in known:
+                    altered += 1
+                else:
+                    known.add(name.lower())
+                    self._counters["ledgers_created"] += 1
+                    created += 1
+        for voucher in vouchers:
+            error = self._check_voucher(company, voucher)
+            if error:
+                errors += 1
+                line_errors.append(error)
+                continue
+            remote_id = voucher.get("REMOTEID") or voucher.get("GUID") or ""
+            with self._lock:
+                seen = self._vouchers.setdefault(company, set())
+                if remote_id and remote_id in seen:
+                    altered += 1
+                    self._counters["vouchers_altered"] += 1
+                else:
+                    seen.add(remote_id)
+                    created += 1
+                    self._counters["vouchers_created"] += 1
+        self._count("voucher_errors", errors)
+        return _response(created, altered, errors, line_errors)
+
+    def _check_voucher(self, company: str, voucher: ET.Element) -> Optional[str]:
+        """Line error Tally would report for this voucher, if any"""
+        with self._lock:
+            known = self._company_ledgers(company)
+            for name in voucher.iter("LEDGERNAME"):
+                if (name.text or "").strip().lower() not in known:
+                    return f"Ledger '{(name.text or '').strip()}' does not exist!"
+        if self.error_rate > 0:
+            remote_id = voucher.get("REMOTEID") or voucher.get("GUID") or ""
+            bucket = int(hashlib.md5(remote_id.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+            if bucket < self.error_rate:
+                return "Voucher totals do not match!"
+        return None
+
+    def _export(self, company: str, collection_type: str) -> str:
+        """Collection export of a company's ledgers or stock items"""
+        tag = collection_type.upper()
+        with self._lock:
+            if collection_type == "Ledger":
+                added = self._masters.get(company, {}).get("Ledger", [])
+                lowered = {name.lower() for name in added}
+                names = sorted(added) + sorted(self._company_ledgers(company) - lowered)
+            else:
+                names = sorted(self._masters.get(company, {}).get(collection_type, []))
+        masters = "".join(f"<{tag} NAME={quoteattr(name)}><NAME>{escape(name)}</NAME></{tag}>"
+                          for name in names)
+        return f"<ENVELOPE><BODY><DATA><COLLECTION>{masters}</COLLECTION></DATA></BODY></ENVELOPE>"
+
+    def _company_ledgers(self, company: str) -> Set[str]:
+        """Lowercased ledger names of a company (call with _lock held)"""
+        if company not in self._ledgers:
+            self._ledgers[company] = {name.lower() for name in DEFAULT_LEDGERS}
+        return self._ledgers[company]
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+
+def _response(created: int = 0, altered: int = 0, errors: int = 0, line_errors=()) -> str:
+    """Import response in Tally's format"""
+    lines = "".join(f"<LINEERROR>{escape(error)}</LINEERROR>" for error in line_errors)
+    return (
+        "<RESPONSE>"
+        f"<CREATED>{created}</CREATED><ALTERED>{altered}</ALTERED><DELETED>0</DELETED>"
+        "<LASTVCHID>0</LASTVCHID><LASTMID>0</LASTMID><COMBINED>0</COMBINED><IGNORED>0</IGNORED>"
+        f"<ERRORS>{errors}</ERRORS><CANCELLED>0</CANCELLED><EXCEPTIONS>0</EXCEPTIONS>"
+        f"{lines}</RESPONSE>"
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        payload = self.server.tally.handle(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        """Request body, with or without chunked transfer encoding"""
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Trailer section ends with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", "0")))
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class FakeTallyServer:
+    """
+    FakeTally served over HTTP on a background thread
+
+    Usage:
+        with FakeTallyServer(latency=0.05) as server:
+            client = TallyClient(server.url)
+    """
+
+    def __init__(self, tally: Optional[FakeTally] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            tally: Fake to serve (default: FakeTally with its defaults)
+            host: Interface to bind
+            port: Port to bind (0 picks a free one)
+        """
+        self.tally = tally or FakeTally()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.tally = self.tally
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTallyServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-tally", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "FakeTallyServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
@@ -0,0 +1,129 @@
+"""
+Synthetic Invoice Generator
+Renders invoice-like images with known line items, optionally degraded to
+look like skewed, unevenly lit phone photos
+"""
+import io
+import random
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# Fonts tried in order; PIL's built-in bitmap font is the fallback
+_FONT_CANDIDATES = (
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+)
+
+_PRODUCTS = (
+    "Basmati Rice 5kg", "Sunflower Oil 1L", "Toor Dal 1kg", "Sugar 1kg", "Tea Powder 500g",
+    "Wheat Flour 10kg", "Detergent 2kg", "Bath Soap 125g", "Biscuits Family Pack",
+    "Masala Mix 100g", "Ghee 500ml", "Paneer 200g", "Milk Powder 1kg", "Salt 1kg",
+)
+
+_SELLER = "Fresh Mart Wholesale Traders"
+
+
+def _font(size: int):
+    for candidate in _FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def line_items(count: int, rng: random.Random) -> List[List[str]]:
+    """Random line items as [name, qty, um, net_price, net_worth, vat, gross]"""
+    items = []
+    for _ in range(count):
+        qty = rng.randint(1, 20)
+        price = rng.randint(1000, 250000) / 100
+        worth = round(qty * price, 2)
+        vat = round(worth * 0.1, 2)
+        items.append([rng.choice(_PRODUCTS), str(qty), "each", f"{price:.2f}",
+                      f"{worth:.2f}", f"{vat:.2f}", f"{worth + vat:.2f}"])
+    return items
+
+
+def render_invoice(items: List[List[str]], width: int = 1240, invoice_no: str = "1001"
+                   ) -> Tuple[Image.Image, str]:
+    """
+    Render a clean invoice page (A4 at 150 DPI by default)
+
+    Returns:
+        Tuple of (RGB image, the text printed on it, one line per row)
+    """
+    height = int(width * 1.414)
+    scale = width / 1240
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    title_font = _font(int(40 * scale))
+    font = _font(int(22 * scale))
+
+    y = int(60 * scale)
+    draw.text((int(60 * scale), y), f"INVOICE No. {invoice_no}", fill="black", font=title_font)
+    y += int(70 * scale)
+    draw.text((int(60 * scale), y), _SELLER, fill="black", font=font)
+    y += int(80 * scale)
+
+    columns = [60, 110, 520, 600, 690, 840, 1000, 1110]
+    headers = ["No.", "Description", "Qty", "UM", "Net price", "Net worth", "VAT", "Gross"]
+    row_height = int(40 * scale)
+    left, right = int(50 * scale), width - int(50 * scale)
+    draw.line([(left, y - 8), (right, y - 8)], fill="black", width=2)
+    for x, header in zip(columns, headers):
+        draw.text((int(x * scale), y), header, fill="black", font=font)
+    y += row_height
+    draw.line([(left, y - 8), (right, y - 8)], fill="black", width=2)
+    for idx, item in enumerate(items, start=1):
+        cells = [str(idx)] + item
+        for x, cell in zip(columns, cells):
+            draw.text((int(x * scale), y), cell, fill="black", font=font)
+        y += row_height
+        draw.line([(left, y - 8), (right, y - 8)], fill="black", width=1)
+    return image, invoice_text(items, invoice_no)
+
+
+def invoice_text(items: List[List[str]], invoice_no: str = "1001") -> str:
+    """The text render_invoice prints, one line per row (what a perfect OCR would return)"""
+    lines = [f"INVOICE No. {invoice_no}", _SELLER,
+             "No. Description Qty UM Net price Net worth VAT Gross"]
+    for idx, item in enumerate(items, start=1):
+        lines.append(" ".join([str(idx)] + item))
+    return "\n".join(lines)
+
+
+def degrade(image: Image.Image, rng: random.Random, target_size: Tuple[int, int] = (3024, 4032),
+            skew_degrees: float = 2.5, noise: float = 6.0) -> Image.Image:
+    """Upscale to phone-photo size, rotate slightly and add lighting gradient and noise"""
+    image = image.resize(target_size, Image.BICUBIC)
+    image = image.rotate(rng.uniform(-skew_degrees, skew_degrees), resample=Image.BICUBIC,
+                         expand=False, fillcolor=(235, 235, 230))
+    image = image.filter(ImageFilter.GaussianBlur(radius=1.2))
+    array = np.asarray(image).astype(np.float32)
+    gradient = np.linspace(0.75, 1.0, array.shape[1], dtype=np.float32)[None, :, None]
+    array = array * gradient + np.random.default_rng(rng.randint(0, 2**31)).normal(0, noise, array.shape)
+    return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+
+
+def synthetic_invoice(item_count: int = 8, seed: Optional[int] = None, phone_photo: bool = True,
+                      image_format: str = "JPEG") -> Tuple[bytes, str, List[List[str]]]:
+    """
+    Generate one encoded invoice image
+
+    Returns:
+        Tuple of (encoded image bytes, ground-truth text, line items)
+    """
+    rng = random.Random(seed)
+    items = line_items(item_count, rng)
+    image, text = render_invoice(items, invoice_no=str(rng.randint(1000, 9999)))
+    if phone_photo:
+        image = degrade(image, rng)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue(), text, items
@@ -0,0 +1,192 @@
+"""
+Document Pages Module
+Lazy page iteration for multi-page TIFF/GIF and PDF invoices, and
+parallel per-page OCR with at most a few pages in memory at once
+"""
+import io
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import BinaryIO, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+# Resolution PDF pages are rasterized at
+PDF_RENDER_DPI = int(os.environ.get("PDF_RENDER_DPI", "300"))
+
+# Separator placed between the OCR text of consecutive pages
+PAGE_SEPARATOR = "\n\n--- Page {number} ---\n"
+
+
+def is_pdf(data: bytes) -> bool:
+    """Whether the bytes are a PDF document"""
+    return data[:1024].lstrip().startswith(b"%PDF")
+
+
+def open_buffer(data) -> BinaryIO:
+    """
+    Seekable stream over encoded document data
+
+    Bytes are wrapped in a BytesIO, which shares them; any other buffer
+    (e.g. an mmap of a spooled upload) is read in place, chunk by chunk,
+    instead of being copied into memory first.
+    """
+    if isinstance(data, bytes):
+        return BytesIO(data)
+    return io.BufferedReader(_BufferReader(data), buffer_size=256 * 1024)
+
+
+def page_count(data: bytes) -> int:
+    """Number of pages without rasterizing any of them"""
+    if is_pdf(data):
+        pdfium = _pdfium()
+        pdf = pdfium.PdfDocument(open_buffer(data))
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    with Image.open(open_buffer(data)) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def page_geometry(data: bytes, dpi: int = PDF_RENDER_DPI) -> Tuple[int, int, int, int]:
+    """
+    Size of the document once decoded, read from its headers only
+
+    Returns:
+        Tuple of (width, height, bands) of the first page as it will be
+        decoded, and the page count
+
+    Raises:
+        PIL.UnidentifiedImageError: If the data is neither an image nor a PDF
+    """
+    if is_pdf(data):
+        pdfium = _pdfium()
+        pdf = pdfium.PdfDocument(open_buffer(data))
+        try:
+            width, height = pdf[0].get_size() if len(pdf) else (0, 0)
+            # Pages are rendered to 4-byte BGRA/BGRX bitmaps
+            return round(width * dpi / 72), round(height * dpi / 72), 4, len(pdf)
+        finally:
+            pdf.close()
+    with Image.open(open_buffer(data)) as image:
+        return image.width, image.height, len(image.getbands()), getattr(image, "n_frames", 1)
+
+
+def iter_pages(data: bytes, dpi: int = PDF_RENDER_DPI) -> Iterator[Image.Image]:
+    """
+    Yield the pages of an image or PDF one at a time
+
+    Only the page being yielded is decoded, so memory does not grow with
+    the page count.
+
+    Args:
+        data: Encoded image, multi-frame TIFF/GIF, or PDF
+        dpi: Rasterization resolution for PDF pages
+    """
+    if is_pdf(data):
+        pdfium = _pdfium()
+        pdf = pdfium.PdfDocument(open_buffer(data))
+        try:
+            for index in range(len(pdf)):
+                page = pdf[index]
+                try:
+                    bitmap = page.render(scale=dpi / 72)
+                    yield bitmap.to_pil()
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+        return
+
+    with Image.open(open_buffer(data)) as image:
+        for index in range(getattr(image, "n_frames", 1)):
+            image.seek(index)
+            # Copy so the page outlives the next seek()
+            yield image.copy()
+
+
+def ocr_pages(data: bytes, ocr_page: Callable[[Image.Image], Optional[str]],
+              max_workers: int = 4) -> Optional[str]:
+    """
+    OCR every page in parallel and merge the text in page order
+
+    Pages are decoded on the calling thread and handed to a pool of
+    max_workers; no more than max_workers pages are decoded but not yet
+    OCR'd at any time.
+
+    Args:
+        data: Encoded multi-page document
+        ocr_page: Returns the text of one page, or None if it has none
+        max_workers: Pages OCR'd concurrently
+
+    Returns:
+        Merged text with page separators, or None if no page had text
+    """
+    texts: Dict[int, str] = {}
+    in_flight: Deque[Tuple[int, Future]] = deque()
+
+    def collect_oldest() -> None:
+        number, future = in_flight.popleft()
+        text = future.result()
+        if text and text.strip():
+            texts[number] = text
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for number, page in enumerate(iter_pages(data), start=1):
+            if len(in_flight) >= max_workers:
+                collect_oldest()
+            in_flight.append((number, executor.submit(ocr_page, page)))
+            # Drop our reference so the page is freed once OCR'd
+            del page
+        while in_flight:
+            collect_oldest()
+
+    if not texts:
+        return None
+    return "".join(PAGE_SEPARATOR.format(number=number) + texts[number]
+                   for number in sorted(texts)).lstrip()
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Read-only raw stream over a buffer
+
+    Reads copy only the requested chunk, and no memoryview of the buffer
+    is kept, so an mmap can be closed while a reader is still referenced.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._size = len(buffer)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        count = max(0, min(len(target), self._size - self._position))
+        target[:count] = self._buffer[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def _pdfium():
+    """Import pypdfium2, which is only needed for PDF input"""
+    try:
+        import pypdfium2
+    except ImportError as e:
+        raise ValueError(f"PDF support requires the pypdfium2 package: {str(e)}")
+    return pypdfium2
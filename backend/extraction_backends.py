@@ -0,0 +1,240 @@
+"""
+Extraction Backends Module
+Interchangeable ways of turning an invoice image into '|' separated line
+items, selected by name with optional fallback
+"""
+import hashlib
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Type
+
+logger = logging.getLogger("ai-tally-agent.extraction_backends")
+
+# Default model for the Gemini based backends
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+
+
+class ExtractionResult:
+    """Output of one backend run"""
+
+    def __init__(self, backend: str, text: Optional[str] = None, error: Optional[str] = None,
+                 timings: Optional[Dict[str, float]] = None):
+        """
+        Initialize result
+
+        Args:
+            backend: Name of the backend that produced the result
+            text: '\\n' / '|' separated line items, or None on failure
+            error: Failure reason when text is None
+            timings: Seconds spent per stage (e.g. "ocr", "llm")
+        """
+        self.backend = backend
+        self.text = text
+        self.error = error
+        self.timings = timings or {}
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.text and self.text.strip())
+
+
+class ExtractionBackend:
+    """Base class for extraction backends"""
+
+    name = "base"
+    # Backends producing synthetic data, kept out of per-request selection
+    test_only = False
+
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self.model = model
+
+    def extract(self, image_bytes: bytes, prompt: str,
+                stage_callback: Optional[Callable[[str, str], None]] = None) -> ExtractionResult:
+        """
+        Extract line items from raw image bytes
+
+        Args:
+            image_bytes: Encoded image (bytes, or a buffer such as an mmap of the upload)
+            prompt: Line-item prompt for the LLM
+            stage_callback: Called as stage_callback(stage, state) for the
+                "ocr" and "llm" stages (optional)
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _report(stage_callback: Optional[Callable[[str, str], None]], stage: str, state: str) -> None:
+        if stage_callback:
+            stage_callback(stage, state)
+
+
+class TesseractLLMBackend(ExtractionBackend):
+    """Local Tesseract OCR, then Gemini on the OCR text"""
+
+    name = "tesseract_llm"
+
+    def extract(self, image_bytes, prompt, stage_callback=None):
+        import OCR_AI
+
+        timings = {}
+        self._report(stage_callback, "ocr", "running")
+        start = time.perf_counter()
+        try:
+            text = OCR_AI.extract_text(image_bytes)
+        except Exception as e:
+            logger.warning("OCR failed: %s", e)
+            text = None
+        timings["ocr"] = time.perf_counter() - start
+        if text is None:
+            self._report(stage_callback, "ocr", "failed")
+            return ExtractionResult(self.name, error="OCR returned no data", timings=timings)
+        self._report(stage_callback, "ocr", "done")
+        return self.extract_from_text(text, prompt, stage_callback, timings)
+
+    def extract_from_text(self, text: str, prompt: str,
+                          stage_callback: Optional[Callable[[str, str], None]] = None,
+                          timings: Optional[Dict[str, float]] = None) -> ExtractionResult:
+        """LLM stage only, for callers that ran OCR themselves"""
+        import OCR_AI
+
+        timings = dict(timings or {})
+        self._report(stage_callback, "llm", "running")
+        start = time.perf_counter()
+        response = OCR_AI.process_with_gemini(text, system_prompt=prompt, useModel=self.model)
+        timings["llm"] = time.perf_counter() - start
+        if response is None or not response.strip():
+            self._report(stage_callback, "llm", "failed")
+            return ExtractionResult(self.name, error="AI returned no data", timings=timings)
+        self._report(stage_callback, "llm", "done")
+        return ExtractionResult(self.name, text=response, timings=timings)
+
+
+class MultimodalLLMBackend(ExtractionBackend):
+    """Send the image straight to Gemini, without local OCR"""
+
+    name = "multimodal"
+
+    def extract(self, image_bytes, prompt, stage_callback=None):
+        import OCR_AI
+
+        self._report(stage_callback, "ocr", "skipped")
+        self._report(stage_callback, "llm", "running")
+        start = time.perf_counter()
+        response = OCR_AI.process_image_with_gemini(image_bytes, system_prompt=prompt, useModel=self.model)
+        timings = {"llm": time.perf_counter() - start}
+        if response is None or not response.strip():
+            self._report(stage_callback, "llm", "failed")
+            return ExtractionResult(self.name, error="AI returned no data", timings=timings)
+        self._report(stage_callback, "llm", "done")
+        return ExtractionResult(self.name, text=response, timings=timings)
+
+
+class StubBackend(ExtractionBackend):
+    """
+    Deterministic local backend for tests; calls no external service.
+
+    UTF-8 input that already contains '|' separated rows is returned as is;
+    any other input yields a few synthetic rows seeded from its hash.
+    """
+
+    name = "stub"
+    test_only = True
+
+    def extract(self, image_bytes, prompt, stage_callback=None):
+        self._report(stage_callback, "ocr", "skipped")
+        self._report(stage_callback, "llm", "running")
+        start = time.perf_counter()
+        try:
+            text = str(image_bytes, "utf-8")
+        except UnicodeDecodeError:
+            text = ""
+        if "|" not in text:
+            rng = random.Random(hashlib.sha256(image_bytes).hexdigest())
+            rows = []
+            for i in range(rng.randint(1, 5)):
+                qty = rng.randint(1, 10)
+                price = rng.randint(100, 10000) / 100
+                worth = round(qty * price, 2)
+                vat = round(worth * 0.1, 2)
+                rows.append(f"Stub item {i + 1}|{qty}|each|{price:.2f}|{worth:.2f}|{vat:.2f}|{worth + vat:.2f}")
+            text = "\n".join(rows)
+        self._report(stage_callback, "llm", "done")
+        return ExtractionResult(self.name, text=text, timings={"llm": time.perf_counter() - start})
+
+
+BACKENDS: Dict[str, Type[ExtractionBackend]] = {
+    TesseractLLMBackend.name: TesseractLLMBackend,
+    MultimodalLLMBackend.name: MultimodalLLMBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def register_backend(backend_class: Type[ExtractionBackend]) -> None:
+    """Make a backend selectable by its name"""
+    BACKENDS[backend_class.name] = backend_class
+
+
+def request_selectable(name: str) -> bool:
+    """
+    Whether a request may choose this backend (?backend=...)
+
+    Test-only backends are selectable only with EXTRACTION_TEST_BACKENDS
+    on; EXTRACTION_BACKEND / EXTRACTION_FALLBACK may still name them.
+    """
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        return False
+    if backend_class.test_only:
+        return os.environ.get("EXTRACTION_TEST_BACKENDS", "false").lower() in ("1", "true", "yes")
+    return True
+
+
+def get_backend(name: str, model: Optional[str] = None) -> ExtractionBackend:
+    """
+    Instantiate a backend by name
+
+    Raises:
+        ValueError: If no backend has that name
+    """
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown extraction backend '{name}'. Available: {', '.join(sorted(BACKENDS))}")
+    return backend_class(model or os.environ.get("EXTRACTION_MODEL", DEFAULT_MODEL))
+
+
+def configured_backends() -> List[str]:
+    """Backend chain from EXTRACTION_BACKEND plus the EXTRACTION_FALLBACK list"""
+    chain = [os.environ.get("EXTRACTION_BACKEND", TesseractLLMBackend.name)]
+    for name in os.environ.get("EXTRACTION_FALLBACK", "").split(","):
+        name = name.strip()
+        if name and name not in chain:
+            chain.append(name)
+    return chain
+
+
+def extract_with_fallback(image_bytes: bytes, prompt: str, chain: List[str],
+                          stage_callback: Optional[Callable[[str, str], None]] = None,
+                          model: Optional[str] = None) -> ExtractionResult:
+    """
+    Try each backend in order until one returns line items
+
+    Returns:
+        The first successful result, or the last failure (its timings
+        include every attempted backend, prefixed with the backend name)
+    """
+    timings: Dict[str, float] = {}
+    result = ExtractionResult(chain[0] if chain else "none", error="No extraction backend configured")
+    for name in chain:
+        try:
+            backend = get_backend(name, model)
+            result = backend.extract(image_bytes, prompt, stage_callback)
+        except Exception as e:
+            result = ExtractionResult(name, error=f"{name} backend failed: {str(e)}")
+        timings.update({f"{name}.{stage}": seconds for stage, seconds in result.timings.items()})
+        if result.ok:
+            break
+        logger.warning("Extraction backend '%s' failed: %s", name, result.error)
+    result.timings = timings
+    return result
@@ -0,0 +1,289 @@
+"""
+Extraction Cache Module
+Content-addressed cache for OCR text and Gemini extraction results, with an
+in-memory LRU tier in front of an on-disk SQLite tier
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("ai-tally-agent.extraction_cache")
+
+# Cache namespaces
+OCR = "ocr"
+LLM = "llm"
+
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest of bytes or text"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def ocr_key(image_bytes: bytes, variant: str = "") -> str:
+    """Cache key for OCR of image bytes under a preprocessing variant"""
+    if not variant:
+        return content_hash(image_bytes)
+    return content_hash("\0".join((content_hash(image_bytes), variant)))
+
+
+def llm_key(text: str, prompt: str, model: str) -> str:
+    """Cache key for an LLM extraction of OCR text with a given prompt and model"""
+    return content_hash("\0".join((content_hash(text), content_hash(prompt), model)))
+
+
+class MemoryTier:
+    """Thread-safe LRU of string values bounded by entry count and total size"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                self._remove((namespace, key))
+                return None
+            self._entries.move_to_end((namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value: str, stored_at: Optional[float] = None) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove((namespace, key))
+            self._entries[(namespace, key)] = (value, stored_at or time.time())
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, entry_key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+
+class SQLiteTier:
+    """On-disk cache tier bounded by total value size and TTL"""
+
+    # Run size/TTL eviction every this many writes
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        conn.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ttl_seconds:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            conn.commit()
+            return None
+        conn.execute(
+            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            (now, namespace, key)
+        )
+        conn.commit()
+        return row[0], row[1]
+
+    def set(self, namespace: str, key: str, value: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, size, created_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, value, len(value), now, now)
+        )
+        conn.commit()
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            freed = 0
+            doomed = []
+            for namespace, key, size in conn.execute(
+                    "SELECT namespace, key, size FROM cache ORDER BY accessed_at"):
+                doomed.append((namespace, key))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", doomed)
+        conn.commit()
+
+    def clear(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connection for the current thread (re-opened after fork)"""
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+
+class ExtractionCache:
+    """
+    Two-level cache for extraction results.
+
+    Lookups try the memory tier first, then SQLite (promoting hits to
+    memory). Hit and miss counters are kept per namespace and tier.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, memory_max_entries: int = 1024,
+                 memory_max_bytes: int = 64 * 1024 * 1024,
+                 disk_max_bytes: int = 512 * 1024 * 1024,
+                 ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Initialize cache
+
+        Args:
+            db_path: SQLite file for the disk tier (None disables the disk tier)
+            memory_max_entries: Maximum entries in the memory tier
+            memory_max_bytes: Maximum total value size in the memory tier
+            disk_max_bytes: Maximum total value size in the disk tier
+            ttl_seconds: Entry lifetime in both tiers
+        """
+        self.memory = MemoryTier(memory_max_entries, memory_max_bytes, ttl_seconds)
+        self.disk = SQLiteTier(db_path, disk_max_bytes, ttl_seconds) if db_path else None
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """Return the cached value, or None on a miss"""
+        value = self.memory.get(namespace, key)
+        if value is not None:
+            self._count(namespace, "memory_hits")
+            return value
+        if self.disk is not None:
+            try:
+                row = self.disk.get(namespace, key)
+            except sqlite3.Error as e:
+                logger.warning("Extraction cache read failed: %s", e)
+                row = None
+            if row is not None:
+                self._count(namespace, "disk_hits")
+                self.memory.set(namespace, key, row[0], stored_at=row[1])
+                return row[0]
+        self._count(namespace, "misses")
+        return None
+
+    def set(self, namespace: str, key: str, value: str) -> None:
+        """Store a value in both tiers"""
+        self.memory.set(namespace, key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(namespace, key, value)
+            except sqlite3.Error as e:
+                logger.warning("Extraction cache write failed: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters, keyed like 'ocr.memory_hits'"""
+        with self._lock:
+            return dict(self._counters)
+
+    def clear(self) -> None:
+        """Drop all cached entries and reset counters"""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+        with self._lock:
+            self._counters.clear()
+
+    def _count(self, namespace: str, counter: str) -> None:
+        name = f"{namespace}.{counter}"
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ExtractionCache]:
+    """
+    Process-wide cache configured from the environment, or None if disabled.
+
+    EXTRACTION_CACHE_ENABLED, EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_TTL_SECONDS,
+    EXTRACTION_CACHE_MEMORY_ENTRIES, EXTRACTION_CACHE_MEMORY_MB and
+    EXTRACTION_CACHE_DISK_MB control it.
+    """
+    global _cache
+    if os.environ.get("EXTRACTION_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = os.environ.get(
+                    "EXTRACTION_CACHE_PATH",
+                    os.path.join(tempfile.gettempdir(), "tallyai_extraction_cache.sqlite3")
+                )
+                try:
+                    _cache = ExtractionCache(
+                        db_path=path or None,
+                        memory_max_entries=int(os.environ.get("EXTRACTION_CACHE_MEMORY_ENTRIES", "1024")),
+                        memory_max_bytes=int(os.environ.get("EXTRACTION_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+                        disk_max_bytes=int(os.environ.get("EXTRACTION_CACHE_DISK_MB", "512")) * 1024 * 1024,
+                        ttl_seconds=float(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning("Extraction cache disk tier unavailable, using memory only: %s", e)
+                    _cache = ExtractionCache(db_path=None)
+    return _cache
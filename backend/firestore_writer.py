@@ -0,0 +1,244 @@
+"""
+Firestore Writer Module
+Background writer that buffers document writes and commits them to
+Firestore in WriteBatches, off the request path
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ai-tally-agent.firestore_writer")
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_OPS = 500
+
+# Longest a partly gathered batch, or an idle writer, waits before
+# noticing flush() or close()
+_WAKE_INTERVAL = 0.05
+_IDLE_WAKE_INTERVAL = 0.2
+
+# (collection path, document id, data, merge)
+Write = Tuple[str, str, dict, bool]
+
+
+class WriterBusy(Exception):
+    """Raised when the write buffer stays full for longer than the put timeout"""
+
+
+class FirestoreWriter:
+    """
+    Buffered, batched Firestore writer
+
+    set() only queues the write. A background thread commits queued
+    writes as one WriteBatch once batch_size writes are waiting or
+    flush_interval seconds after the first of them. The buffer holds at
+    most max_buffered writes; set() waits up to put_timeout for room and
+    then raises WriterBusy. A failed batch is retried with backoff up to
+    max_retries times and then dropped (counted as failed).
+    """
+
+    def __init__(self, client_getter: Callable[[], object], batch_size: int = MAX_BATCH_OPS,
+                 flush_interval: float = 1.0, max_buffered: int = 10000,
+                 max_retries: int = 5, backoff_base: float = 0.5, put_timeout: float = 5.0):
+        """
+        Initialize writer (the background thread starts on the first write)
+
+        Args:
+            client_getter: Returns the Firestore client, or an in-process
+                fake with collection(path).document(id) and batch()
+            batch_size: Writes per WriteBatch (at most 500)
+            flush_interval: Longest time a write waits to be committed
+            max_buffered: Writes queued before set() blocks
+            max_retries: Retries of a failed batch commit
+            backoff_base: Base delay for exponential backoff with jitter
+            put_timeout: Longest time set() waits for buffer room
+        """
+        self.client_getter = client_getter
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_OPS))
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue[Write]" = queue.Queue(maxsize=max_buffered)
+        self._flush_now = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._enqueued = 0
+        self._finished = 0
+        self._counters = {"written": 0, "failed": 0, "batches": 0, "retries": 0, "rejected": 0}
+
+    def set(self, collection: str, doc_id: str, data: dict, merge: bool = False,
+            timeout: Optional[float] = None) -> None:
+        """
+        Queue a document write
+
+        Args:
+            collection: Collection path, e.g. "invoices" or "invoices/<id>/lineItems"
+            doc_id: Document id
+            data: Document fields
+            merge: Merge into an existing document instead of replacing it
+            timeout: Longest wait for buffer room (default: put_timeout)
+
+        Raises:
+            WriterBusy: If the buffer stayed full
+            RuntimeError: If the writer is closed
+        """
+        if self._stopping:
+            raise RuntimeError("Firestore writer is closed")
+        self._start()
+        with self._lock:
+            self._enqueued += 1
+        try:
+            self._queue.put((collection, doc_id, data, merge),
+                            timeout=self.put_timeout if timeout is None else timeout)
+        except queue.Full:
+            with self._lock:
+                self._enqueued -= 1
+                self._counters["rejected"] += 1
+            raise WriterBusy("Firestore write buffer is full")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Commit everything queued so far
+
+        Returns:
+            False if timeout expired first
+        """
+        with self._lock:
+            target = self._enqueued
+        self._flush_now.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._done:
+            while self._finished < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 30.0) -> bool:
+        """Flush outstanding writes and stop the background thread"""
+        self._stopping = True
+        flushed = self.flush(timeout) if self._thread is not None else True
+        self._flush_now.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        return flushed
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {"buffered": self._queue.qsize(), **self._counters}
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """Writer loop: gather a batch, commit it, repeat"""
+        while True:
+            batch = self._gather()
+            if batch:
+                self._commit(batch)
+            elif self._stopping:
+                return
+
+    def _gather(self) -> List[Write]:
+        """Wait for writes, then collect up to batch_size or until flush_interval passes"""
+        try:
+            first = self._queue.get(timeout=_IDLE_WAKE_INTERVAL)
+        except queue.Empty:
+            self._flush_now.clear()
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._flush_now.is_set() or self._stopping:
+                break
+            # Wait in short slices so flush() and close() are noticed
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, _WAKE_INTERVAL)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _commit(self, writes: List[Write]) -> None:
+        """Commit one WriteBatch, retrying with backoff"""
+        attempt = 0
+        while True:
+            try:
+                client = self.client_getter()
+                batch = client.batch()
+                for collection, doc_id, data, merge in writes:
+                    batch.set(client.collection(collection).document(doc_id), data, merge=merge)
+                batch.commit()
+                self._count("batches")
+                self._count("written", len(writes))
+                break
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error("Dropping %d Firestore write(s) after %d attempts: %s", len(writes), attempt + 1, e)
+                    self._count("failed", len(writes))
+                    break
+                self._count("retries")
+                time.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+        with self._done:
+            self._finished += len(writes)
+            self._done.notify_all()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+
+_writer: Optional[FirestoreWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(client_getter: Callable[[], object]) -> FirestoreWriter:
+    """
+    Process-wide writer configured from FIRESTORE_WRITER_BATCH_SIZE,
+    FIRESTORE_WRITER_FLUSH_INTERVAL, FIRESTORE_WRITER_MAX_BUFFERED,
+    FIRESTORE_WRITER_MAX_RETRIES and FIRESTORE_WRITER_PUT_TIMEOUT, flushed
+    at interpreter exit
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = FirestoreWriter(
+                    client_getter,
+                    batch_size=int(os.environ.get("FIRESTORE_WRITER_BATCH_SIZE", str(MAX_BATCH_OPS))),
+                    flush_interval=float(os.environ.get("FIRESTORE_WRITER_FLUSH_INTERVAL", "1.0")),
+                    max_buffered=int(os.environ.get("FIRESTORE_WRITER_MAX_BUFFERED", "10000")),
+                    max_retries=int(os.environ.get("FIRESTORE_WRITER_MAX_RETRIES", "5")),
+                    put_timeout=float(os.environ.get("FIRESTORE_WRITER_PUT_TIMEOUT", "5.0")),
+                )
+                atexit.register(close)
+    return _writer
+
+
+def metrics() -> Dict[str, int]:
+    """Counters of the process-wide writer, empty if it was never created"""
+    return _writer.metrics() if _writer is not None else {}
+
+
+def close(timeout: float = 30.0) -> None:
+    """Flush and stop the process-wide writer, if one was created"""
+    if _writer is not None:
+        _writer.close(timeout)
@@ -0,0 +1,20 @@
+"""
+Gunicorn Configuration
+Loaded automatically from the working directory; once a worker has loaded
+the app (the listening socket is already bound), heavy services are
+prewarmed in the background so the first requests do not pay for them,
+buffered Firestore writes are flushed and the Tally outbox dispatcher is
+stopped when a worker exits
+"""
+
+
+def post_worker_init(worker):
+    import services
+    services.prewarm_from_env()
+
+
+def worker_exit(server, worker):
+    import firestore_writer
+    import tally_outbox
+    firestore_writer.close()
+    tally_outbox.close()
@@ -0,0 +1,217 @@
+"""
+Image Preprocessing Module
+NumPy/OpenCV steps that prepare invoice photos for Tesseract: grayscale,
+downscale to a target DPI, deskew, adaptive binarization and optional
+cropping to the detected table region
+"""
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class PreprocessConfig:
+    """Which preprocessing steps run, and their parameters"""
+
+    def __init__(self, enabled: bool = True, grayscale: bool = True, downscale: bool = True,
+                 deskew: bool = True, binarize: bool = True, crop_table: bool = False,
+                 target_dpi: int = 300, page_width_inches: float = 8.27,
+                 max_deskew_angle: float = 15.0, block_size: int = 31, threshold_c: int = 15):
+        """
+        Initialize preprocessing config
+
+        Args:
+            enabled: Run preprocessing at all
+            grayscale: Convert to a single channel
+            downscale: Shrink images larger than target_dpi
+            deskew: Rotate text lines to horizontal
+            binarize: Apply adaptive (local mean) thresholding
+            crop_table: Crop to the bounding box of detected table rules
+            target_dpi: Resolution Tesseract should see
+            page_width_inches: Assumed page width, used to size images whose
+                DPI information is missing or implausible (default: A4)
+            max_deskew_angle: Larger detected angles are ignored as misdetections
+            block_size: Neighbourhood size in pixels for adaptive thresholding (odd)
+            threshold_c: Constant subtracted from the local mean when thresholding
+        """
+        self.enabled = enabled
+        self.grayscale = grayscale
+        self.downscale = downscale
+        self.deskew = deskew
+        self.binarize = binarize
+        self.crop_table = crop_table
+        self.target_dpi = target_dpi
+        self.page_width_inches = page_width_inches
+        self.max_deskew_angle = max_deskew_angle
+        self.block_size = block_size | 1
+        self.threshold_c = threshold_c
+
+    @classmethod
+    def from_env(cls) -> "PreprocessConfig":
+        """Build config from OCR_PREPROCESS_* environment variables"""
+        def flag(name: str, default: str) -> bool:
+            return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+        return cls(
+            enabled=flag("OCR_PREPROCESS", "true"),
+            grayscale=flag("OCR_PREPROCESS_GRAYSCALE", "true"),
+            downscale=flag("OCR_PREPROCESS_DOWNSCALE", "true"),
+            deskew=flag("OCR_PREPROCESS_DESKEW", "true"),
+            binarize=flag("OCR_PREPROCESS_BINARIZE", "true"),
+            crop_table=flag("OCR_PREPROCESS_CROP_TABLE", "false"),
+            target_dpi=int(os.environ.get("OCR_PREPROCESS_TARGET_DPI", "300")),
+        )
+
+    def cache_tag(self) -> str:
+        """Short string identifying the settings that change OCR output"""
+        if not self.enabled:
+            return "raw"
+        return (f"g{int(self.grayscale)}d{int(self.downscale)}s{int(self.deskew)}"
+                f"b{int(self.binarize)}c{int(self.crop_table)}-{self.target_dpi}"
+                f"-{self.page_width_inches}-{self.block_size}-{self.threshold_c}")
+
+
+def preprocess(image: Image.Image, config: Optional[PreprocessConfig] = None
+               ) -> Tuple[np.ndarray, Dict[str, float]]:
+    """
+    Run the enabled preprocessing steps on a decoded image
+
+    Args:
+        image: Decoded PIL image
+        config: Steps to run (default: PreprocessConfig.from_env())
+
+    Returns:
+        Tuple of (image array for Tesseract, seconds spent per step)
+    """
+    config = config or PreprocessConfig.from_env()
+    timings: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    dpi = image.info.get("dpi")
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    array = np.asarray(image)
+    timings["decode"] = time.perf_counter() - start
+
+    if not config.enabled:
+        return array, timings
+
+    if config.grayscale and array.ndim == 3:
+        start = time.perf_counter()
+        array = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+        timings["grayscale"] = time.perf_counter() - start
+
+    if config.downscale:
+        start = time.perf_counter()
+        array = downscale_to_dpi(array, config, dpi[0] if dpi else None)
+        timings["downscale"] = time.perf_counter() - start
+
+    if config.deskew:
+        start = time.perf_counter()
+        array = deskew(array, config.max_deskew_angle)
+        timings["deskew"] = time.perf_counter() - start
+
+    if config.crop_table:
+        start = time.perf_counter()
+        array = crop_to_table(array)
+        timings["crop_table"] = time.perf_counter() - start
+
+    if config.binarize:
+        start = time.perf_counter()
+        array = binarize(array, config.block_size, config.threshold_c)
+        timings["binarize"] = time.perf_counter() - start
+
+    return array, timings
+
+
+def downscale_to_dpi(array: np.ndarray, config: PreprocessConfig,
+                     source_dpi: Optional[float] = None) -> np.ndarray:
+    """
+    Shrink the image so it is no larger than config.target_dpi
+
+    The stored DPI is not trusted on its own: phone cameras write the
+    JFIF default of 72 dpi into 12-megapixel photos. The image is sized as
+    if it spanned page_width_inches, and a stored DPI can only shrink it
+    further.
+    """
+    height, width = array.shape[:2]
+    scale = (config.target_dpi * config.page_width_inches) / float(width)
+    if source_dpi:
+        scale = min(scale, config.target_dpi / float(source_dpi))
+    if scale >= 1:
+        return array
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+
+def _gray(array: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(array, cv2.COLOR_RGB2GRAY) if array.ndim == 3 else array
+
+
+def deskew(array: np.ndarray, max_angle: float = 15.0) -> np.ndarray:
+    """Rotate the image so the dominant text direction is horizontal"""
+    gray = _gray(array)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    # Merge characters into line blobs so the angle follows text lines
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(15, gray.shape[1] // 60), 3))
+    lines = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles = []
+    weights = []
+    for contour in contours:
+        (_, _), (w, h), angle = cv2.minAreaRect(contour)
+        if w < h:
+            w, h = h, w
+            angle -= 90
+        if w < gray.shape[1] * 0.05 or w < 3 * h:
+            continue
+        # OpenCV versions disagree on the range minAreaRect reports
+        # ([-90, 0) or (0, 90]); a line's angle is only defined modulo 90
+        # here, so fold it into (-45, 45]
+        angle %= 90
+        if angle > 45:
+            angle -= 90
+        angles.append(angle)
+        weights.append(w)
+    if not angles:
+        return array
+    angle = float(np.average(angles, weights=weights))
+    if abs(angle) < 0.3 or abs(angle) > max_angle:
+        return array
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    border = (255, 255, 255) if array.ndim == 3 else 255
+    return cv2.warpAffine(array, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+def binarize(array: np.ndarray, block_size: int = 31, threshold_c: int = 15) -> np.ndarray:
+    """Adaptive threshold to black text on white, robust to uneven lighting"""
+    return cv2.adaptiveThreshold(_gray(array), 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                 cv2.THRESH_BINARY, block_size, threshold_c)
+
+
+def crop_to_table(array: np.ndarray, min_area_ratio: float = 0.1,
+                  margin: int = 10) -> np.ndarray:
+    """Crop to the bounding box of horizontal/vertical rules, if a table is found"""
+    gray = _gray(array)
+    height, width = gray.shape
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY_INV, 15, 10)
+    horizontal = cv2.morphologyEx(
+        ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, width // 15), 1))
+    )
+    vertical = cv2.morphologyEx(
+        ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(10, height // 15)))
+    )
+    ys, xs = np.nonzero(horizontal | vertical)
+    if len(xs) == 0:
+        return array
+    x0, x1 = max(0, xs.min() - margin), min(width, xs.max() + margin)
+    y0, y1 = max(0, ys.min() - margin), min(height, ys.max() + margin)
+    if (x1 - x0) * (y1 - y0) < min_area_ratio * width * height:
+        return array
+    return array[y0:y1, x0:x1]
@@ -0,0 +1,302 @@
+"""
+Instrumentation Module
+Timing spans and counters per pipeline stage, exported as Prometheus
+histograms and written to structured logs with the current request id
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Latency buckets in seconds, from a cache hit to a slow Gemini call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+span_logger = logging.getLogger("ai-tally-agent.spans")
+
+_request_id: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("request_id", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id() -> Optional[str]:
+    """Request id of the upload being handled on this thread, if any"""
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]) -> "contextvars.Token":
+    """Set the request id for this context; returns a token for reset_request_id"""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: "contextvars.Token") -> None:
+    _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id to log records as %(request_id)s"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get() or "-"
+        return True
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(count, sum) per label set"""
+        with self._lock:
+            return {key: (sum(counts), total[0]) for key, (counts, total) in self._series.items()}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total[0]) for key, (counts, total) in sorted(self._series.items())]
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collectors that report other modules' counters as gauges"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]) -> None:
+        """
+        Export the numeric values of collect() as gauges named
+        <prefix>_<key> on every scrape (e.g. cache or LLM client metrics)
+        """
+        with self._lock:
+            self._collectors[prefix] = collect
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, collect in collectors:
+            try:
+                values = collect() or {}
+            except Exception as e:
+                span_logger.warning(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}".replace(".", "_").replace("-", "_")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "invoice_stage_seconds", "Time spent per pipeline stage", ("stage", "outcome")
+)
+
+
+class Span:
+    """Times one stage; the outcome is 'ok' unless set or an exception escapes"""
+
+    __slots__ = ("stage", "outcome", "fields", "_start")
+
+    def __init__(self, stage: str, fields: Dict[str, object]):
+        self.stage = stage
+        self.outcome = "ok"
+        self.fields = fields
+        self._start = 0.0
+
+    def __enter__(self) -> "Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None and self.outcome == "ok":
+            self.outcome = "error"
+        record(self.stage, time.perf_counter() - self._start, self.outcome, **self.fields)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+def span(stage: str, **fields) -> Span:
+    """
+    Context manager timing a stage
+
+    Usage:
+        with instrumentation.span("tesseract") as s:
+            ...
+            if not text:
+                s.outcome = "empty"
+    """
+    if not ENABLED:
+        return _NoopSpan()
+    return Span(stage, fields)
+
+
+def record(stage: str, seconds: float, outcome: str = "ok", **fields) -> None:
+    """Record a finished stage: histogram observation and a structured log line"""
+    if not ENABLED:
+        return
+    stage_seconds.observe(seconds, stage=stage, outcome=outcome)
+    if span_logger.isEnabledFor(logging.INFO):
+        span_logger.info(json.dumps({
+            "event": "span",
+            "stage": stage,
+            "outcome": outcome,
+            "seconds": round(seconds, 6),
+            "request_id": _request_id.get(),
+            **fields,
+        }, default=str))
+
+
+def timed_iter(iterable: Iterable, stage: str, **fields) -> Iterator:
+    """
+    Yield from iterable, recording only the time spent producing items
+    (not the consumer's time between them) as one span
+    """
+    if not ENABLED:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    spent = 0.0
+    outcome = "error"
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - start
+                outcome = "ok"
+                return
+            spent += time.perf_counter() - start
+            yield item
+    finally:
+        record(stage, spent, outcome, **fields)
+
+
+def stage_reporter(callback: Optional[Callable[[str, str], None]] = None) -> Callable[[str, str], None]:
+    """
+    Wrap a stage_callback(stage, state) so "running" -> "done"/"failed"
+    transitions are also recorded as spans
+    """
+    started: Dict[str, float] = {}
+
+    def report(stage: str, state: str) -> None:
+        if state == "running":
+            started[stage] = time.perf_counter()
+        elif stage in started:
+            record(f"pipeline.{stage}", time.perf_counter() - started.pop(stage),
+                   "ok" if state == "done" else state)
+        if callback:
+            callback(stage, state)
+
+    return report
@@ -2,12 +2,51 @@
 Invoice Processing Module
 Handles OCR extraction and Tally integration for invoice images
 """
+import functools
+import logging
+import mmap
 import os
+import queue
 import threading
-from typing import Callable, List, Optional
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
 
 from tally_client import TallyClient
-import OCR_AI
+from tally_outbox import TallyOutbox
+import batch_extraction
+import extraction_backends as extraction_backends_module
+from extraction_cache import content_hash
+from line_items import LineItemBatch
+import instrumentation
+import ocr_engine
+
+logger = logging.getLogger("ai-tally-agent.invoice_processor")
+
+# Prompt used to turn OCR text into '|' separated line items
+LINE_ITEM_PROMPT = (
+    "This is extracted OCR text i need a 2d array of with 0th index of the index(0 based) "
+    "is item name and 1st index is quantity and 2nd is 'um'(present in the invoice), 3rd being net price, "
+    "4th being the net_worth, 5th being vat, 6th being gross, return a '\\n' sepreated string for each item "
+    "and '|' sepreated values, no additional context or text formatiing is required just the required "
+)
+
+# Pipeline stages reported through process_file's stage_callback
+STAGES = ("ocr", "llm", "ledger", "vouchers")
+
+
+def _ocr_file(image_path: str) -> Tuple[str, Optional[str]]:
+    """
+    OCR stage of folder mode (runs in a worker process)
+
+    Returns:
+        Tuple of (document hash, OCR text or None)
+    """
+    import OCR_AI
+
+    with open(image_path, "rb") as f:
+        file_data = f.read()
+    return content_hash(file_data), OCR_AI.extract_text(file_data)
+
 
 class InvoiceProcessor:
     """
@@ -15,7 +54,12 @@ class InvoiceProcessor:
     """
     
     def __init__(self, company_name: str = "A", ledger_name: str = "New Fresh Ledger",
-                 contra_ledger: str = "Purchase", tally_url: str = "http://localhost:9000"):
+                 contra_ledger: str = "Cash", tally_url: str = "http://localhost:9000",
+                 ocr_workers: Optional[int] = None, llm_workers: int = 4,
+                 tally_batch_size: int = 500, tally_client: Optional[TallyClient] = None,
+                 extraction_backends: Optional[List[str]] = None,
+                 extraction_model: Optional[str] = None, llm_batch_size: Optional[int] = None,
+                 outbox: Optional[TallyOutbox] = None):
         """
         Initialize invoice processor
         
@@ -24,11 +68,30 @@ class InvoiceProcessor:
             ledger_name: Ledger name to create/use for invoices
             contra_ledger: Contra ledger for receipts (default: Cash)
             tally_url: Tally HTTP Server URL
+            ocr_workers: OCR processes for folder mode (default: CPU count)
+            llm_workers: Concurrent LLM extractions for folder mode
+            tally_batch_size: Line items pushed to Tally per import in folder mode
+            tally_client: Shared TallyClient to use instead of creating one for tally_url
+            extraction_backends: Backend names tried in order (default: EXTRACTION_BACKEND
+                followed by EXTRACTION_FALLBACK)
+            extraction_model: Gemini model for the backends (default: EXTRACTION_MODEL)
+            llm_batch_size: Invoices packed into one Gemini request in folder and
+                batch mode (default: LLM_BATCH_SIZE, 1 disables batching)
+            outbox: Outbox that process_file and process_files queue
+                extracted items in instead of pushing them to Tally
+                (optional; folder mode always pushes directly)
         """
         self.company_name = company_name
         self.ledger_name = ledger_name
-        self.contra_ledger = contra_ledger if ledger_name == "Purchase" else "Cash"
-        self.tally_client = TallyClient(tally_url)
+        self.contra_ledger = contra_ledger
+        self.tally_client = tally_client or TallyClient(tally_url)
+        self.ocr_workers = ocr_workers or os.cpu_count() or 1
+        self.llm_workers = llm_workers
+        self.tally_batch_size = tally_batch_size
+        self.extraction_backends = extraction_backends or extraction_backends_module.configured_backends()
+        self.extraction_model = extraction_model
+        self.llm_batch_size = max(1, llm_batch_size or batch_extraction.LLM_BATCH_SIZE)
+        self.outbox = outbox
         self._processing = False
     
     def process(self, folder: str, status_callback: Callable[[str], None],
@@ -59,7 +122,13 @@ class InvoiceProcessor:
     def _process_internal(self, folder: str, status_callback: Callable[[str], None],
                          error_callback: Optional[Callable[[str], None]],
                          success_callback: Optional[Callable[[], None]]) -> None:
-        """Internal processing method that runs in background thread"""
+        """
+        Internal processing method that runs in background thread
+
+        Folder mode runs as a staged pipeline: OCR in a process pool, LLM
+        extraction in a thread pool, and Tally imports in this thread as
+        soon as tally_batch_size line items have been extracted.
+        """
         self._processing = True
         
         try:
@@ -80,7 +149,6 @@ class InvoiceProcessor:
                 return
             
             # Process all image files
-            mainlist: List[List[str]] = []
             files = [f for f in os.listdir(folder) 
                     if os.path.isfile(os.path.join(folder, f)) and 
                     self._is_image_file(f)]
@@ -92,78 +160,91 @@ class InvoiceProcessor:
             
             total_files = len(files)
             status_callback(f"Found {total_files} image(s) to process...")
-            
-            # Process each image
-            processed_count = 0
-            for idx, filename in enumerate(files, start=1):
-                try:
+
+            results: "queue.Queue[Tuple[str, Optional[LineItemBatch], Optional[str]]]" = queue.Queue()
+            # The pool's processes are OCR workers themselves, so each keeps
+            # its own Tesseract instead of feeding the shared OCR engine
+            ocr_pool = ProcessPoolExecutor(max_workers=self.ocr_workers,
+                                           initializer=ocr_engine.use_in_process)
+            llm_pool = ThreadPoolExecutor(max_workers=self.llm_workers)
+            try:
+                chain = self.extraction_backends
+                batcher = _TextBatcher(total_files, self.llm_batch_size)
+                for filename in files:
                     image_path = os.path.join(folder, filename)
-                    status_callback(f"Processing {filename} ({idx}/{total_files})...")
-                    
-                    # Run OCR
-                    ocr_result = OCR_AI.ocr_ai(
-                        image_path,
-                        system_prompt=(
-                            "This is extracted OCR text i need a 2d array of with 0th index of the index(0 based) "
-                            "is item name and 1st index is quantity and 2nd is 'um'(present in the invoice), 3rd being net price, "
-                            "4th being the net_worth, 5th being vat, 6th being gross, return a '\\n' sepreated string for each item "
-                            "and '|' sepreated values, no additional context or text formatiing is required just the required "
+                    if chain[0] == extraction_backends_module.TesseractLLMBackend.name:
+                        future = ocr_pool.submit(_ocr_file, image_path)
+                        future.add_done_callback(
+                            functools.partial(self._on_ocr_done, filename, image_path,
+                                              llm_pool, results, batcher)
                         )
-                    )
-                    
-                    if ocr_result is None or not ocr_result.strip():
-                        status_callback(f"Skipping {filename} - OCR returned no data")
-                        continue
-                    
-                    # Parse OCR result
-                    templist = ocr_result.split("\n")
-                    for i in range(len(templist)):
-                        templist[i] = templist[i].split("|")
-                    
-                    mainlist += templist
-                    processed_count += 1
-                    
-                except Exception as e:
-                    status_callback(f"Error processing {filename}: {str(e)}")
-                    continue
-            
-            if not mainlist:
+                    else:
+                        # Backends without a local OCR stage run whole in the thread pool
+                        llm_pool.submit(self._extract_file_items, filename, image_path, chain, results)
+
+                # Tally import stage: push items as extraction results arrive
+                pending: List[LineItemBatch] = []
+                pending_count = 0
+                ledger_ready = False
+                processed_count = 0
+                extracted_count = 0
+                imported_batches = 0
+                for done in range(1, total_files + 1):
+                    filename, items, error = results.get()
+                    if items is None:
+                        status_callback(f"Skipping {filename} - {error} ({done}/{total_files})")
+                    else:
+                        processed_count += 1
+                        extracted_count += len(items)
+                        pending.append(items)
+                        pending_count += len(items)
+                        status_callback(f"Processed {filename} ({done}/{total_files})")
+
+                    if pending_count and (pending_count >= self.tally_batch_size or done == total_files):
+                        if not ledger_ready:
+                            # Create/update ledger in Tally
+                            status_callback("Creating ledger in Tally...")
+                            success, message = self.tally_client.ensure_ledger(
+                                self.company_name,
+                                self.ledger_name
+                            )
+                            if not success:
+                                if error_callback:
+                                    error_callback(f"Failed to create ledger: {message}")
+                                return
+                            status_callback(message)
+                            ledger_ready = True
+
+                        # Import vouchers to Tally
+                        status_callback(f"Importing {pending_count} voucher(s) to Tally...")
+                        success, message = self.tally_client.import_vouchers(
+                            self.company_name,
+                            self.ledger_name,
+                            LineItemBatch.concat(pending),
+                            self.contra_ledger
+                        )
+                        if not success:
+                            if error_callback:
+                                error_callback(f"Failed to import vouchers: {message}")
+                            return
+                        status_callback(message)
+                        imported_batches += 1
+                        pending = []
+                        pending_count = 0
+            finally:
+                ocr_pool.shutdown(wait=False, cancel_futures=True)
+                llm_pool.shutdown(wait=False, cancel_futures=True)
+
+            if not extracted_count:
                 if error_callback:
                     error_callback(f"No invoice data extracted from {total_files} file(s)")
                 return
             
-            status_callback(f"Extracted {len(mainlist)} line item(s) from {processed_count} file(s)")
-            
-            # Create/update ledger in Tally
-            status_callback("Creating ledger in Tally...")
-            success, message = self.tally_client.create_ledger(
-                self.company_name,
-                self.ledger_name
-            )
-            
-            if not success:
-                if error_callback:
-                    error_callback(f"Failed to create ledger: {message}")
-                return
-            
-            status_callback(message)
-            
-            # Import vouchers to Tally
-            status_callback("Importing vouchers to Tally...")
-            success, message = self.tally_client.import_vouchers(
-                self.company_name,
-                self.ledger_name,
-                mainlist,
-                self.contra_ledger
+            status_callback(
+                f"✓ Success! Imported {extracted_count} line item(s) from {processed_count} "
+                f"file(s) in {imported_batches} batch(es)"
             )
             
-            if not success:
-                if error_callback:
-                    error_callback(f"Failed to import vouchers: {message}")
-                return
-            
-            status_callback(f"✓ Success! {message}")
-            
             if success_callback:
                 success_callback()
                 
@@ -172,10 +253,82 @@ class InvoiceProcessor:
                 error_callback(f"Unexpected error: {str(e)}")
         finally:
             self._processing = False
+
+    def _on_ocr_done(self, filename: str, image_path: str, llm_pool: ThreadPoolExecutor,
+                     results: "queue.Queue", batcher: "_TextBatcher", future: Future) -> None:
+        """Hand a finished OCR result to the LLM stage, batching texts"""
+        try:
+            source, extracted_text = future.result()
+        except Exception as e:
+            logger.warning("OCR failed for %s: %s", filename, e)
+            extracted_text = None
+        entry = None if extracted_text is None else (filename, image_path, extracted_text, source)
+        ready = batcher.add(entry)
+        try:
+            if extracted_text is None:
+                # Let the fallback backends try the raw image
+                llm_pool.submit(self._extract_file_items, filename, image_path,
+                                self.extraction_backends[1:], results, "OCR returned no data")
+            for batch in ready:
+                llm_pool.submit(self._extract_text_batch, batch, results)
+        except RuntimeError:
+            # Pool already shut down after a Tally failure
+            results.put((filename, None, "Processing cancelled"))
+
+    def _extract_text_batch(self, entries: List[Tuple[str, str, str, str]],
+                            results: "queue.Queue") -> None:
+        """
+        LLM stage: turn a batch of OCR texts into line items and queue them for Tally
+
+        Args:
+            entries: (filename, image path, OCR text, document hash) per file
+        """
+        try:
+            outputs = batch_extraction.extract_batch(
+                [text for _, _, text, _ in entries], LINE_ITEM_PROMPT, self._llm_model(),
+                max_invoices=self.llm_batch_size
+            )
+        except Exception as e:
+            logger.warning("Batched extraction failed: %s", e)
+            outputs = [None] * len(entries)
+        for (filename, image_path, _, source), output in zip(entries, outputs):
+            try:
+                if output and output.strip():
+                    results.put((filename, self._parse_ocr_result(output, source), None))
+                else:
+                    self._extract_file_items(filename, image_path, self.extraction_backends[1:],
+                                             results, "AI returned no data")
+            except Exception as e:
+                results.put((filename, None, f"Error processing {filename}: {str(e)}"))
+
+    def _llm_model(self) -> str:
+        """Gemini model used for text extraction"""
+        return extraction_backends_module.get_backend(
+            extraction_backends_module.TesseractLLMBackend.name, self.extraction_model
+        ).model
+
+    def _extract_file_items(self, filename: str, image_path: str, chain: List[str],
+                            results: "queue.Queue", error: Optional[str] = None) -> None:
+        """Run a backend chain on a file from disk and queue the items for Tally"""
+        if not chain:
+            results.put((filename, None, error or "No extraction backend configured"))
+            return
+        try:
+            with open(image_path, "rb") as f:
+                file_data = f.read()
+            result = extraction_backends_module.extract_with_fallback(
+                file_data, LINE_ITEM_PROMPT, chain, model=self.extraction_model
+            )
+            if result.ok:
+                results.put((filename, self._parse_ocr_result(result.text, content_hash(file_data)), None))
+            else:
+                results.put((filename, None, result.error))
+        except Exception as e:
+            results.put((filename, None, f"Error processing {filename}: {str(e)}"))
     
     def _is_image_file(self, filename: str) -> bool:
-        """Check if file is a supported image format"""
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif'}
+        """Check if file is a supported image or PDF format"""
+        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.pdf'}
         return os.path.splitext(filename.lower())[1] in image_extensions
     
     def is_processing(self) -> bool:
@@ -183,48 +336,75 @@ class InvoiceProcessor:
         return self._processing
 
 
-    def process_file(self, file) -> tuple:
-        """Process a single invoice file"""
-        # Read file data instead of just filename
-        file_data = file.read()
+    def process_file(self, file,
+                     stage_callback: Optional[Callable[[str, str], None]] = None,
+                     backend: Optional[str] = None,
+                     items_callback: Optional[Callable[[LineItemBatch], None]] = None,
+                     outbox_callback: Optional[Callable[[str], None]] = None) -> tuple:
+        """
+        Process a single invoice file
 
-        # Import OCR module (lazy import to avoid startup delay)
-        try:
-            import OCR_AI
-        except ImportError as e:
-            print(f"OCR module not found: {str(e)}")
-            return False, f"OCR module not found: {str(e)}"
-
-        # Run OCR with file data (bytes) instead of filename
-        ocr_result = OCR_AI.ocr_ai(
-            file_data,  # Pass actual file data (bytes)
-            is_base64=False,  # File data is raw bytes, not base64
-            system_prompt=(
-                "This is extracted OCR text i need a 2d array of with 0th index of the index(0 based) "
-                "is item name and 1st index is quantity and 2nd is 'um'(present in the invoice), 3rd being net price, "
-                "4th being the net_worth, 5th being vat, 6th being gross, return a '\\n' sepreated string for each item "
-                "and '|' sepreated values, no additional context or text formatiing is required just the required "
-            )
-        )
+        Args:
+            file: File-like object with the invoice image, or its contents
+                as bytes or a buffer (e.g. an mmap from admission.open_upload)
+            stage_callback: Called as stage_callback(stage, state) when one of
+                STAGES changes state ("running", "done", "failed", "skipped" or
+                "queued") (optional)
+            backend: Extraction backend to try first for this file; the
+                configured backends remain as fallback (optional)
+            items_callback: Called with the extracted line items before they
+                are pushed to Tally (optional)
+            outbox_callback: Called with the outbox entry id when the items
+                were queued for Tally instead of pushed (optional)
 
-        if ocr_result is None or not ocr_result.strip():
-            return False, "OCR Or AI returned no data"
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        # Stage transitions are also recorded as instrumentation spans
+        report = instrumentation.stage_reporter(stage_callback)
 
-        # Parse OCR result
-        templist = ocr_result.split("\n")
-        for i in range(len(templist)):
-            templist[i] = templist[i].split("|")
+        # Read file data instead of just filename (buffers are used in place)
+        file_data = file if isinstance(file, (bytes, bytearray, memoryview, mmap.mmap)) else file.read()
+        with instrumentation.span("process_file", bytes=len(file_data)) as span:
+            success, message = self._process_file_data(file_data, report, backend, items_callback,
+                                                       outbox_callback)
+            if not success:
+                span.outcome = "failed"
+        return success, message
+
+    def _process_file_data(self, file_data: bytes, report: Callable[[str, str], None],
+                           backend: Optional[str],
+                           items_callback: Optional[Callable[[LineItemBatch], None]],
+                           outbox_callback: Optional[Callable[[str], None]] = None) -> tuple:
+        """Extraction and Tally import stages of process_file"""
+        templist, error = self._extract_items(file_data, report, backend)
+        if templist is None:
+            return False, error
+        if items_callback:
+            items_callback(templist)
+
+        if self.outbox is not None:
+            entry_id = self._enqueue(templist)
+            report("ledger", "queued")
+            report("vouchers", "queued")
+            if outbox_callback:
+                outbox_callback(entry_id)
+            return True, f"Queued {len(templist)} line items for Tally"
 
         # Create/update ledger in Tally
-        success, message = self.tally_client.create_ledger(
+        report("ledger", "running")
+        success, message = self.tally_client.ensure_ledger(
             self.company_name,
             self.ledger_name
         )
 
         if not success:
+            report("ledger", "failed")
             return False, f"Failed to create ledger: {message}"
+        report("ledger", "done")
 
         # Import vouchers to Tally
+        report("vouchers", "running")
         success, message = self.tally_client.import_vouchers(
             self.company_name,
             self.ledger_name,
@@ -233,6 +413,216 @@ class InvoiceProcessor:
         )
 
         if not success:
+            report("vouchers", "failed")
             return False, f"Failed to import vouchers: {message}"
+        report("vouchers", "done")
+
+        return success, message
+
+    def process_files(self, files: List[Tuple[str, bytes]], max_workers: int = 4,
+                      backend: Optional[str] = None) -> Tuple[bool, str, List[dict]]:
+        """
+        Process many invoice files with a single Tally push
+
+        Files are OCR'd and extracted concurrently, their line items merged,
+        and then one ledger create and one voucher import are sent to Tally.
+
+        Args:
+            files: List of (filename, file bytes or buffer such as an mmap
+                from admission.open_upload)
+            max_workers: Number of files extracted concurrently
+            backend: Extraction backend to try first (optional)
+
+        Returns:
+            Tuple of (success: bool, message: str, per-file results)
+        """
+        results: List[dict] = [
+            {'fileName': filename, 'success': False, 'items': 0, 'message': None}
+            for filename, _ in files
+        ]
+        if not files:
+            return False, "No files to process", results
+
+        # Extract all files concurrently, keeping items in upload order
+        extracted: List[Optional[LineItemBatch]] = [None] * len(files)
+        for idx, (items, error) in enumerate(self._extract_many(files, max_workers, backend)):
+            extracted[idx] = items
+            if items is None:
+                results[idx]['message'] = error
+            else:
+                results[idx]['items'] = len(items)
+
+        mainlist = LineItemBatch.concat(items for items in extracted if items is not None)
+
+        if not mainlist:
+            return False, f"No invoice data extracted from {len(files)} file(s)", results
+
+        if self.outbox is not None:
+            entry_id = self._enqueue(mainlist)
+            message = f"Queued {len(mainlist)} line items for Tally"
+            for idx, items in enumerate(extracted):
+                if items is not None:
+                    results[idx].update(success=True, message=message, outboxId=entry_id)
+            return True, message, results
+
+        # Create/update ledger in Tally once for the whole batch
+        success, message = self.tally_client.ensure_ledger(
+            self.company_name,
+            self.ledger_name
+        )
+        if not success:
+            message = f"Failed to create ledger: {message}"
+        else:
+            # Import vouchers from every file in one envelope
+            success, message = self.tally_client.import_vouchers(
+                self.company_name,
+                self.ledger_name,
+                mainlist,
+                self.contra_ledger
+            )
+            if not success:
+                message = f"Failed to import vouchers: {message}"
+
+        for idx, items in enumerate(extracted):
+            if items is not None:
+                results[idx]['success'] = success
+                results[idx]['message'] = message
+        return success, message, results
+
+    def _enqueue(self, items: LineItemBatch) -> str:
+        """Commit items to the outbox for this processor's Tally instance, company and ledgers"""
+        return self.outbox.enqueue(self.tally_client.tally_url, self.company_name,
+                                   self.ledger_name, self.contra_ledger, items)
+
+    def _extract_many(self, files: List[Tuple[str, bytes]], max_workers: int,
+                      backend: Optional[str] = None
+                      ) -> List[Tuple[Optional[LineItemBatch], Optional[str]]]:
+        """
+        Extract line items from many files
 
-        return success, message
\ No newline at end of file
+        With the tesseract_llm backend first in line, files are OCR'd
+        concurrently and their texts sent to Gemini in batches of
+        llm_batch_size; files the batch could not extract go through the
+        rest of the backend chain one by one.
+        """
+        chain = self._backend_chain(backend)
+        workers = max(1, min(max_workers, len(files)))
+        outcomes: List[Tuple[Optional[LineItemBatch], Optional[str]]] = [(None, None)] * len(files)
+
+        if chain[0] != extraction_backends_module.TesseractLLMBackend.name or \
+                self.llm_batch_size == 1 or len(files) == 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._extract_items, file_data, None, backend): idx
+                    for idx, (_, file_data) in enumerate(files)
+                }
+                for future in as_completed(futures):
+                    try:
+                        outcomes[futures[future]] = future.result()
+                    except Exception as e:
+                        outcomes[futures[future]] = (None, f"Unexpected error: {str(e)}")
+            return outcomes
+
+        import OCR_AI
+
+        def ocr(file_data: bytes) -> Optional[str]:
+            try:
+                return OCR_AI.extract_text(file_data)
+            except Exception as e:
+                logger.warning("OCR failed: %s", e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            texts = list(executor.map(ocr, [file_data for _, file_data in files]))
+        ocr_ok = [idx for idx, text in enumerate(texts) if text is not None]
+        outputs = batch_extraction.extract_batch(
+            [texts[idx] for idx in ocr_ok], LINE_ITEM_PROMPT, self._llm_model(),
+            max_invoices=self.llm_batch_size, max_workers=workers
+        )
+        for idx, output in zip(ocr_ok, outputs):
+            if output and output.strip():
+                outcomes[idx] = (self._parse_ocr_result(output, content_hash(files[idx][1])), None)
+
+        # Remaining backends for files OCR or the batch could not handle
+        fallback = chain[1:]
+        for idx, (items, _) in enumerate(outcomes):
+            if items is None:
+                outcomes[idx] = (None, "OCR Or AI returned no data")
+                if fallback:
+                    result = extraction_backends_module.extract_with_fallback(
+                        files[idx][1], LINE_ITEM_PROMPT, fallback, model=self.extraction_model
+                    )
+                    if result.ok:
+                        outcomes[idx] = (self._parse_ocr_result(result.text, content_hash(files[idx][1])), None)
+        return outcomes
+
+    def _backend_chain(self, backend: Optional[str] = None) -> List[str]:
+        """Configured backend chain, with a per-request backend moved to the front"""
+        chain = list(self.extraction_backends)
+        if backend:
+            chain = [backend] + [name for name in chain if name != backend]
+        return chain
+
+    def _extract_items(self, file_data: bytes,
+                       report: Optional[Callable[[str, str], None]] = None,
+                       backend: Optional[str] = None
+                       ) -> Tuple[Optional[LineItemBatch], Optional[str]]:
+        """
+        Run the extraction backend chain on raw file bytes
+
+        Returns:
+            Tuple of (line items or None on failure, error message)
+        """
+        result = extraction_backends_module.extract_with_fallback(
+            file_data, LINE_ITEM_PROMPT, self._backend_chain(backend), report, self.extraction_model
+        )
+        logger.debug("Extraction via %s: %s", result.backend,
+                     {stage: round(seconds, 3) for stage, seconds in result.timings.items()})
+        if not result.ok:
+            return None, "OCR Or AI returned no data"
+
+        # Parse OCR result
+        return self._parse_ocr_result(result.text, content_hash(file_data)), None
+
+    def _parse_ocr_result(self, ocr_result: str, source: str = "") -> LineItemBatch:
+        """
+        Parse the '\\n' / '|' separated model output into line items
+
+        Args:
+            ocr_result: Model output
+            source: Hash of the invoice file, from which voucher identities are derived
+        """
+        return LineItemBatch.from_text(ocr_result, source)
+
+
+class _TextBatcher:
+    """Collects folder-mode OCR results into batches for the LLM stage"""
+
+    def __init__(self, expected: int, batch_size: int):
+        """
+        Args:
+            expected: Number of OCR results that will be added
+            batch_size: Texts per LLM batch
+        """
+        self.expected = expected
+        self.batch_size = batch_size
+        self._seen = 0
+        self._pending: List[Tuple[str, str, str, str]] = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: Optional[Tuple[str, str, str, str]]) -> List[List[Tuple[str, str, str, str]]]:
+        """
+        Record one OCR result (None if OCR failed)
+
+        Returns:
+            Batches that are now ready: a full batch, or the remainder once
+            every expected result has arrived
+        """
+        with self._lock:
+            self._seen += 1
+            if entry is not None:
+                self._pending.append(entry)
+            if self._pending and (len(self._pending) >= self.batch_size or self._seen >= self.expected):
+                ready, self._pending = self._pending, []
+                return [ready]
+            return []
@@ -0,0 +1,264 @@
+"""
+Invoice Job Queue Module
+Runs invoice uploads on a bounded in-process worker pool so the web
+request can return immediately with a job id
+"""
+import contextlib
+import logging
+import queue
+import threading
+import time
+import uuid
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+import admission
+import instrumentation
+from invoice_processor import STAGES
+
+logger = logging.getLogger("ai-tally-agent.job_queue")
+
+
+class Job:
+    """State of a single queued invoice upload"""
+
+    def __init__(self, user_id: Optional[str], filename: str, file_data: bytes,
+                 backend: Optional[str] = None, tenant_id: Optional[str] = None):
+        """
+        Initialize job
+
+        Args:
+            user_id: Id of the user that uploaded the file (optional)
+            filename: Original file name
+            file_data: Raw uploaded file bytes
+            backend: Extraction backend requested for this file (optional)
+            tenant_id: Tenant whose Tally the items go to (optional)
+        """
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filename = filename
+        self.file_data: Optional[bytes] = file_data
+        self.backend = backend
+        self.tenant_id = tenant_id
+        # Request id of the upload, so worker-side spans and logs carry it
+        self.request_id = instrumentation.get_request_id()
+        self.status = "queued"
+        self.stages: Dict[str, str] = {stage: "pending" for stage in STAGES}
+        self.stage_seconds: Dict[str, float] = {}
+        self._stage_started: Dict[str, float] = {}
+        self.success: Optional[bool] = None
+        self.message: Optional[str] = None
+        # Tally outbox entry of the extracted items, when they were queued
+        self.outbox_id: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def set_stage(self, stage: str, state: str) -> None:
+        """Stage callback passed to InvoiceProcessor.process_file"""
+        now = time.time()
+        if state == "running":
+            self._stage_started[stage] = now
+        elif stage in self._stage_started:
+            self.stage_seconds[stage] = round(now - self._stage_started.pop(stage), 3)
+        self.stages[stage] = state
+
+    def set_outbox_id(self, outbox_id: str) -> None:
+        """Outbox callback passed to InvoiceProcessor.process_file"""
+        self.outbox_id = outbox_id
+
+    def to_dict(self) -> dict:
+        """Serialize job for the /jobs endpoints"""
+        return {
+            'jobId': self.job_id,
+            'userId': self.user_id,
+            'fileName': self.filename,
+            'status': self.status,
+            'stages': dict(self.stages),
+            'stageSeconds': dict(self.stage_seconds),
+            'backend': self.backend,
+            'tenantId': self.tenant_id,
+            'requestId': self.request_id,
+            'success': self.success,
+            'message': self.message,
+            'outboxId': self.outbox_id,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process queue of invoice jobs served by a fixed number of worker threads.
+
+    Jobs are kept in memory only, so the job id must be polled on the same
+    process that accepted the upload. Uploads are held until their job has
+    run, up to max_pending_bytes in total; a worker reserves the job's
+    estimated decoding cost from the admission controller before
+    processing it, waiting (rather than failing the job) while the budget
+    is taken.
+    """
+
+    def __init__(self, processor_factory: Callable[[Optional[str]], object], max_workers: int = 4,
+                 max_pending: int = 500, retention_seconds: float = 3600,
+                 max_pending_bytes: Optional[int] = None,
+                 admission_controller: Optional[admission.AdmissionController] = None):
+        """
+        Initialize job queue
+
+        Args:
+            processor_factory: Called with a job's tenant id; returns an object with
+                process_file(file, stage_callback, backend, outbox_callback)
+            max_workers: Number of worker threads processing jobs
+            max_pending: Maximum number of queued jobs before submit() rejects
+            retention_seconds: How long finished jobs stay queryable
+            max_pending_bytes: Upload bytes held by unfinished jobs before
+                submit() rejects (default: no limit)
+            admission_controller: Memory budget shared with synchronous
+                uploads (default: none)
+        """
+        self.processor_factory = processor_factory
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.max_pending_bytes = max_pending_bytes
+        self.admission_controller = admission_controller
+        self._pending_bytes = 0
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_pending)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"invoice-job-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._workers.append(thread)
+
+    def submit(self, user_id: Optional[str], filename: str, file_data: bytes,
+               backend: Optional[str] = None, tenant_id: Optional[str] = None) -> Job:
+        """
+        Queue an invoice for processing
+
+        Raises:
+            queue.Full: If max_pending jobs are already waiting, or the
+                upload would exceed max_pending_bytes
+        """
+        self.start()
+        self._prune()
+        job = Job(user_id, filename, file_data, backend, tenant_id)
+        with self._lock:
+            if (self.max_pending_bytes is not None
+                    and self._pending_bytes + len(file_data) > self.max_pending_bytes):
+                raise queue.Full("Queued uploads exceed max_pending_bytes")
+            self._pending_bytes += len(file_data)
+            self._jobs[job.job_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+                self._pending_bytes -= len(file_data)
+            raise
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return job by id, or None if unknown or expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for_user(self, user_id: str) -> List[Job]:
+        """Return all known jobs of a user, newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.user_id == user_id]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def pending_count(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def pending_bytes(self) -> int:
+        """Upload bytes held by jobs that have not finished"""
+        with self._lock:
+            return self._pending_bytes
+
+    def _worker(self) -> None:
+        """Worker loop: take jobs off the queue and process them"""
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job) -> None:
+        """Process one job and record its outcome"""
+        token = instrumentation.set_request_id(job.request_id)
+        size = len(job.file_data)
+        try:
+            cost = admission.estimate_cost(job.file_data)
+            while True:
+                try:
+                    with self._admit(cost):
+                        self._process(job)
+                    break
+                except admission.Overloaded as e:
+                    # Jobs have no client to shed to: wait for the budget
+                    logger.info("Job %s waiting %ss for memory budget", job.job_id, e.retry_after)
+                    time.sleep(e.retry_after)
+        except Exception as e:
+            job.success = False
+            job.message = f"Unexpected error: {str(e)}"
+            job.status = "failed"
+        finally:
+            # Raw bytes are no longer needed once the job has run
+            job.file_data = None
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending_bytes -= size
+            instrumentation.reset_request_id(token)
+
+    def _admit(self, cost: int):
+        """Reservation of cost bytes of the admission budget (nothing without a controller)"""
+        if self.admission_controller is None:
+            return contextlib.nullcontext()
+        return self.admission_controller.admit(cost)
+
+    def _process(self, job: Job) -> None:
+        """Run the processor on an admitted job"""
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            processor = self.processor_factory(job.tenant_id)
+            success, message = processor.process_file(
+                BytesIO(job.file_data),
+                stage_callback=job.set_stage,
+                backend=job.backend,
+                outbox_callback=job.set_outbox_id
+            )
+            job.success = bool(success)
+            job.message = message
+            job.status = "done" if success else "failed"
+        except Exception as e:
+            job.success = False
+            job.message = f"Unexpected error: {str(e)}"
+            job.status = "failed"
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than retention_seconds"""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,268 @@
+"""
+Line Items Module
+Columnar batch of extracted invoice line items with vectorized,
+locale-aware number parsing and bulk cross-field validation
+"""
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Column order of the '|' separated rows produced by the LLM
+COLUMNS = ("name", "qty", "unit", "rate", "net_worth", "vat", "gross")
+
+# Characters dropped before parsing a number
+_NOISE = ("₹", "Rs.", "Rs", "INR", "$", "€", "£", " ", " ", "'")
+
+# Cross-field checks pass within max(ABS_TOLERANCE, REL_TOLERANCE * value)
+REL_TOLERANCE = 0.02
+ABS_TOLERANCE = 1.0
+
+
+def parse_numbers(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse many number strings at once
+
+    Handles Indian (1,25,000.00) and Western (125,000.00) digit grouping,
+    decimal commas (1.250,50 or 12,5), currency symbols and a trailing
+    '%'. Blank or unparseable values become NaN.
+
+    Returns:
+        Tuple of (float64 values, bool mask of values given as percentages)
+    """
+    text = np.char.strip(np.asarray(values, dtype=str))
+    for noise in _NOISE:
+        text = np.char.replace(text, noise, "")
+    percent = np.char.endswith(text, "%")
+    text = np.char.replace(text, "%", "")
+
+    # A comma is the decimal separator if it comes after the last dot, or
+    # if it is the only separator and is not followed by a 3-digit group
+    last_comma = np.char.rfind(text, ",")
+    last_dot = np.char.rfind(text, ".")
+    has_dot = last_dot >= 0
+    trailing = np.char.str_len(text) - last_comma - 1
+    decimal_comma = (last_comma > last_dot) & (has_dot | (trailing != 3))
+
+    grouped = np.char.replace(text, ",", "")
+    swapped = np.char.replace(np.char.replace(text, ".", ""), ",", ".")
+    text = np.where(decimal_comma, swapped, grouped)
+
+    try:
+        numbers = np.where(text == "", "nan", text).astype(np.float64)
+    except ValueError:
+        # Some value is not a number: fall back to per-value parsing
+        numbers = np.array([_to_float(value) for value in text], dtype=np.float64)
+    return numbers, percent
+
+
+def parse_number(value: str) -> float:
+    """
+    Parse a single number string the way parse_numbers does, NaN if
+    unparseable; a trailing '%' is dropped
+    """
+    text = value.strip()
+    for noise in _NOISE:
+        text = text.replace(noise, "")
+    text = text.replace("%", "")
+    last_comma = text.rfind(",")
+    last_dot = text.rfind(".")
+    if last_comma > last_dot and (last_dot >= 0 or len(text) - last_comma - 1 != 3):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    return _to_float(text) if text else float("nan")
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+class LineItem:
+    """One line item row"""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, name: str, qty: float, unit: str, rate: float,
+                 net_worth: float, vat: float, gross: float):
+        self.name = name
+        self.qty = qty
+        self.unit = unit
+        self.rate = rate
+        self.net_worth = net_worth
+        self.vat = vat
+        self.gross = gross
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{column}={getattr(self, column)!r}" for column in COLUMNS)
+        return f"LineItem({fields})"
+
+
+class LineItemBatch:
+    """
+    Line items stored column by column
+
+    Names and units are plain lists of strings; numeric columns are
+    float64 arrays (NaN where the value was missing or unparseable), so
+    parsing and validation run once over the whole batch instead of per
+    row. VAT given as a percentage is converted to an amount of the net
+    worth. Rows with fewer than 7 fields are kept but flagged as
+    malformed so callers can report them. Each row also records the hash
+    of the document it was extracted from ("" if unknown).
+    """
+
+    def __init__(self, names: List[str], units: List[str], qty: np.ndarray, rate: np.ndarray,
+                 net_worth: np.ndarray, vat: np.ndarray, gross: np.ndarray,
+                 malformed: Optional[np.ndarray] = None, sources: Optional[List[str]] = None):
+        self.names = names
+        self.units = units
+        self.qty = qty
+        self.rate = rate
+        self.net_worth = net_worth
+        self.vat = vat
+        self.gross = gross
+        self.malformed = malformed if malformed is not None else np.zeros(len(names), dtype=bool)
+        self.sources = sources if sources is not None else [""] * len(names)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[str]], source: str = "") -> "LineItemBatch":
+        """
+        Build a batch from rows of [name, qty, unit, rate, net_worth, vat, gross] strings
+
+        Args:
+            rows: Rows of strings
+            source: Hash of the document the rows were extracted from
+        """
+        columns: List[List[str]] = [[] for _ in COLUMNS]
+        malformed: List[bool] = []
+        for row in rows:
+            malformed.append(len(row) < len(COLUMNS))
+            for position, column in enumerate(columns):
+                column.append(row[position].strip() if position < len(row) else "")
+        if not malformed:
+            return cls.empty()
+
+        numeric = {}
+        for position in (1, 3, 4, 5, 6):
+            numeric[COLUMNS[position]] = parse_numbers(columns[position])
+        net_worth = numeric["net_worth"][0]
+        vat, vat_percent = numeric["vat"]
+        vat = np.where(vat_percent, net_worth * vat / 100, vat)
+        return cls(columns[0], columns[2], numeric["qty"][0], numeric["rate"][0],
+                   net_worth, vat, numeric["gross"][0], np.array(malformed, dtype=bool),
+                   [source] * len(malformed))
+
+    @classmethod
+    def from_text(cls, text: str, source: str = "") -> "LineItemBatch":
+        """Build a batch from '\\n' / '|' separated LLM output, ignoring blank lines"""
+        return cls.from_rows((line.split("|") for line in text.splitlines() if line.strip()), source)
+
+    @classmethod
+    def coerce(cls, items: Union["LineItemBatch", Iterable[Sequence[str]]]) -> "LineItemBatch":
+        """Return items as a batch, converting raw string rows if needed"""
+        return items if isinstance(items, cls) else cls.from_rows(items)
+
+    @classmethod
+    def empty(cls) -> "LineItemBatch":
+        none = np.empty(0, dtype=np.float64)
+        return cls([], [], none, none, none, none, none, np.empty(0, dtype=bool), [])
+
+    @classmethod
+    def concat(cls, batches: Iterable["LineItemBatch"]) -> "LineItemBatch":
+        """Join batches into one, keeping row order"""
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return cls(
+            [name for batch in batches for name in batch.names],
+            [unit for batch in batches for unit in batch.units],
+            *(np.concatenate([getattr(batch, column) for batch in batches])
+              for column in ("qty", "rate", "net_worth", "vat", "gross", "malformed")),
+            [source for batch in batches for source in batch.sources]
+        )
+
+    def to_columns(self) -> dict:
+        """Columns as plain lists (JSON-serializable, NaN kept as NaN)"""
+        return {
+            "names": list(self.names), "units": list(self.units),
+            **{column: getattr(self, column).tolist()
+               for column in ("qty", "rate", "net_worth", "vat", "gross", "malformed")},
+            "sources": list(self.sources),
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "LineItemBatch":
+        """Inverse of to_columns"""
+        return cls(
+            columns["names"], columns["units"],
+            *(np.array(columns[column], dtype=np.float64)
+              for column in ("qty", "rate", "net_worth", "vat", "gross")),
+            np.array(columns["malformed"], dtype=bool), columns["sources"]
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> LineItem:
+        return LineItem(self.names[index], float(self.qty[index]), self.units[index],
+                        float(self.rate[index]), float(self.net_worth[index]),
+                        float(self.vat[index]), float(self.gross[index]))
+
+    def __iter__(self) -> Iterator[LineItem]:
+        return (self[index] for index in range(len(self)))
+
+    def take(self, mask: np.ndarray) -> "LineItemBatch":
+        """Rows where mask is True, as a new batch"""
+        positions = np.flatnonzero(mask)
+        return LineItemBatch(
+            [self.names[i] for i in positions], [self.units[i] for i in positions],
+            self.qty[positions], self.rate[positions], self.net_worth[positions],
+            self.vat[positions], self.gross[positions], self.malformed[positions],
+            [self.sources[i] for i in positions]
+        )
+
+    def validate(self, rel_tolerance: float = REL_TOLERANCE,
+                 abs_tolerance: float = ABS_TOLERANCE) -> Tuple[np.ndarray, List[Optional[str]]]:
+        """
+        Check every row at once
+
+        A row is rejected if it is malformed, has no quantity or gross
+        amount, or if qty x rate differs from the net worth or net worth
+        + VAT from the gross by more than the tolerance. Checks whose
+        inputs are missing are skipped.
+
+        Returns:
+            Tuple of (bool mask of valid rows, rejection reason per row or None)
+        """
+        reasons: List[Optional[str]] = [None] * len(self)
+        if not len(self):
+            return np.zeros(0, dtype=bool), reasons
+
+        with np.errstate(invalid="ignore"):
+            expected_worth = self.qty * self.rate
+            worth_off = np.abs(expected_worth - self.net_worth) > np.maximum(
+                abs_tolerance, rel_tolerance * np.abs(self.net_worth))
+            expected_gross = self.net_worth + self.vat
+            gross_off = np.abs(expected_gross - self.gross) > np.maximum(
+                abs_tolerance, rel_tolerance * np.abs(self.gross))
+
+        checks = (
+            (self.malformed, "Malformed row"),
+            (np.isnan(self.qty) | (self.qty == 0), "Missing quantity"),
+            (np.isnan(self.gross), "Missing gross amount"),
+            (worth_off & ~np.isnan(expected_worth) & ~np.isnan(self.net_worth),
+             "Quantity x rate does not match net worth"),
+            (gross_off & ~np.isnan(expected_gross) & ~np.isnan(self.gross),
+             "Net worth + VAT does not match gross"),
+        )
+        invalid = np.zeros(len(self), dtype=bool)
+        # Later checks only name rows that passed the earlier ones
+        for failed, reason in checks:
+            for index in np.flatnonzero(failed & ~invalid):
+                reasons[index] = reason
+            invalid |= failed
+        return ~invalid, reasons
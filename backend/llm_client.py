@@ -0,0 +1,282 @@
+"""
+LLM Client Module
+Process-wide Gemini access: one model instance per model name, a cap on
+in-flight requests, request/token rate limiting, and retries that honour
+the provider's retry-after hints
+"""
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import instrumentation
+
+# HTTP statuses worth retrying: rate limited and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_RETRY_AFTER_RE = re.compile(
+    r"retry[ _-]?(?:after|delay|in)\D{0,20}?(\d+(?:\.\d+)?)\s*(ms|s|sec|seconds)?", re.IGNORECASE
+)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Take amount tokens, waiting for the bucket to refill if needed
+
+        Requests larger than the capacity are clamped so they can ever run.
+
+        Returns:
+            False if timeout expired first
+        """
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class LLMClient:
+    """Shared, rate-limited Gemini client"""
+
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: float = 60,
+                 tokens_per_minute: float = 1_000_000, max_retries: int = 4,
+                 backoff_base: float = 1.0, max_backoff: float = 60.0,
+                 acquire_timeout: Optional[float] = 300.0,
+                 model_factory: Optional[Callable[[str], object]] = None):
+        """
+        Initialize client
+
+        Args:
+            max_concurrency: Maximum requests in flight at once
+            requests_per_minute: Request rate limit
+            tokens_per_minute: Estimated input+output token rate limit
+            max_retries: Retries for 429 and 5xx responses
+            backoff_base: Base delay for exponential backoff without a retry-after hint
+            max_backoff: Longest single wait between retries
+            acquire_timeout: Longest wait for a rate-limit or concurrency slot
+            model_factory: Creates the model for a name instead of
+                google.generativeai (e.g. a local stand-in for benchmarks)
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.acquire_timeout = acquire_timeout
+        self.model_factory = model_factory
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._models: Dict[str, object] = {}
+        self._models_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._counters = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def model(self, name: str):
+        """
+        Cached GenerativeModel for a model name
+
+        Raises:
+            ValueError: If GOOGLE_API_KEY is not set
+        """
+        with self._models_lock:
+            model = self._models.get(name)
+            if model is None and self.model_factory is not None:
+                model = self._models[name] = self.model_factory(name)
+            if model is None:
+                import google.generativeai as genai
+                if not self._models:
+                    # First model of this client: configure the API key
+                    api_key = os.environ.get("GOOGLE_API_KEY")
+                    if not api_key:
+                        raise ValueError("Please set the GOOGLE_API_KEY in your .env file")
+                    genai.configure(api_key=api_key)
+                model = genai.GenerativeModel(name)
+                self._models[name] = model
+            return model
+
+    def generate(self, model_name: str, contents, generation_config: Optional[dict] = None,
+                 estimated_tokens: Optional[int] = None):
+        """
+        Call generate_content under the concurrency cap and rate limits
+
+        Args:
+            model_name: Gemini model name
+            contents: Prompt text or list of parts
+            generation_config: Passed through to generate_content
+            estimated_tokens: Tokens charged against the token bucket
+                (default: estimated from text length and max_output_tokens)
+
+        Raises:
+            TimeoutError: If no slot became free within acquire_timeout
+            Exception: The provider error once retries are exhausted
+        """
+        if estimated_tokens is None:
+            estimated_tokens = self.estimate_tokens(contents, generation_config)
+        attempt = 0
+        while True:
+            self._acquire(estimated_tokens)
+            start = time.perf_counter()
+            try:
+                response = self.model(model_name).generate_content(
+                    contents, generation_config=generation_config
+                )
+                self._count("requests")
+                instrumentation.record("gemini", time.perf_counter() - start, model=model_name,
+                                       attempt=attempt)
+                return response
+            except Exception as e:
+                self._count("requests")
+                status = self._status_code(e)
+                instrumentation.record("gemini", time.perf_counter() - start,
+                                       f"http_{status}" if status else "error",
+                                       model=model_name, attempt=attempt)
+                if status == 429:
+                    self._count("throttled")
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, self.backoff_base * (2 ** attempt))
+                self._count("retries")
+                attempt += 1
+            finally:
+                self._release()
+            time.sleep(min(delay, self.max_backoff))
+
+    def metrics(self) -> dict:
+        """Queue depth, in-flight requests, counters and wait times"""
+        with self._metrics_lock:
+            waits = self._counters["requests"] or 1
+            return {
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                **self._counters,
+                "wait_seconds_total": round(self._wait_total, 3),
+                "wait_seconds_avg": round(self._wait_total / waits, 3),
+                "wait_seconds_max": round(self._wait_max, 3),
+            }
+
+    @staticmethod
+    def estimate_tokens(contents, generation_config: Optional[dict] = None) -> int:
+        """Rough token count: ~4 characters per token plus the output budget"""
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        chars = sum(len(part) for part in parts if isinstance(part, str))
+        # Images are billed as a fixed-size block of tokens
+        images = sum(1 for part in parts if not isinstance(part, str))
+        output = (generation_config or {}).get("max_output_tokens", 2048)
+        return chars // 4 + images * 258 + output
+
+    def _acquire(self, tokens: int) -> None:
+        """Wait for rate-limit budget and a concurrency slot"""
+        start = time.monotonic()
+        with self._metrics_lock:
+            self._waiting += 1
+        try:
+            if not self._requests.acquire(1, self.acquire_timeout) or \
+                    not self._tokens.acquire(tokens, self.acquire_timeout) or \
+                    not self._slots.acquire(timeout=self.acquire_timeout):
+                raise TimeoutError("Timed out waiting for an LLM request slot")
+        finally:
+            waited = time.monotonic() - start
+            instrumentation.record("gemini.wait", waited)
+            with self._metrics_lock:
+                self._waiting -= 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        with self._metrics_lock:
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._metrics_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _count(self, name: str) -> None:
+        with self._metrics_lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _status_code(error: Exception) -> Optional[int]:
+        """HTTP status of a google.api_core (or requests-style) error"""
+        code = getattr(error, "code", None)
+        if isinstance(code, int):
+            return int(code)
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+        return int(status) if isinstance(status, int) else None
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Seconds the provider asked us to wait, if it said"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        match = _RETRY_AFTER_RE.search(str(error))
+        if match:
+            seconds = float(match.group(1))
+            return seconds / 1000 if (match.group(2) or "").lower() == "ms" else seconds
+        return None
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """
+    Process-wide client configured from LLM_MAX_CONCURRENCY,
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE and LLM_MAX_RETRIES
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient(
+                    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+                    requests_per_minute=float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "60")),
+                    tokens_per_minute=float(os.environ.get("LLM_TOKENS_PER_MINUTE", "1000000")),
+                    max_retries=int(os.environ.get("LLM_MAX_RETRIES", "4")),
+                )
+    return _client
+
+
+def set_llm_client(client: Optional[LLMClient]) -> None:
+    """Replace the process-wide client (None re-creates it from the environment)"""
+    global _client
+    with _client_lock:
+        _client = client
@@ -1,12 +1,33 @@
+import sys
+if __name__ == '__main__' and '--profile-startup' in sys.argv:
+    # Report import and initialization time per module, then exit
+    import services
+    sys.exit(services.profile_startup("main"))
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from google.cloud import firestore
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 from dotenv import load_dotenv
 import logging
 import invoice_processor as InvoiceProcessor
-import razorpay
+import job_queue
+import extraction_cache
+import extraction_backends
+import llm_client
+import admission
+import contextlib
+import queue
+import services
+import subscription_cache
+import firestore_writer
+import tally_outbox
+import tenant_registry
+import instrumentation
+import ocr_engine
+import time
+import uuid
 from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
@@ -21,57 +42,217 @@ global_counter = 0
 # Configure logging for production-grade diagnostics
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO"),
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    format="%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s",
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(instrumentation.RequestIdFilter())
 logger = logging.getLogger("ai-tally-agent")
 
-# Initialize Razorpay client
-razorpay_client = razorpay.Client(
-    auth=(os.environ.get("RAZORPAY_KEY_ID"), os.environ.get("RAZORPAY_KEY_SECRET"))
+# Request latency and a request id (X-Request-ID) that follows the upload
+# through processing, spans and logs
+http_request_seconds = instrumentation.registry.histogram(
+    "http_request_seconds", "HTTP request latency", ("endpoint", "method", "status")
 )
-# Global environment variables
-try:
-    import os, json
+
+@app.before_request
+def _start_request():
+    request_id = request.headers.get("X-Request-ID") or instrumentation.new_request_id()
+    request.environ["ai_tally.request_id_token"] = instrumentation.set_request_id(request_id)
+    request.environ["ai_tally.started"] = time.perf_counter()
+
+@app.after_request
+def _finish_request(response):
+    started = request.environ.get("ai_tally.started")
+    if started is not None:
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or "unknown",
+                                     method=request.method, status=response.status_code)
+    request_id = instrumentation.get_request_id()
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.teardown_request
+def _end_request(exc):
+    token = request.environ.pop("ai_tally.request_id_token", None)
+    if token is not None:
+        instrumentation.reset_request_id(token)
+
+# Heavy clients are created on first use (see services.py)
+def _create_razorpay_client():
+    import razorpay
+    return razorpay.Client(
+        auth=(os.environ.get("RAZORPAY_KEY_ID"), os.environ.get("RAZORPAY_KEY_SECRET"))
+    )
+
+def _create_firestore_client():
+    import json
     import firebase_admin
     from firebase_admin import credentials, firestore
 
-    sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
-    if sa_json:
-        sa_dict = json.loads(sa_json)
-        cred = credentials.Certificate(sa_dict)
-        firebase_admin.initialize_app(cred)
-    else:
-        # fallback to default credentials (not recommended for production)
-        firebase_admin.initialize_app()
+    if not firebase_admin._apps:
+        sa_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
+        if sa_json:
+            sa_dict = json.loads(sa_json)
+            cred = credentials.Certificate(sa_dict)
+            firebase_admin.initialize_app(cred)
+        else:
+            # fallback to default credentials (not recommended for production)
+            firebase_admin.initialize_app()
     db = firestore.client()
-    
     logger.info("Firestore client initialized successfully.")
+    return db
+
+def _warm_gemini():
+    client = llm_client.get_llm_client()
+    client.model(extraction_backends.get_backend(extraction_backends.TesseractLLMBackend.name).model)
+    return client
+
+def _warm_ocr():
+    import OCR_AI
+    engine = ocr_engine.get_engine()
+    if engine is not None:
+        engine.start()
+    return engine
+
+services.register("firestore", _create_firestore_client)
+services.register("razorpay", _create_razorpay_client)
+services.register("gemini", _warm_gemini)
+services.register("ocr", _warm_ocr)
+
+# Configuration for Tally and voucher defaults
+TALLY_URL = os.environ.get("TALLY_URL", "http://localhost:9000")
+TALLY_COMPANY = os.environ.get("TALLY_COMPANY", "A")
+TALLY_LEDGER = os.environ.get("TALLY_LEDGER", "Main Ledger")
+TALLY_REQUEST_TIMEOUT = float(os.environ.get("TALLY_REQUEST_TIMEOUT", "20"))
+TALLY_MAX_RETRIES = int(os.environ.get("TALLY_MAX_RETRIES", "3"))
+TALLY_RETRY_BACKOFF_BASE = float(os.environ.get("TALLY_RETRY_BACKOFF_BASE", "0.5"))
+TALLY_CONNECT_TIMEOUT = float(os.environ.get("TALLY_CONNECT_TIMEOUT", "5"))
+TALLY_POOL_SIZE = int(os.environ.get("TALLY_POOL_SIZE", "4"))
+TALLY_LEDGER_CACHE_TTL = float(os.environ.get("TALLY_LEDGER_CACHE_TTL", "600"))
+TALLY_IMPORT_CHUNK_SIZE = int(os.environ.get("TALLY_IMPORT_CHUNK_SIZE", "200"))
+TALLY_IMPORT_MAX_IN_FLIGHT = int(os.environ.get("TALLY_IMPORT_MAX_IN_FLIGHT", "1"))
+TALLY_STREAM_REQUESTS = os.environ.get("TALLY_STREAM_REQUESTS", "true").lower() in ("1", "true", "yes")
+TALLY_CONTRA_LEDGER = os.environ.get("TALLY_CONTRA_LEDGER", "Cash")
+TALLY_MAX_CONCURRENCY = int(os.environ.get("TALLY_MAX_CONCURRENCY", "1"))
+TALLY_MASTERS_REFRESH = float(os.environ.get("TALLY_MASTERS_REFRESH", "0"))
+TALLY_MATCH_MIN_SCORE = float(os.environ.get("TALLY_MATCH_MIN_SCORE", "0.5"))
+
+# Async upload mode: jobs are processed by an in-process worker pool
+UPLOAD_ASYNC_DEFAULT = os.environ.get("UPLOAD_ASYNC_DEFAULT", "false").lower() in ("1", "true", "yes")
+JOB_QUEUE_WORKERS = int(os.environ.get("JOB_QUEUE_WORKERS", "4"))
+JOB_QUEUE_MAX_PENDING = int(os.environ.get("JOB_QUEUE_MAX_PENDING", "500"))
+JOB_QUEUE_MAX_PENDING_BYTES = int(float(os.environ.get("JOB_QUEUE_MAX_PENDING_MB", "128")) * 1024 * 1024)
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+
+# Batch uploads: files extracted concurrently, one Tally push per request
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get("BATCH_UPLOAD_MAX_FILES", "100"))
+BATCH_EXTRACT_WORKERS = int(os.environ.get("BATCH_EXTRACT_WORKERS", "4"))
+
+# Tenants (TALLY_TENANTS_FILE) map users and organizations to their own Tally
+# server, company and ledgers; everyone else uses the TALLY_* defaults. Each
+# Tally server gets one long-lived pooled client with a concurrency cap.
+tenants = tenant_registry.load_registry(
+    tenant_registry.Tenant(
+        "default", TALLY_URL, TALLY_COMPANY,
+        ledger=TALLY_LEDGER,
+        contra_ledger=TALLY_CONTRA_LEDGER,
+        max_concurrency=TALLY_MAX_CONCURRENCY,
+    ),
+    client_options=dict(
+        pool_size=TALLY_POOL_SIZE,
+        max_retries=TALLY_MAX_RETRIES,
+        backoff_base=TALLY_RETRY_BACKOFF_BASE,
+        connect_timeout=TALLY_CONNECT_TIMEOUT,
+        read_timeout=TALLY_REQUEST_TIMEOUT,
+        ledger_cache_ttl=TALLY_LEDGER_CACHE_TTL,
+        import_chunk_size=TALLY_IMPORT_CHUNK_SIZE,
+        import_max_in_flight=TALLY_IMPORT_MAX_IN_FLIGHT,
+        stream_requests=TALLY_STREAM_REQUESTS,
+        masters_refresh_interval=TALLY_MASTERS_REFRESH,
+        match_min_score=TALLY_MATCH_MIN_SCORE,
+    ),
+)
+
+# Subscription status served from a per-process TTL cache
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get("SUBSCRIPTION_CACHE_TTL", "60"))
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = float(os.environ.get("SUBSCRIPTION_CACHE_NEGATIVE_TTL", "15"))
+SUBSCRIPTION_CACHE_MAX_ENTRIES = int(os.environ.get("SUBSCRIPTION_CACHE_MAX_ENTRIES", "10000"))
+SUBSCRIPTION_CHECK_MAX_USERS = int(os.environ.get("SUBSCRIPTION_CHECK_MAX_USERS", "100"))
 
-    # # Configure Gemini API from environment variable
-    # GEMINI_API_KEY = os.environ.get('GOOGLE_API_KEY')
-    # if not GEMINI_API_KEY:
-    #     raise ValueError("GOOGLE_API_KEY environment variable not set.")
-    # genai.configure(api_key=GEMINI_API_KEY)
-    # logger.info("Gemini API configured successfully.")
-
-    # Configuration for Tally and voucher defaults
-    TALLY_URL = os.environ.get("TALLY_URL", "http://localhost:9000")
-    TALLY_COMPANY = os.environ.get("TALLY_COMPANY", "A")
-    TALLY_LEDGER = os.environ.get("TALLY_LEDGER", "Main Ledger")
-    TALLY_REQUEST_TIMEOUT = float(os.environ.get("TALLY_REQUEST_TIMEOUT", "20"))
-    TALLY_MAX_RETRIES = int(os.environ.get("TALLY_MAX_RETRIES", "3"))
-    TALLY_RETRY_BACKOFF_BASE = float(os.environ.get("TALLY_RETRY_BACKOFF_BASE", "0.5"))
-except Exception as e:
-    logger.exception(f"Failed to initialize a service: {e}")
-    db = None
-    GEMINI_API_KEY = None
-    # Provide safe fallbacks so app can still start (but endpoint will guard usage)
-    TALLY_URL = os.environ.get("TALLY_URL", "http://localhost:9000")
-    TALLY_COMPANY = os.environ.get("TALLY_COMPANY", "A")
-    TALLY_LEDGER = os.environ.get("TALLY_LEDGER", "Main Ledger")
-    TALLY_REQUEST_TIMEOUT = float(os.environ.get("TALLY_REQUEST_TIMEOUT", "20"))
-    TALLY_MAX_RETRIES = int(os.environ.get("TALLY_MAX_RETRIES", "3"))
-    TALLY_RETRY_BACKOFF_BASE = float(os.environ.get("TALLY_RETRY_BACKOFF_BASE", "0.5"))
+subscriptions = subscription_cache.SubscriptionCache(
+    lambda: services.get("firestore"),
+    ttl_seconds=SUBSCRIPTION_CACHE_TTL,
+    negative_ttl_seconds=SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+    max_entries=SUBSCRIPTION_CACHE_MAX_ENTRIES,
+)
+
+# Extracted invoices are persisted to Firestore through a buffered background writer
+PERSIST_INVOICES = os.environ.get("PERSIST_INVOICES", "false").lower() in ("1", "true", "yes")
+INVOICES_COLLECTION = os.environ.get(
+    "INVOICES_COLLECTION", "artifacts/default-app-id/public/data/invoices"
+)
+
+def _persist_invoice(file_name, user_id, success, message, items) -> Optional[str]:
+    """Queue an invoice document and one document per line item; returns the invoice id"""
+    writer = firestore_writer.get_writer(lambda: services.get("firestore"))
+    invoice_id = uuid.uuid4().hex
+    try:
+        writer.set(INVOICES_COLLECTION, invoice_id, {
+            'fileName': file_name,
+            'userId': user_id,
+            'status': 'Success' if success else 'Failed',
+            'message': message,
+            'itemCount': len(items) if items is not None else 0,
+            'uploadedAt': datetime.now(timezone.utc),
+        })
+        for index, item in enumerate(items if items is not None else []):
+            writer.set(f"{INVOICES_COLLECTION}/{invoice_id}/lineItems", f"{index:05d}", {
+                'description': item.name,
+                'quantity': item.qty,
+                'unit': item.unit,
+                'rate': item.rate,
+                'netWorth': item.net_worth,
+                'vat': item.vat,
+                'gross': item.gross,
+            })
+    except firestore_writer.WriterBusy:
+        logger.warning(f"Firestore write buffer full, invoice {file_name} not persisted")
+        return None
+    return invoice_id
+
+# Extracted items are committed to a durable outbox and pushed to Tally in
+# the background, so uploads do not wait for Tally or fail while it is off.
+# The outbox is only used with a TALLY_OUTBOX_PATH on persistent storage;
+# without one, items are pushed to Tally during the upload as before
+TALLY_OUTBOX_PATH = os.environ.get("TALLY_OUTBOX_PATH", "")
+TALLY_OUTBOX_ENABLED = os.environ.get("TALLY_OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+if TALLY_OUTBOX_ENABLED and not TALLY_OUTBOX_PATH:
+    if "TALLY_OUTBOX_ENABLED" in os.environ:
+        logger.warning("TALLY_OUTBOX_ENABLED is set but TALLY_OUTBOX_PATH is not; Tally outbox disabled")
+    TALLY_OUTBOX_ENABLED = False
+
+outbox = tally_outbox.get_outbox(tenants.client_for_url) if TALLY_OUTBOX_ENABLED else None
+
+def new_invoice_processor(tenant_id: Optional[str] = None) -> InvoiceProcessor.InvoiceProcessor:
+    """InvoiceProcessor for a tenant (default: the default tenant), wired to its pooled client and the outbox"""
+    tenant = tenants.get(tenant_id) if tenant_id else tenants.default
+    tenant = tenant or tenants.default
+    return InvoiceProcessor.InvoiceProcessor(
+        company_name=tenant.company,
+        ledger_name=tenant.ledger,
+        contra_ledger=tenant.contra_ledger,
+        tally_client=tenants.client(tenant),
+        outbox=outbox,
+    )
+
+invoice_jobs = job_queue.JobQueue(
+    new_invoice_processor,
+    max_workers=JOB_QUEUE_WORKERS,
+    max_pending=JOB_QUEUE_MAX_PENDING,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    max_pending_bytes=JOB_QUEUE_MAX_PENDING_BYTES,
+    admission_controller=admission.get_controller(),
+)
 
 SYSTEM_PROMPT = """
 You will get the extracted OCR text from a document like an invoice. Your task is to return the data in a structured JSON format for data entry. The JSON should be a single object containing the following keys: 'invoiceNumber', 'date', 'customerName', 'totalAmount', and 'items'. The 'items' key should be an array of objects, each with 'description', 'quantity', 'price', and 'total'. Do not include any other text or context. Return only the JSON object.
@@ -79,8 +260,20 @@ You will get the extracted OCR text from a document like an invoice. Your task i
 
 
 
+# Upload admission: size limit and a budget of estimated decoded-image memory
+MAX_UPLOAD_BYTES = admission.max_upload_bytes()
+upload_admission = admission.get_controller()
+
+def _upload_too_large():
+    return jsonify({'error': f'File too large, the limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
+
+
 @app.route('/upload-invoice', methods=['POST'])
 def upload_invoice():
+    # Reject oversized uploads before the body is parsed (allow for the other form fields)
+    if request.content_length and request.content_length > MAX_UPLOAD_BYTES + 64 * 1024:
+        return _upload_too_large()
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file part in the request'}), 400
 
@@ -90,6 +283,31 @@ def upload_invoice():
         return jsonify({'error': 'No selected file'}), 400
     # if not db or not GEMINI_API_KEY:
     #     return jsonify({'error': 'Backend services are not initialized'}), 500
+
+    backend = _requested_backend()
+    if backend and not extraction_backends.request_selectable(backend):
+        return jsonify({'error': f'Unknown extraction backend: {backend}'}), 400
+
+    user_id = _authenticated_user_id()
+    wants_async = _wants_async()
+    if user_id is None and (wants_async or PERSIST_INVOICES):
+        # Jobs and persisted invoices are owned by the authenticated user
+        raise Unauthorized("Missing ID token")
+    tenant = _request_tenant(user_id)
+    if wants_async:
+        try:
+            with admission.open_upload(file, MAX_UPLOAD_BYTES) as file_data:
+                job = invoice_jobs.submit(user_id, file.filename, bytes(file_data), backend,
+                                          tenant_id=tenant.tenant_id)
+        except admission.UploadTooLarge:
+            return _upload_too_large()
+        except queue.Full:
+            return jsonify({'error': 'Too many pending invoices, please retry later'}), 503
+        return jsonify({
+            'message': 'Invoice queued for processing',
+            'jobId': job.job_id,
+            'status': job.status,
+        }), 202, {'Location': f"/jobs/{job.job_id}"}
     
     try:
         # Step 1: Process the invoice file with OCR and Gemini
@@ -99,8 +317,21 @@ def upload_invoice():
         #     return jsonify({'error': 'Failed to process invoice with AI'}), 500
 
         # Step 2: Push data to Tally
-        success, message = InvoiceProcessor.InvoiceProcessor().process_file(file)
-        print(success, message)
+        # Large uploads are decoded from an mmap of the spooled file, and
+        # only once their estimated decoded size fits the memory budget
+        extracted = []
+        queued = []
+        with admission.open_upload(file, MAX_UPLOAD_BYTES) as file_data:
+            with upload_admission.admit(admission.estimate_cost(file_data)):
+                success, message = new_invoice_processor(tenant.tenant_id).process_file(
+                    file_data, backend=backend, items_callback=extracted.append,
+                    outbox_callback=queued.append
+                )
+        logger.info("Upload processed: success=%s, %s", success, message)
+        invoice_id = None
+        if PERSIST_INVOICES:
+            invoice_id = _persist_invoice(file.filename, user_id, success,
+                                          message, extracted[0] if extracted else None)
         # tally_status = tally_result.get('tally_status', 'Failed')
         # tally_response = tally_result.get('response') or ''
         # tally_error = tally_result.get('error')
@@ -139,19 +370,207 @@ def upload_invoice():
         #     'tallyError': tally_error,
         #     'invoiceId': doc_ref[1].id
         # }), 200
-        return jsonify({
+        response = {
             'message': 'Invoice processed successfully',
             'status': success,
             # 'data': extracted_data,
             'message': message
-             }), 200
+             }
+        if invoice_id:
+            response['invoiceId'] = invoice_id
+        if queued:
+            response['outboxId'] = queued[0]
+        return jsonify(response), 200
+    except admission.UploadTooLarge:
+        return _upload_too_large()
+    except admission.Overloaded as e:
+        logger.warning(f"Shedding upload {file.filename}: memory budget exhausted")
+        return jsonify({'error': 'Server is busy, please retry later'}), 429, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         logger.exception(f"An error occurred while processing invoice: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/upload-invoices', methods=['POST'])
+def upload_invoices():
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files in the request'}), 400
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        return jsonify({'error': f'Too many files, at most {BATCH_UPLOAD_MAX_FILES} per request'}), 400
+
+    backend = _requested_backend()
+    if backend and not extraction_backends.request_selectable(backend):
+        return jsonify({'error': f'Unknown extraction backend: {backend}'}), 400
+
+    tenant = _request_tenant(_authenticated_user_id())
+    try:
+        # Same limits as /upload-invoice: each file opened without copying
+        # (mmapped when large), and the whole batch's estimated decoded
+        # size reserved from the shared memory budget before any decoding
+        with contextlib.ExitStack() as stack:
+            batch = [(f.filename, stack.enter_context(admission.open_upload(f, MAX_UPLOAD_BYTES)))
+                     for f in files]
+            cost = sum(admission.estimate_cost(file_data) for _, file_data in batch)
+            with upload_admission.admit(cost):
+                success, message, results = new_invoice_processor(tenant.tenant_id).process_files(
+                    batch,
+                    max_workers=BATCH_EXTRACT_WORKERS,
+                    backend=backend,
+                )
+        return jsonify({
+            'status': success,
+            'message': message,
+            'files': results,
+        }), 200
+    except admission.UploadTooLarge:
+        return _upload_too_large()
+    except admission.Overloaded as e:
+        logger.warning(f"Shedding batch of {len(files)} files: memory budget exhausted")
+        return jsonify({'error': 'Server is busy, please retry later'}), 429, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        logger.exception(f"An error occurred while processing invoices: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+class Unauthorized(Exception):
+    """The request's Firebase ID token could not be verified"""
+
+
+@app.errorhandler(Unauthorized)
+def _unauthorized(e):
+    return jsonify({'error': str(e)}), 401
+
+def _authenticated_user_id() -> Optional[str]:
+    """
+    uid of the Firebase ID token in the Authorization header, or None if
+    the request has none
+
+    Raises:
+        Unauthorized: If the token is invalid, expired or revoked
+    """
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    from firebase_admin import auth
+    # The Firebase app is initialized along with the Firestore client
+    services.get("firestore")
+    try:
+        return auth.verify_id_token(header[len('Bearer '):].strip())['uid']
+    except (ValueError, auth.InvalidIdTokenError, auth.RevokedIdTokenError, auth.UserDisabledError) as e:
+        raise Unauthorized(f"Invalid ID token: {e}")
+
+def _request_tenant(user_id: Optional[str]) -> tenant_registry.Tenant:
+    """
+    Tenant of the authenticated user or of their organization
+
+    The user comes from the verified ID token (see _authenticated_user_id)
+    and the organization from the org_id of their user document, never
+    from ids in the request, so a caller cannot route items into another
+    tenant's Tally. Requests without a token use the default tenant.
+    """
+    if user_id is None:
+        return tenants.default
+    return tenants.resolve(user_id, subscriptions.organization(user_id))
+
+def _requested_backend():
+    """Extraction backend named in the request, if any"""
+    return request.args.get('backend') or request.form.get('backend') or None
+
+def _wants_async() -> bool:
+    """Whether the upload should be queued instead of processed inline"""
+    value = request.args.get('async', request.form.get('async'))
+    if value is None:
+        return UPLOAD_ASYNC_DEFAULT
+    return value.lower() in ("1", "true", "yes")
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    user_id = _authenticated_user_id()
+    if user_id is None:
+        raise Unauthorized("Missing ID token")
+    job = invoice_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    user_id = _authenticated_user_id()
+    if user_id is None:
+        raise Unauthorized("Missing ID token")
+    return jsonify({'jobs': [job.to_dict() for job in invoice_jobs.jobs_for_user(user_id)]}), 200
+
+@app.route('/tally-outbox/<outbox_id>', methods=['GET'])
+def get_outbox_entry(outbox_id):
+    if outbox is None:
+        return jsonify({'error': 'Tally outbox is disabled'}), 404
+    entry = outbox.get(outbox_id)
+    if entry is None:
+        return jsonify({'error': 'Outbox entry not found'}), 404
+    return jsonify(entry), 200
+
+@app.route('/tally-outbox', methods=['GET'])
+def list_outbox():
+    if outbox is None:
+        return jsonify({"enabled": False}), 200
+    limit = min(int(request.args.get('limit', '100')), 1000)
+    return jsonify({"enabled": True, **outbox.metrics(),
+                    "entries": outbox.entries(request.args.get('status'), limit)}), 200
+
+@app.route('/tally-outbox/<outbox_id>/retry', methods=['POST'])
+def retry_outbox_entry(outbox_id):
+    if outbox is None or not outbox.retry(outbox_id):
+        return jsonify({'error': 'No failed outbox entry with that id'}), 404
+    return jsonify(outbox.get(outbox_id)), 202
+
+@app.route("/api/cache-stats")
+def cache_stats():
+    cache = extraction_cache.get_cache()
+    if cache is None:
+        return jsonify({"enabled": False, "subscriptions": subscriptions.stats()}), 200
+    return jsonify({"enabled": True, "counters": cache.stats(),
+                    "subscriptions": subscriptions.stats()}), 200
+
+@app.route("/metrics")
+def metrics():
+    return instrumentation.registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def _extraction_cache_stats():
+    cache = extraction_cache.get_cache()
+    return cache.stats() if cache is not None else {}
+
+instrumentation.registry.register_collector("extraction_cache", _extraction_cache_stats)
+instrumentation.registry.register_collector("llm", lambda: llm_client.get_llm_client().metrics())
+instrumentation.registry.register_collector("ocr_engine", ocr_engine.metrics)
+instrumentation.registry.register_collector("subscription_cache", lambda: subscriptions.stats())
+instrumentation.registry.register_collector("firestore_writer", firestore_writer.metrics)
+instrumentation.registry.register_collector("admission", upload_admission.metrics)
+instrumentation.registry.register_collector("tally_outbox", tally_outbox.metrics)
+instrumentation.registry.register_collector("tenants", tenants.metrics)
+instrumentation.registry.register_collector("tally_masters", tenants.masters_metrics)
+instrumentation.registry.register_collector("job_queue", lambda: {"pending": invoice_jobs.pending_count(),
+                                                                 "pending_bytes": invoice_jobs.pending_bytes()})
+
+@app.route("/api/llm-stats")
+def llm_stats():
+    return jsonify(llm_client.get_llm_client().metrics()), 200
+
+@app.route("/api/ocr-stats")
+def ocr_stats():
+    engine = ocr_engine.get_engine()
+    if engine is None:
+        return jsonify({"enabled": False, "tesserocr": ocr_engine.tesserocr_available()}), 200
+    return jsonify({"enabled": True, **engine.metrics()}), 200
+
+@app.route("/api/writer-stats")
+def writer_stats():
+    if not PERSIST_INVOICES:
+        return jsonify({"enabled": False}), 200
+    writer = firestore_writer.get_writer(lambda: services.get("firestore"))
+    return jsonify({"enabled": True, **writer.metrics()}), 200
+
 @app.route("/api/health")
 def health():
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "services": services.registry.status()}), 200
 
 @app.route('/create-subscription', methods=['POST'])
 def create_subscription():
@@ -160,7 +579,7 @@ def create_subscription():
         return jsonify({'error': 'RAZORPAY_PLAN_ID not configured'}), 500
 
     try:
-        subscription = razorpay_client.subscription.create({
+        subscription = services.get("razorpay").subscription.create({
             'plan_id': plan_id,
             'customer_notify': 1,
             'total_count': 12,  # Yearly plan
@@ -190,15 +609,16 @@ def payment_callback():
     }
 
     try:
-        razorpay_client.utility.verify_payment_signature(params_dict)
+        services.get("razorpay").utility.verify_payment_signature(params_dict)
         # Payment successful, update user's subscription status in Firestore
-        user_ref = db.collection('users').document(user_id)
+        user_ref = services.get("firestore").collection('users').document(user_id)
         user_ref.update(
             {
                 'subscription_id': razorpay_subscription_id,
                 'subscription_status': 'active'
             }
         )
+        subscriptions.invalidate(user_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         logger.exception(f"An error occurred during payment verification: {e}")
@@ -208,16 +628,17 @@ def payment_callback():
 def check_subscription():
     data = request.get_json()
     user_id = data.get('user_id')
+    user_ids = data.get('user_ids')
 
     try:
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            subscription_status = user_data.get('subscription_status')
-            return jsonify({'subscription_status': subscription_status})
-        else:
-            return jsonify({'subscription_status': 'not_found'})
+        if user_ids is not None:
+            # Several users at once: cache misses are read in one batch
+            if not isinstance(user_ids, list) or not all(isinstance(uid, str) and uid for uid in user_ids):
+                return jsonify({'error': 'user_ids must be a list of user ids'}), 400
+            if len(user_ids) > SUBSCRIPTION_CHECK_MAX_USERS:
+                return jsonify({'error': f'At most {SUBSCRIPTION_CHECK_MAX_USERS} user ids per request'}), 400
+            return jsonify({'subscription_statuses': subscriptions.get_many(user_ids)})
+        return jsonify({'subscription_status': subscriptions.get(user_id)})
     except Exception as e:
         logger.exception(f"An error occurred while checking subscription: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -225,4 +646,5 @@ def check_subscription():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
+    services.prewarm_from_env()
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,358 @@
+"""
+OCR Engine Module
+Server-wide pool of long-lived Tesseract worker processes; page pixels are
+handed over through shared memory instead of temp files or pickled bytes
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+# Tesseract settings matching the previous pytesseract call
+DEFAULT_LANG = "eng"
+DEFAULT_PSM = 6
+
+logger = logging.getLogger("ai-tally-agent.ocr_engine")
+
+
+class OCREngineBusy(Exception):
+    """Raised when no OCR slot frees up before the caller's timeout"""
+
+
+def tesserocr_available() -> bool:
+    """Whether tesserocr (Tesseract's in-process API) can be imported"""
+    global _tesserocr_available
+    if _tesserocr_available is None:
+        try:
+            import tesserocr  # noqa: F401
+            _tesserocr_available = True
+        except ImportError:
+            _tesserocr_available = False
+    return _tesserocr_available
+
+
+_tesserocr_available: Optional[bool] = None
+
+
+class _TesseractRunner:
+    """
+    One initialized Tesseract: tesserocr's in-process API when installed
+    (the language model is loaded once), otherwise pytesseract, which
+    starts a tesseract process per image
+    """
+
+    def __init__(self, lang: str = DEFAULT_LANG, psm: int = DEFAULT_PSM):
+        self.lang = lang
+        self.psm = psm
+        try:
+            import tesserocr
+            self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM(psm))
+        except ImportError:
+            self._api = None
+
+    def image_to_string(self, pixels: np.ndarray) -> str:
+        if self._api is None:
+            import pytesseract
+            return pytesseract.image_to_string(pixels, lang=self.lang, config=f"--psm {self.psm}")
+        pixels = np.ascontiguousarray(pixels)
+        height, width = pixels.shape[:2]
+        channels = pixels.shape[2] if pixels.ndim == 3 else 1
+        self._api.SetImageBytes(pixels.tobytes(), width, height, channels, width * channels)
+        return self._api.GetUTF8Text()
+
+    def close(self) -> None:
+        if self._api is not None:
+            self._api.End()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Open a segment created by the parent
+
+    Workers share the parent's resource tracker, so attaching only repeats
+    the parent's registration and the segment is unlinked once, by the
+    parent.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(conn, lang: str, psm: int) -> None:
+    """Worker process loop: OCR (segment, shape) jobs until told to stop"""
+    runner = _TesseractRunner(lang, psm)
+    segment = None
+    try:
+        while True:
+            job = conn.recv()
+            if job is None:
+                return
+            name, shape = job
+            try:
+                if segment is None or segment.name.lstrip("/") != name.lstrip("/"):
+                    if segment is not None:
+                        segment.close()
+                    segment = _attach(name)
+                pixels = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+                conn.send((True, runner.image_to_string(pixels)))
+                del pixels
+            except Exception as e:
+                conn.send((False, f"{type(e).__name__}: {str(e)}"))
+    except (EOFError, KeyboardInterrupt):
+        return
+    finally:
+        if segment is not None:
+            segment.close()
+        runner.close()
+
+
+class _Worker:
+    """Parent-side handle of one worker process and its shared segment"""
+
+    def __init__(self, context, lang: str, psm: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, lang, psm), name="ocr-worker", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.segment: Optional[shared_memory.SharedMemory] = None
+
+    def buffer_for(self, size: int) -> shared_memory.SharedMemory:
+        """Shared segment of at least size bytes, grown by replacing it"""
+        if self.segment is None or self.segment.size < size:
+            self._release_segment()
+            # Round up so slightly larger pages reuse the segment
+            self.segment = shared_memory.SharedMemory(create=True, size=max(size, 1) * 5 // 4)
+        return self.segment
+
+    def stop(self, timeout: float = 2.0) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout)
+        self.conn.close()
+        self._release_segment()
+
+    def _release_segment(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+
+class OCREngine:
+    """
+    Pool of Tesseract worker processes shared by every request
+
+    Callers block in image_to_string until a worker is free. At most
+    max_pending callers may wait at once; beyond that, or once a caller's
+    timeout expires, OCREngineBusy is raised. A worker that exceeds the
+    job timeout is killed and replaced, and every worker is replaced after
+    max_jobs_per_worker jobs to contain leaks in Tesseract.
+    """
+
+    def __init__(self, workers: int = 2, max_jobs_per_worker: int = 500, max_pending: int = 64,
+                 queue_timeout: float = 60.0, job_timeout: float = 120.0,
+                 lang: str = DEFAULT_LANG, psm: int = DEFAULT_PSM, start_method: str = "spawn"):
+        """
+        Initialize engine (worker processes start on first use)
+
+        Args:
+            workers: Worker processes
+            max_jobs_per_worker: Jobs after which a worker is recycled
+            max_pending: Callers allowed to wait for a free worker
+            queue_timeout: Longest wait for a free worker
+            job_timeout: Longest time one image may take
+            lang: Tesseract language
+            psm: Tesseract page segmentation mode
+            start_method: multiprocessing start method for workers
+        """
+        self.workers = max(1, workers)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.queue_timeout = queue_timeout
+        self.job_timeout = job_timeout
+        self.lang = lang
+        self.psm = psm
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_pending))
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._counters = {"jobs": 0, "failures": 0, "timeouts": 0, "rejected": 0, "recycled": 0}
+
+    def start(self) -> None:
+        """Start the worker processes (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.workers):
+                self._idle.put(self._spawn())
+            self._started = True
+
+    def image_to_string(self, pixels: np.ndarray, timeout: Optional[float] = None) -> str:
+        """
+        OCR one decoded page
+
+        Args:
+            pixels: uint8 array of shape (height, width) or (height, width, channels)
+            timeout: Longest wait for a free worker (default: queue_timeout)
+
+        Raises:
+            OCREngineBusy: If no worker became free in time
+            TimeoutError: If the worker exceeded job_timeout
+            RuntimeError: If Tesseract failed on the image
+        """
+        if self._closed:
+            raise RuntimeError("OCR engine is shut down")
+        self.start()
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise OCREngineBusy("Too many images waiting for OCR")
+        try:
+            try:
+                worker = self._idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._count("rejected")
+                raise OCREngineBusy(f"No OCR worker free within {timeout:.0f}s")
+            try:
+                return self._run(worker, pixels)
+            finally:
+                self._idle.put(self._maybe_recycle(worker))
+        finally:
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "idle": self._idle.qsize(), **self._counters}
+
+    def shutdown(self) -> None:
+        """Stop all idle workers; busy ones stop when handed back"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def _run(self, worker: _Worker, pixels: np.ndarray) -> str:
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        segment = worker.buffer_for(pixels.nbytes)
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=segment.buf)[...] = pixels
+        worker.jobs += 1
+        self._count("jobs")
+        try:
+            worker.conn.send((segment.name, pixels.shape))
+            if not worker.conn.poll(self.job_timeout):
+                self._count("timeouts")
+                worker.jobs = self.max_jobs_per_worker  # recycle: it may still be busy
+                raise TimeoutError(f"OCR took longer than {self.job_timeout:.0f}s")
+            ok, text = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            worker.jobs = self.max_jobs_per_worker
+            self._count("failures")
+            raise RuntimeError(f"OCR worker died: {str(e)}")
+        if not ok:
+            self._count("failures")
+            raise RuntimeError(f"Tesseract failed: {text}")
+        return text
+
+    def _maybe_recycle(self, worker: _Worker) -> _Worker:
+        """Replace a worker that has done its share of jobs or died"""
+        if self._closed or worker.jobs >= self.max_jobs_per_worker or not worker.process.is_alive():
+            worker.stop()
+            if self._closed:
+                return worker
+            self._count("recycled")
+            return self._spawn()
+        return worker
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.lang, self.psm)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+
+_engine: Optional[OCREngine] = None
+_engine_lock = threading.Lock()
+_in_process = threading.local()
+_in_process_only = False
+
+
+def use_in_process() -> None:
+    """
+    Make image_to_string OCR in the calling process (one persistent
+    Tesseract per thread) instead of the worker pool; for processes that
+    are themselves OCR workers, such as folder mode's process pool
+    """
+    global _in_process_only
+    _in_process_only = True
+
+
+def get_engine() -> Optional[OCREngine]:
+    """
+    Process-wide engine configured from OCR_ENGINE_WORKERS (0 disables the
+    pool), OCR_ENGINE_MAX_JOBS, OCR_ENGINE_MAX_PENDING, OCR_ENGINE_QUEUE_TIMEOUT
+    and OCR_ENGINE_JOB_TIMEOUT
+
+    The pool needs tesserocr: pytesseract starts a tesseract process and
+    reloads the language model per image anyway, so without tesserocr a
+    worker would only add a hop. Without it the pool stays off (with a
+    warning) and OCR runs in the calling process as before.
+    """
+    global _engine, _in_process_only
+    if _in_process_only:
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                workers = int(os.environ.get("OCR_ENGINE_WORKERS", str(min(4, os.cpu_count() or 1))))
+                if workers <= 0:
+                    return None
+                if not tesserocr_available():
+                    logger.warning("tesserocr is not installed; OCR_ENGINE_WORKERS=%d ignored, "
+                                   "OCR runs pytesseract in the calling process", workers)
+                    _in_process_only = True
+                    return None
+                _engine = OCREngine(
+                    workers=workers,
+                    max_jobs_per_worker=int(os.environ.get("OCR_ENGINE_MAX_JOBS", "500")),
+                    max_pending=int(os.environ.get("OCR_ENGINE_MAX_PENDING", "64")),
+                    queue_timeout=float(os.environ.get("OCR_ENGINE_QUEUE_TIMEOUT", "60")),
+                    job_timeout=float(os.environ.get("OCR_ENGINE_JOB_TIMEOUT", "120")),
+                )
+                atexit.register(_engine.shutdown)
+    return _engine
+
+
+def metrics() -> dict:
+    """Counters of the process-wide engine, empty if it was never created"""
+    stats = _engine.metrics() if _engine is not None else {}
+    stats["tesserocr"] = int(tesserocr_available())
+    return stats
+
+
+def image_to_string(pixels: np.ndarray) -> str:
+    """OCR one page on the shared engine, or in-process if the pool is disabled"""
+    engine = get_engine()
+    if engine is not None:
+        return engine.image_to_string(pixels)
+    runner = getattr(_in_process, "runner", None)
+    if runner is None:
+        runner = _in_process.runner = _TesseractRunner()
+    return runner.image_to_string(pixels)
@@ -0,0 +1,181 @@
+"""
+Service Registry Module
+Heavy clients (Firestore, Razorpay, Gemini, OCR) are created on first use
+instead of at import, with an optional background prewarm and a startup
+profile of import and initialization times
+"""
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("ai-tally-agent.services")
+
+
+class ServiceRegistry:
+    """Named, lazily created, process-wide service instances"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], object]] = {}
+        self._instances: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._init_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], object]) -> None:
+        """Register a zero-argument factory; nothing is created yet"""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._instances.pop(name, None)
+
+    def get(self, name: str):
+        """
+        Return the service, creating it on first use
+
+        Concurrent first calls wait for a single factory run. A factory
+        that raises is tried again on the next call.
+
+        Raises:
+            KeyError: If no service has that name
+        """
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            factory = self._factories[name]
+            lock = self._locks[name]
+        with lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                instance = factory()
+                self._init_seconds[name] = time.perf_counter() - start
+                self._instances[name] = instance
+            return self._instances[name]
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._factories)
+
+    def status(self) -> Dict[str, dict]:
+        """Whether each service is created yet and how long it took"""
+        with self._lock:
+            return {
+                name: {
+                    "ready": name in self._instances,
+                    "init_seconds": round(self._init_seconds[name], 4) if name in self._init_seconds else None,
+                }
+                for name in self._factories
+            }
+
+    def prewarm(self, names: Optional[Iterable[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Create services ahead of their first request
+
+        Failures are printed and left for the first real use to retry.
+
+        Args:
+            names: Services to create (default: all registered)
+            background: Run on a daemon thread instead of blocking
+
+        Returns:
+            The prewarm thread when background is True
+        """
+        names = list(names) if names is not None else self.names()
+
+        def run() -> None:
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    logger.warning("Prewarm of service '%s' failed: %s", name, e)
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="service-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+
+registry = ServiceRegistry()
+
+
+def register(name: str, factory: Callable[[], object]) -> None:
+    """Register a service factory on the process-wide registry"""
+    registry.register(name, factory)
+
+
+def get(name: str):
+    """Service from the process-wide registry, created on first use"""
+    return registry.get(name)
+
+
+def prewarm_from_env() -> Optional[threading.Thread]:
+    """
+    Start a background prewarm of the services named in PREWARM_SERVICES
+    (comma-separated, "all" by default, "none" or empty to disable)
+    """
+    setting = os.environ.get("PREWARM_SERVICES", "all").strip().lower()
+    if setting in ("", "none", "false", "0"):
+        return None
+    names = None if setting == "all" else [name.strip() for name in setting.split(",") if name.strip()]
+    return registry.prewarm(names)
+
+
+def profile_startup(module: str = "main", top: int = 25) -> int:
+    """
+    Import module, then create every registered service, and print the
+    time spent per imported module and per service
+
+    Import times are self times: time spent importing a module minus the
+    time spent in the imports it triggered.
+
+    Returns:
+        Process exit code
+    """
+    imports: List[Tuple[str, float, float]] = []
+    stack: List[List[float]] = []
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        stack.append([0.0])
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()[0]
+            if stack:
+                stack[-1][0] += elapsed
+            imports.append((name, elapsed - children, elapsed))
+
+    start = time.perf_counter()
+    builtins.__import__ = timed_import
+    try:
+        __import__(module)
+    finally:
+        builtins.__import__ = original_import
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    registry.prewarm(background=False)
+    init_seconds = time.perf_counter() - start
+
+    print(f"Imported {module} in {import_seconds:.3f}s ({len(imports)} modules)")
+    print(f"{'module':<50} {'self s':>9} {'total s':>9}")
+    for name, self_seconds, total_seconds in sorted(imports, key=lambda entry: entry[1], reverse=True)[:top]:
+        print(f"{name:<50} {self_seconds:>9.4f} {total_seconds:>9.4f}")
+    print()
+    print(f"Initialized services in {init_seconds:.3f}s")
+    print(f"{'service':<50} {'ready':>9} {'init s':>9}")
+    for name, state in registry.status().items():
+        seconds = f"{state['init_seconds']:.4f}" if state["init_seconds"] is not None else "-"
+        print(f"{name:<50} {str(state['ready']):>9} {seconds:>9}")
+    return 0
@@ -0,0 +1,164 @@
+"""
+Subscription Cache Module
+Per-process TTL cache of users' subscription status and organization in
+front of the Firestore users collection
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Status reported for users without a document
+NOT_FOUND = "not_found"
+
+# (subscription_status, org_id) of a user document
+_Record = Tuple[Optional[str], Optional[str]]
+
+
+class SubscriptionCache:
+    """
+    Thread-safe LRU of subscription status and organization per user id
+
+    Known users are kept for ttl_seconds; unknown users (NOT_FOUND) for
+    negative_ttl_seconds so a user who signs up shortly after is seen
+    soon. Writers must call invalidate() after changing a user document.
+    """
+
+    def __init__(self, client_getter: Callable[[], object], collection: str = "users",
+                 ttl_seconds: float = 60, negative_ttl_seconds: float = 15,
+                 max_entries: int = 10000):
+        """
+        Initialize cache
+
+        Args:
+            client_getter: Returns the Firestore client (called on each miss)
+            collection: Collection holding one document per user id
+            ttl_seconds: How long a found user's status is served from cache
+            negative_ttl_seconds: How long NOT_FOUND is served from cache
+            max_entries: Most user ids kept
+        """
+        self.client_getter = client_getter
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[_Record, float]]" = OrderedDict()
+        # Invalidation epoch per user, so a read that raced an invalidation
+        # is returned but not cached
+        self._epoch = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "reads": 0, "invalidations": 0}
+
+    def get(self, user_id: str) -> Optional[str]:
+        """
+        Subscription status of a user
+
+        Returns:
+            The user's subscription_status (None if the document has none),
+            or NOT_FOUND if there is no user document
+        """
+        return self._record(user_id)[0]
+
+    def organization(self, user_id: str) -> Optional[str]:
+        """org_id of a user's document, or None if it has none or there is no document"""
+        return self._record(user_id)[1]
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Subscription status of several users, reading all misses from
+        Firestore in one get_all call
+        """
+        statuses: Dict[str, Optional[str]] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            record = self._cached(user_id)
+            if record is not None:
+                statuses[user_id] = record[0]
+            else:
+                missing.append(user_id)
+        if missing:
+            epoch = self._epoch
+            client = self.client_getter()
+            users = client.collection(self.collection)
+            snapshots = client.get_all([users.document(user_id) for user_id in missing])
+            self._count("reads")
+            for snapshot in snapshots:
+                statuses[snapshot.id] = self._store(snapshot.id, snapshot, epoch)[0]
+            for user_id in missing:
+                # get_all omits nothing in practice, but never leave a gap
+                statuses.setdefault(user_id, NOT_FOUND)
+        return statuses
+
+    def invalidate(self, user_id: str) -> None:
+        """Forget a user's cached status (call after updating the document)"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._epoch += 1
+            self._invalidated.pop(user_id, None)
+            self._invalidated[user_id] = self._epoch
+            while len(self._invalidated) > self.max_entries:
+                self._invalidated.popitem(last=False)
+            self._counters["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
+
+    def _record(self, user_id: str) -> _Record:
+        """(subscription_status, org_id) of a user, from cache or Firestore"""
+        record = self._cached(user_id)
+        if record is not None:
+            return record
+        epoch = self._epoch
+        snapshot = self._users().document(user_id).get()
+        self._count("reads")
+        return self._store(user_id, snapshot, epoch)
+
+    def _cached(self, user_id: str) -> Optional[_Record]:
+        """The record on a fresh hit, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                record, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(user_id)
+                    self._counters["hits"] += 1
+                    return record
+                del self._entries[user_id]
+            self._counters["misses"] += 1
+            return None
+
+    def _store(self, user_id: str, snapshot, epoch: int) -> _Record:
+        """
+        Cache the record read from a document snapshot and return it
+
+        Args:
+            epoch: Invalidation epoch when the read started
+        """
+        if snapshot.exists:
+            data = snapshot.to_dict() or {}
+            record = (data.get("subscription_status"), data.get("org_id"))
+            ttl = self.ttl_seconds
+        else:
+            record = (NOT_FOUND, None)
+            ttl = self.negative_ttl_seconds
+        with self._lock:
+            if self._invalidated.get(user_id, 0) > epoch:
+                return record
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (record, time.monotonic() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return record
+
+    def _users(self):
+        return self.client_getter().collection(self.collection)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
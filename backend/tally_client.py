@@ -2,51 +2,308 @@
 Tally ERP Integration Module
 Handles all Tally XML generation and API communication
 """
-import uuid
+import logging
+import re
+import sqlite3
+import threading
+import time
 import random
+import xml.etree.ElementTree as ET
 import requests
-from typing import List, Optional
+import requests.adapters
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from xml.sax.saxutils import escape
+
+import instrumentation
+import tally_masters
+from line_items import LineItem, LineItemBatch, parse_number
+import voucher_index as voucher_index_module
+from voucher_index import VoucherIndex, voucher_guid, voucher_keys, voucher_number
+
+logger = logging.getLogger("ai-tally-agent.tally_client")
+
+# Tally reports unknown ledgers in <LINEERROR> as "Ledger 'X' does not exist!"
+_MISSING_LEDGER_RE = re.compile(r"Ledger\s+'?([^'<]*?)'?\s+does not exist", re.IGNORECASE)
+
+# Extra entities needed when a value goes inside a double-quoted attribute
+_ATTR_ENTITIES = {'"': "&quot;"}
+
+# Vouchers per import outcome, exported at /metrics
+_VOUCHER_OUTCOMES = instrumentation.registry.counter(
+    "tally_vouchers_total", "Vouchers sent to Tally by outcome", ("status",)
+)
+
+# Streamed request bodies are sent in chunks of about this many bytes
+_STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _coalesce(fragments: Iterable[bytes], size: int = _STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Group small XML fragments into chunks of about size bytes"""
+    buffer = []
+    buffered = 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        buffered += len(fragment)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class ImportResult:
+    """Per-voucher outcome of a voucher import"""
+
+    CREATED = "created"
+    ALTERED = "altered"
+    IMPORTED = "imported"  # accepted, but Tally's counts don't say created or altered
+    ERROR = "error"
+    SKIPPED = "skipped"    # invalid line item, never sent
+    DUPLICATE = "duplicate"  # pushed before according to the voucher index, not sent
+
+    def __init__(self, total: int):
+        self.outcomes: List[dict] = [
+            {"index": i, "status": None, "error": None, "retryable": False} for i in range(total)
+        ]
+        self._lock = threading.Lock()
+
+    def set(self, index: int, status: str, error: Optional[str] = None, retryable: bool = False) -> None:
+        """
+        Record a voucher's outcome
+
+        Args:
+            retryable: The error was a transport failure (Tally unreachable
+                or timed out), so the voucher may be sent again later
+        """
+        with self._lock:
+            self.outcomes[index] = {"index": index, "status": status, "error": error, "retryable": retryable}
+
+    def count(self, *statuses: str) -> int:
+        return sum(1 for outcome in self.outcomes if outcome["status"] in statuses)
+
+    def slice(self, start: int, stop: int) -> "ImportResult":
+        """Outcomes of items start..stop-1 as their own result, re-indexed from 0"""
+        part = ImportResult(0)
+        part.outcomes = [dict(outcome, index=outcome["index"] - start)
+                         for outcome in self.outcomes[start:stop]]
+        return part
+
+    @property
+    def success(self) -> bool:
+        """True when no voucher failed"""
+        return self.count(self.ERROR) == 0
+
+    def message(self) -> str:
+        """Human readable summary"""
+        imported = self.count(self.CREATED, self.ALTERED, self.IMPORTED)
+        duplicates = self.count(self.DUPLICATE)
+        if self.success:
+            if duplicates:
+                return f"Successfully imported {imported} vouchers ({duplicates} already in Tally, skipped)"
+            return f"Successfully imported {imported} vouchers"
+        errors = [o["error"] for o in self.outcomes if o["status"] == self.ERROR]
+        return (f"Imported {imported} of {imported + len(errors)} vouchers, "
+                f"{len(errors)} failed: {errors[0]}")
 
 
 class TallyClient:
     """Client for communicating with Tally ERP via HTTP API"""
     
-    def __init__(self, tally_url: str = "http://localhost:9000"):
+    def __init__(self, tally_url: str = "http://localhost:9000", pool_size: int = 4,
+                 max_retries: int = 3, backoff_base: float = 0.5,
+                 connect_timeout: float = 5, read_timeout: float = 20,
+                 ledger_cache_ttl: float = 600, import_chunk_size: int = 200,
+                 import_max_in_flight: int = 1, stream_requests: bool = True,
+                 voucher_index: Optional[VoucherIndex] = None,
+                 max_concurrency: Optional[int] = None,
+                 masters_refresh_interval: float = 0,
+                 match_min_score: float = tally_masters.MIN_SCORE):
         """
         Initialize Tally client
         
         Args:
             tally_url: URL of Tally HTTP Server (default: http://localhost:9000)
+            pool_size: Maximum keep-alive connections kept to Tally
+            max_retries: Retries after connection errors and timeouts
+            backoff_base: Base delay in seconds for jittered exponential backoff
+            connect_timeout: Seconds to wait for the TCP connection
+            read_timeout: Seconds to wait for Tally's response
+            ledger_cache_ttl: Seconds before the known-ledger cache of a company is re-read
+            import_chunk_size: Vouchers sent per import request
+            import_max_in_flight: Concurrent import requests (Tally serves one at a time)
+            stream_requests: Send generated envelopes with chunked transfer encoding
+            voucher_index: Index of vouchers already pushed (default: the
+                process-wide index, unless VOUCHER_INDEX_ENABLED is off)
+            max_concurrency: Most requests outstanding to this Tally at once,
+                across all threads using the client (default: no limit)
+            masters_refresh_interval: Seconds between exports of a company's
+                ledgers and stock items, used to resolve extracted names to
+                existing masters (default: 0, names are used as given)
+            match_min_score: Least trigram similarity for a name to be resolved
         """
         self.tally_url = tally_url
         self.headers = {"Content-Type": "application/xml"}
+        self.max_retries = max_retries
+        self.import_chunk_size = import_chunk_size
+        self.import_max_in_flight = import_max_in_flight
+        self.stream_requests = stream_requests
+        self.backoff_base = backoff_base
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.voucher_index = voucher_index if voucher_index is not None else voucher_index_module.get_voucher_index()
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._metrics_lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._requests = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        # One persistent session so requests reuse keep-alive connections
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Per-company cache of existing ledger names (lowercased, as Tally
+        # matches names case-insensitively) and when it was loaded
+        self.ledger_cache_ttl = ledger_cache_ttl
+        self._known_ledgers: Dict[str, Tuple[Set[str], float]] = {}
+        self._ledger_lock = threading.Lock()
+
+        # Local copy of each company's masters for fuzzy name resolution
+        self.masters = tally_masters.MasterCache(
+            self.send_request, masters_refresh_interval, min_score=match_min_score
+        ) if masters_refresh_interval > 0 else None
     
-    def send_request(self, xml: str, timeout: int = 20) -> tuple[bool, str]:
+    def send_request(self, xml: Union[str, Callable[[], Iterable[bytes]]],
+                     timeout: Optional[float] = None,
+                     on_chunk: Optional[Callable[[bytes], None]] = None) -> tuple[bool, str]:
         """
         Send XML request to Tally
+
+        Connection errors and timeouts are retried up to max_retries times
+        with jittered exponential backoff.
         
         Args:
-            xml: XML string to send
-            timeout: Request timeout in seconds
+            xml: XML string to send, or a function returning an iterator of
+                encoded XML fragments. Fragments are streamed with chunked
+                transfer encoding (or joined first if stream_requests is off);
+                the function is called again for each retry.
+            timeout: Read timeout in seconds (default: read_timeout)
+            on_chunk: Called with each piece of the response body as it
+                arrives, instead of returning the body (for large exports).
+                A request whose response was partly delivered is not retried.
             
         Returns:
-            Tuple of (success: bool, response: str)
+            Tuple of (success: bool, response: str); response is "" on
+            success when on_chunk is given
         """
-        try:
-            resp = requests.post(
-                self.tally_url, 
-                data=xml.encode("utf-8"), 
-                headers=self.headers, 
-                timeout=timeout
-            )
-            resp.raise_for_status()
-            return True, resp.text
-        except requests.exceptions.ConnectionError:
-            return False, "Failed to connect to Tally. Please ensure Tally is running and HTTP Server is enabled."
-        except requests.exceptions.Timeout:
-            return False, f"Request to Tally timed out after {timeout} seconds."
-        except requests.exceptions.RequestException as e:
-            return False, f"Error communicating with Tally: {str(e)}"
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        attempt = 0
+        received = False
+        while True:
+            if isinstance(xml, str):
+                data = xml.encode("utf-8")
+            elif self.stream_requests:
+                data = _coalesce(instrumentation.timed_iter(xml(), "xml_build"))
+            else:
+                with instrumentation.span("xml_build"):
+                    data = b"".join(xml())
+            self._acquire()
+            start = time.perf_counter()
+            try:
+                resp = self.session.post(
+                    self.tally_url, 
+                    data=data, 
+                    headers=self.headers, 
+                    timeout=(self.connect_timeout, read_timeout),
+                    stream=on_chunk is not None
+                )
+                resp.raise_for_status()
+                if on_chunk is None:
+                    instrumentation.record("tally_post", time.perf_counter() - start, attempt=attempt)
+                    return True, resp.text
+                with resp:
+                    for chunk in resp.iter_content(_STREAM_CHUNK_BYTES):
+                        received = True
+                        on_chunk(chunk)
+                instrumentation.record("tally_post", time.perf_counter() - start, attempt=attempt)
+                return True, ""
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                instrumentation.record("tally_post", time.perf_counter() - start,
+                                       "timeout" if isinstance(e, requests.exceptions.Timeout)
+                                       else "connection_error", attempt=attempt)
+                if received:
+                    return False, "Connection to Tally was lost while reading its response."
+                if attempt >= self.max_retries:
+                    if isinstance(e, requests.exceptions.ReadTimeout):
+                        return False, f"Request to Tally timed out after {read_timeout} seconds."
+                    return False, "Failed to connect to Tally. Please ensure Tally is running and HTTP Server is enabled."
+                delay = self._backoff_delay(attempt)
+            except requests.exceptions.RequestException as e:
+                instrumentation.record("tally_post", time.perf_counter() - start, "error", attempt=attempt)
+                return False, f"Error communicating with Tally: {str(e)}"
+            finally:
+                self._release()
+            # Back off without holding the concurrency slot
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        """Close pooled connections"""
+        self.session.close()
+
+    def metrics(self) -> dict:
+        """Requests waiting for and holding a concurrency slot, and wait times"""
+        with self._metrics_lock:
+            requests_sent = self._requests or 1
+            return {
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency or 0,
+                "requests": self._requests,
+                "wait_seconds_avg": round(self._wait_total / requests_sent, 3),
+                "wait_seconds_max": round(self._wait_max, 3),
+            }
+
+    def _acquire(self) -> None:
+        """Wait for a concurrency slot (Tally serves one request at a time)"""
+        start = time.monotonic()
+        if self._slots is not None:
+            with self._metrics_lock:
+                self._waiting += 1
+            try:
+                self._slots.acquire()
+            finally:
+                with self._metrics_lock:
+                    self._waiting -= 1
+        waited = time.monotonic() - start
+        if self._slots is not None:
+            instrumentation.record("tally.wait", waited)
+        with self._metrics_lock:
+            self._in_flight += 1
+            self._requests += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+    def _release(self) -> None:
+        with self._metrics_lock:
+            self._in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff delay for a retry attempt"""
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
     
     def create_ledger(self, company_name: str, ledger_name: str,
                      parent: str = "Sundry Debtors",
@@ -66,33 +323,367 @@ class TallyClient:
         xml = self._build_create_ledger_xml(company_name, ledger_name, parent, opening_balance)
         success, response = self.send_request(xml)
         if success:
+            self._remember_ledger(company_name, ledger_name)
             return True, f"Ledger '{ledger_name}' created/updated successfully"
         return False, response
+
+    def ensure_ledger(self, company_name: str, ledger_name: str,
+                      parent: str = "Sundry Debtors",
+                      opening_balance: str = "0") -> tuple[bool, str]:
+        """
+        Create a ledger only if it is not already known to exist
+
+        A name that resolves to an existing ledger (see resolve_ledger) is
+        not created.
+
+        Args:
+            company_name: Tally company name
+            ledger_name: Name of the ledger to create
+            parent: Parent group (default: Sundry Debtors)
+            opening_balance: Opening balance (default: 0)
+
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        resolved = self.resolve_ledger(company_name, ledger_name)
+        if resolved != ledger_name:
+            return True, f"Ledger '{ledger_name}' matches existing ledger '{resolved}'"
+        known = self.known_ledgers(company_name)
+        if known is not None and ledger_name.lower() in known:
+            return True, f"Ledger '{ledger_name}' already exists"
+        return self.create_ledger(company_name, ledger_name, parent, opening_balance)
+
+    def known_ledgers(self, company_name: str, refresh: bool = False) -> Optional[Set[str]]:
+        """
+        Lowercased names of the ledgers in a company
+
+        Loaded from a Tally ledger export on first use and again after
+        ledger_cache_ttl seconds or when refresh is set.
+
+        Returns:
+            Set of ledger names, or None if Tally could not be queried
+        """
+        with self._ledger_lock:
+            cached = self._known_ledgers.get(company_name)
+        if cached and not refresh and time.time() - cached[1] < self.ledger_cache_ttl:
+            return cached[0]
+
+        success, response = self.send_request(self._build_list_ledgers_xml(company_name))
+        if not success:
+            return None
+        # An unparseable export still seeds an empty cache, so ledgers
+        # created from now on are remembered
+        names = self._parse_ledger_names(response) or set()
+        with self._ledger_lock:
+            self._known_ledgers[company_name] = (names, time.time())
+        return names
+
+    def resolve_ledger(self, company_name: str, ledger_name: str) -> str:
+        """
+        Name of the existing ledger ledger_name refers to
+
+        Extracted names often differ from Tally in case and punctuation
+        ("ACME TRADERS PVT LTD" for "Acme Traders Pvt. Ltd."), so the name
+        is looked up in the local copy of the company's masters; only such
+        exact matches are used. Returns ledger_name itself if master
+        resolution is off or no ledger has that name.
+        """
+        if self.masters is None:
+            return ledger_name
+        return self.masters.resolve_ledger(company_name, ledger_name) or ledger_name
+
+    def resolve_stock_items(self, company_name: str, names: Iterable[str]) -> Dict[str, str]:
+        """Existing stock item each distinct extracted item name refers to, for names that have one"""
+        if self.masters is None:
+            return {}
+        resolved = self.masters.resolve_stock_items(company_name, names)
+        return {name: item for name, item in resolved.items() if item is not None}
+
+    def invalidate_ledgers(self, company_name: Optional[str] = None) -> None:
+        """Forget cached ledgers (and masters) of one company, or of all companies"""
+        with self._ledger_lock:
+            if company_name is None:
+                self._known_ledgers.clear()
+            else:
+                self._known_ledgers.pop(company_name, None)
+        if self.masters is not None:
+            self.masters.invalidate(company_name)
     
     def import_vouchers(self, company_name: str, party_ledger: str, 
-                       items: List[List[str]], contra_ledger: str = "Cash") -> tuple[bool, str]:
+                       items: Union[LineItemBatch, List[List[str]]], contra_ledger: str = "Cash",
+                       chunk_size: Optional[int] = None,
+                       max_in_flight: Optional[int] = None) -> tuple[bool, str]:
         """
         Import receipt vouchers to Tally
+
+        See import_vouchers_detailed for chunking and retry behaviour.
         
         Args:
             company_name: Tally company name
             party_ledger: Party ledger name
-            items: List of invoice items (each item is [name, qty, um, net_price, net_worth, vat, gross])
+            items: LineItemBatch, or rows of [name, qty, um, net_price, net_worth, vat, gross] strings
             contra_ledger: Contra ledger (default: Cash)
+            chunk_size: Vouchers per request (default: client's import_chunk_size)
+            max_in_flight: Concurrent requests (default: client's import_max_in_flight)
             
         Returns:
             Tuple of (success: bool, message: str)
         """
-        xml = self._build_receipt_vouchers_xml(company_name, party_ledger, items, contra_ledger)
-        success, response = self.send_request(xml)
-        if success:
-            return True, f"Successfully imported {len(items)} vouchers"
-        return False, response
+        result = self.import_vouchers_detailed(
+            company_name, party_ledger, items, contra_ledger, chunk_size, max_in_flight
+        )
+        return result.success, result.message()
+
+    def import_vouchers_detailed(self, company_name: str, party_ledger: str,
+                                 items: Union[LineItemBatch, List[List[str]]],
+                                 contra_ledger: str = "Cash",
+                                 chunk_size: Optional[int] = None,
+                                 max_in_flight: Optional[int] = None) -> "ImportResult":
+        """
+        Import receipt vouchers in chunks and report the outcome of each voucher
+
+        Items failing LineItemBatch.validate are marked SKIPPED with the
+        reason before anything is sent. Each voucher's GUID and number are
+        derived from its source document and content (voucher_keys), and
+        vouchers the voucher index says this Tally instance and company
+        already accepted are marked DUPLICATE without being built or sent.
+        With master resolution on, the party and contra ledgers are mapped
+        to existing ledgers of the same name (see resolve_ledger) and item
+        names to the most similar stock items; voucher keys still come from
+        the extracted items. Chunks are sent back-to-back with at most
+        max_in_flight requests outstanding. Each response's CREATED/ALTERED/ERRORS counts are read;
+        a chunk that reports errors is split in half and each half re-sent
+        until the failing vouchers are isolated. Re-sent vouchers keep their
+        REMOTEID, so vouchers Tally already accepted are altered rather than
+        duplicated. If the party ledger is reported missing, the ledger cache
+        is refreshed, the ledger re-created and only the failed vouchers
+        retried once.
+
+        Args:
+            company_name: Tally company name
+            party_ledger: Party ledger name
+            items: LineItemBatch, or rows of [name, qty, um, net_price, net_worth, vat, gross] strings
+            contra_ledger: Contra ledger (default: Cash)
+            chunk_size: Vouchers per request (default: client's import_chunk_size)
+            max_in_flight: Concurrent requests (default: client's import_max_in_flight)
+
+        Returns:
+            ImportResult with one outcome per item
+        """
+        chunk_size = max(1, chunk_size or self.import_chunk_size)
+        max_in_flight = max(1, max_in_flight or self.import_max_in_flight)
+        batch = LineItemBatch.coerce(items)
+        result = ImportResult(len(batch))
+
+        _, reasons = batch.validate()
+        keys = voucher_keys(batch)
+        pushed = self._pushed_vouchers(
+            company_name, [keys[i] for i, reason in enumerate(reasons) if reason is None]
+        )
+        pending = [i for i, reason in enumerate(reasons) if reason is None and keys[i] not in pushed]
+        if pending:
+            party_ledger = self.resolve_ledger(company_name, party_ledger)
+            contra_ledger = self.resolve_ledger(company_name, contra_ledger)
+        stock_items = self.resolve_stock_items(company_name, (batch.names[i] for i in pending))
+        vouchers = []
+        for i, reason in enumerate(reasons):
+            if reason is not None:
+                result.set(i, ImportResult.SKIPPED, reason)
+            elif keys[i] in pushed:
+                result.set(i, ImportResult.DUPLICATE)
+            else:
+                vouchers.append(self._prepare_voucher(batch[i], i, keys[i],
+                                                      stock_items.get(batch.names[i])))
+
+        self._import_chunks(company_name, party_ledger, contra_ledger, vouchers,
+                            chunk_size, max_in_flight, result, action="Create")
+
+        failed = [v for v in vouchers if result.outcomes[v["index"]]["status"] == ImportResult.ERROR]
+        missing = set()
+        for v in failed:
+            missing |= self._missing_ledgers(result.outcomes[v["index"]]["error"])
+        if missing:
+            self.invalidate_ledgers(company_name)
+            if party_ledger.lower() in missing:
+                created, message = self.create_ledger(company_name, party_ledger)
+                if created:
+                    self._import_chunks(company_name, party_ledger, contra_ledger, failed,
+                                        chunk_size, max_in_flight, result, action=None)
+        self._record_vouchers(company_name, vouchers, result)
+        for status in (ImportResult.CREATED, ImportResult.ALTERED, ImportResult.IMPORTED,
+                       ImportResult.ERROR, ImportResult.SKIPPED, ImportResult.DUPLICATE):
+            count = result.count(status)
+            if count:
+                _VOUCHER_OUTCOMES.inc(count, status=status)
+        return result
+
+    def _pushed_vouchers(self, company_name: str, keys: List[str]) -> Set[str]:
+        """Keys the voucher index has as already accepted by this instance and company"""
+        if self.voucher_index is None or not keys:
+            return set()
+        try:
+            return self.voucher_index.pushed(self.tally_url, company_name, keys)
+        except sqlite3.Error as e:
+            logger.warning("Voucher index lookup failed, sending all vouchers: %s", e)
+            return set()
+
+    def _record_vouchers(self, company_name: str, vouchers: List[dict], result: "ImportResult") -> None:
+        """Add the vouchers Tally accepted to the voucher index"""
+        if self.voucher_index is None:
+            return
+        accepted = (ImportResult.CREATED, ImportResult.ALTERED, ImportResult.IMPORTED)
+        try:
+            self.voucher_index.record(self.tally_url, company_name, [
+                (v["key"], v["guid"], v["number"]) for v in vouchers
+                if result.outcomes[v["index"]]["status"] in accepted
+            ])
+        except sqlite3.Error as e:
+            logger.warning("Voucher index update failed: %s", e)
+
+    def _import_chunks(self, company_name: str, party_ledger: str, contra_ledger: str,
+                       vouchers: List[dict], chunk_size: int, max_in_flight: int,
+                       result: "ImportResult", action: Optional[str]) -> None:
+        """Send vouchers in chunks with bounded concurrency, recording outcomes"""
+        chunks = [vouchers[i:i + chunk_size] for i in range(0, len(vouchers), chunk_size)]
+        if len(chunks) <= 1 or max_in_flight == 1:
+            for chunk in chunks:
+                self._import_chunk(company_name, party_ledger, contra_ledger, chunk, result, action)
+            return
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            futures = [
+                executor.submit(self._import_chunk, company_name, party_ledger,
+                                contra_ledger, chunk, result, action)
+                for chunk in chunks
+            ]
+            for future in futures:
+                future.result()
+
+    def _import_chunk(self, company_name: str, party_ledger: str, contra_ledger: str,
+                      chunk: List[dict], result: "ImportResult", action: Optional[str]) -> None:
+        """Import one chunk, bisecting it when Tally reports errors"""
+        success, response = self.send_request(
+            lambda: self._iter_vouchers_envelope(company_name, party_ledger, contra_ledger, chunk, action)
+        )
+        if not success:
+            # Transport failure: send_request already retried, nothing to isolate
+            for v in chunk:
+                result.set(v["index"], ImportResult.ERROR, response, retryable=True)
+            return
+
+        counts = self._parse_import_response(response)
+        if counts is None:
+            # Response without import counts: trust the HTTP status
+            for v in chunk:
+                result.set(v["index"], ImportResult.IMPORTED)
+            return
+
+        accepted = counts["created"] + counts["altered"]
+        if counts["errors"] == 0 and accepted >= len(chunk):
+            if counts["created"] == len(chunk):
+                status = ImportResult.CREATED
+            elif counts["altered"] == len(chunk):
+                status = ImportResult.ALTERED
+            else:
+                status = ImportResult.IMPORTED
+            for v in chunk:
+                result.set(v["index"], status)
+            return
+
+        if len(chunk) == 1:
+            error = "; ".join(counts["line_errors"]) or f"Tally reported {counts['errors']} error(s)"
+            result.set(chunk[0]["index"], ImportResult.ERROR, error)
+            return
+
+        # Isolate the bad voucher(s); re-sent vouchers are matched by REMOTEID
+        middle = len(chunk) // 2
+        self._import_chunk(company_name, party_ledger, contra_ledger, chunk[:middle], result, None)
+        self._import_chunk(company_name, party_ledger, contra_ledger, chunk[middle:], result, None)
+
+    def _parse_import_response(self, response: str) -> Optional[dict]:
+        """
+        Read the counts and line errors of an import response
+
+        Returns:
+            Dict with created, altered, errors, exceptions and line_errors,
+            or None if the response has no import counts
+        """
+        counts = {}
+        for tag in ("CREATED", "ALTERED", "ERRORS", "EXCEPTIONS"):
+            match = re.search(rf"<{tag}>\s*(\d+)\s*</{tag}>", response or "")
+            counts[tag.lower()] = int(match.group(1)) if match else None
+        if counts["created"] is None and counts["altered"] is None and counts["errors"] is None:
+            return None
+        counts = {name: value or 0 for name, value in counts.items()}
+        counts["errors"] += counts["exceptions"]
+        counts["line_errors"] = [
+            error.strip() for error in re.findall(r"<LINEERROR>(.*?)</LINEERROR>", response, re.DOTALL)
+        ]
+        if counts["line_errors"] and not counts["errors"]:
+            counts["errors"] = len(counts["line_errors"])
+        return counts
+
+    def _remember_ledger(self, company_name: str, ledger_name: str) -> None:
+        """Add a ledger to the company's cache, if the cache is loaded"""
+        with self._ledger_lock:
+            cached = self._known_ledgers.get(company_name)
+            if cached:
+                cached[0].add(ledger_name.lower())
+
+    def _missing_ledgers(self, response: str) -> Set[str]:
+        """Lowercased ledger names an import response reports as missing"""
+        return {name.strip().lower() for name in _MISSING_LEDGER_RE.findall(response or "")}
+
+    def _parse_ledger_names(self, response: str) -> Optional[Set[str]]:
+        """Parse ledger names from a ledger collection export"""
+        try:
+            root = ET.fromstring(response)
+        except ET.ParseError:
+            return None
+        names = set()
+        for ledger in root.iter("LEDGER"):
+            name = ledger.get("NAME") or ledger.findtext("NAME")
+            if name:
+                names.add(name.strip().lower())
+        return names
+
+    def _build_list_ledgers_xml(self, company_name: str) -> str:
+        """Build XML for exporting the names of all ledgers"""
+        company_name = escape(company_name)
+        return f"""
+<ENVELOPE>
+  <HEADER>
+    <VERSION>1</VERSION>
+    <TALLYREQUEST>Export</TALLYREQUEST>
+    <TYPE>Collection</TYPE>
+    <ID>TallyAI Ledger Names</ID>
+  </HEADER>
+  <BODY>
+    <DESC>
+      <STATICVARIABLES>
+        <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+        <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
+      </STATICVARIABLES>
+      <TDL>
+        <TDLMESSAGE>
+          <COLLECTION NAME="TallyAI Ledger Names" ISMODIFY="No">
+            <TYPE>Ledger</TYPE>
+            <NATIVEMETHOD>Name</NATIVEMETHOD>
+          </COLLECTION>
+        </TDLMESSAGE>
+      </TDL>
+    </DESC>
+  </BODY>
+</ENVELOPE>
+"""
     
     def _build_create_ledger_xml(self, company_name: str, ledger_name: str,
                                  parent: str = "Sundry Debtors",
                                  opening_balance: str = "0") -> str:
         """Build XML for creating a ledger"""
+        company_name = escape(company_name)
+        ledger_name = escape(ledger_name, _ATTR_ENTITIES)
+        parent = escape(parent)
+        opening_balance = escape(str(opening_balance))
         return f"""
 <ENVELOPE>
   <HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>
@@ -122,109 +713,104 @@ class TallyClient:
 """
     
     def _build_receipt_vouchers_xml(self, company_name: str, party_ledger: str, 
-                                    items: List[List[str]], contra_ledger: str = "Purchase") -> str:
+                                    items: Union[LineItemBatch, List[List[str]]],
+                                    contra_ledger: str = "Purchase") -> str:
         """Build XML for receipt vouchers"""
-        messages = []
-        
-        for i, item in enumerate(items):
-            try:
-                # Validate item has enough fields
-                if not item or len(item) < 7 or item[1] == "":
-                    print("Invalid item")
-                    print(item)
-                    continue
-                
-                qty = int(self._parse_number(item[1]))
-                if qty == 0:
-                  print("Quantity is 0")
-                  print(item)
-                  continue
-                um = item[2]
-                net_price = float(self._parse_number(item[3]))
-                net_worth = self._parse_number(item[4])
-                vat = self._parse_number(item[5])
-                gross = self._parse_number(item[6])
-                amt = gross
-
-                dt = self._edu_safe_date_yyyyMMdd()
-                vno = f"INV-{i+100:03d}"
-                narration = f"{item[0]} | Qty: {qty} {um} | Rate: {net_price}"
-                guid = str(uuid.uuid4()).upper()
-                
-                messages.append(f"""
-                <TALLYMESSAGE xmlns:UDF="TallyUDF">
-      <VOUCHER VCHTYPE="Receipt" ACTION="Create" GUID="{guid}">
-        <DATE>{dt}</DATE>
-        <EFFECTIVEDATE>{dt}</EFFECTIVEDATE>
-        <VOUCHERNUMBER>{vno}</VOUCHERNUMBER>
-        <VOUCHERTYPENAME>Receipt</VOUCHERTYPENAME>
-        <PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>
-        <NARRATION>{narration}</NARRATION>
-        <PARTYLEDGERNAME>{party_ledger}</PARTYLEDGERNAME>
-
-        <!-- Party ledger (Credit) -->
-        <ALLLEDGERENTRIES.LIST>
-          <LEDGERNAME>{party_ledger}</LEDGERNAME>
-          <ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE>
-          <AMOUNT>-{amt}</AMOUNT>
-        </ALLLEDGERENTRIES.LIST>
-
-        <!-- Cash/Bank (Debit) -->
-        <ALLLEDGERENTRIES.LIST>
-          <LEDGERNAME>{contra_ledger}</LEDGERNAME>
-          <ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE>
-          <AMOUNT>{amt}</AMOUNT>
-        </ALLLEDGERENTRIES.LIST>
-      </VOUCHER>
-    </TALLYMESSAGE>
-        """)
-                # print(messages)
-            except (IndexError, ValueError, TypeError) as e:
-                # Skip invalid items
-                continue
-        
-        return f"""
-<ENVELOPE>
-  <HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>
-  <BODY>
-    <IMPORTDATA>
-      <REQUESTDESC>
-        <REPORTNAME>Vouchers</REPORTNAME>
-        <STATICVARIABLES>
-          <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
-        </STATICVARIABLES>
-      </REQUESTDESC>
-      <REQUESTDATA>
-        {''.join(messages)}
-      </REQUESTDATA>
-    </IMPORTDATA>
-  </BODY>
-</ENVELOPE>
-"""
+        batch = LineItemBatch.coerce(items)
+        valid, _ = batch.validate()
+        keys = voucher_keys(batch)
+        vouchers = (self._prepare_voucher(batch[i], i, keys[i]) for i in np.flatnonzero(valid))
+        return b"".join(self._iter_vouchers_envelope(
+            company_name, party_ledger, contra_ledger, vouchers, "Create"
+        )).decode("utf-8")
+
+    def _prepare_voucher(self, item: LineItem, i: int, key: str,
+                         stock_item: Optional[str] = None) -> dict:
+        """
+        Compute the voucher fields of a validated item
+
+        GUID, number and date all follow from the voucher key, so a
+        re-sent voucher is identical to the first one. The narration names
+        the stock item the item resolved to, if any.
+        """
+        qty = int(item.qty)
+        return {
+            "index": int(i),
+            "key": key,
+            "date": self._edu_safe_date_yyyyMMdd(random.Random(key)),
+            "number": voucher_number(key),
+            "narration": f"{stock_item or item.name} | Qty: {qty} {item.unit} | Rate: {item.rate}",
+            "guid": voucher_guid(key),
+            "amount": item.gross,
+        }
+
+    def _iter_vouchers_envelope(self, company_name: str, party_ledger: str,
+                                contra_ledger: str, vouchers: Iterable[dict],
+                                action: Optional[str] = "Create") -> Iterator[bytes]:
+        """
+        Yield a compact voucher import envelope as UTF-8 fragments
+
+        One fragment is produced per voucher, so the envelope is never held
+        in memory as a whole. All values are XML-escaped.
+        """
+        yield (
+            "<ENVELOPE><HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>"
+            "<BODY><IMPORTDATA><REQUESTDESC><REPORTNAME>Vouchers</REPORTNAME>"
+            f"<STATICVARIABLES><SVCURRENTCOMPANY>{escape(company_name)}</SVCURRENTCOMPANY>"
+            "</STATICVARIABLES></REQUESTDESC><REQUESTDATA>"
+        ).encode("utf-8")
+
+        # Ledger entries are the same for every voucher except the amount
+        party = escape(party_ledger)
+        contra = escape(contra_ledger)
+        action_attr = f' ACTION="{escape(action, _ATTR_ENTITIES)}"' if action else ""
+        for voucher in vouchers:
+            dt = voucher["date"]
+            amt = voucher["amount"]
+            guid = escape(voucher["guid"], _ATTR_ENTITIES)
+            yield (
+                '<TALLYMESSAGE xmlns:UDF="TallyUDF">'
+                f'<VOUCHER REMOTEID="{guid}" VCHTYPE="Receipt"{action_attr} GUID="{guid}">'
+                f"<DATE>{dt}</DATE><EFFECTIVEDATE>{dt}</EFFECTIVEDATE>"
+                f"<VOUCHERNUMBER>{escape(voucher['number'])}</VOUCHERNUMBER>"
+                "<VOUCHERTYPENAME>Receipt</VOUCHERTYPENAME>"
+                "<PERSISTEDVIEW>Accounting Voucher View</PERSISTEDVIEW>"
+                f"<NARRATION>{escape(voucher['narration'])}</NARRATION>"
+                f"<PARTYLEDGERNAME>{party}</PARTYLEDGERNAME>"
+                # Party ledger (Credit)
+                f"<ALLLEDGERENTRIES.LIST><LEDGERNAME>{party}</LEDGERNAME>"
+                f"<ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE><AMOUNT>-{amt}</AMOUNT></ALLLEDGERENTRIES.LIST>"
+                # Cash/Bank (Debit)
+                f"<ALLLEDGERENTRIES.LIST><LEDGERNAME>{contra}</LEDGERNAME>"
+                f"<ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE><AMOUNT>{amt}</AMOUNT></ALLLEDGERENTRIES.LIST>"
+                "</VOUCHER></TALLYMESSAGE>"
+            ).encode("utf-8")
+
+        yield b"</REQUESTDATA></IMPORTDATA></BODY></ENVELOPE>"
     
     def _parse_number(self, num_str) -> float:
-        """Parse number string, handling commas and percentages"""
+        """Parse number string, handling digit grouping and percentages (0 if unparseable)"""
         try:
-            if isinstance(num_str, str):
-                if ',' in num_str:
-                    return float(num_str.replace(',', '').replace('%', '')) / 100
-                else:
-                    return float(num_str.replace('%', ''))
-            return float(num_str)
-        except (ValueError, AttributeError, TypeError):
+            value = parse_number(num_str) if isinstance(num_str, str) else float(num_str)
+        except (ValueError, TypeError):
             return 0
+        return 0 if value != value else value
     
-    def _edu_safe_date_yyyyMMdd(self) -> str:
+    def _edu_safe_date_yyyyMMdd(self, rng: Optional[random.Random] = None) -> str:
         """
         Generate EDU-safe date for Tally Educational mode.
         EDU mode allows only 01 or 02 of any month, plus 31-Mar.
         Returns dates within FY 01-Apr-2024 to 31-Mar-2025.
+
+        Args:
+            rng: Random source, seeded for a repeatable date (default: module random)
         """
+        rng = rng or random
         months = [(2024, m) for m in range(4, 13)] + [(2025, m) for m in range(1, 4)]
-        y, m = random.choice(months)
+        y, m = rng.choice(months)
         if y == 2025 and m == 3:
-            day = random.choice([1, 2, 31])
+            day = rng.choice([1, 2, 31])
         else:
-            day = random.choice([1, 2])
+            day = rng.choice([1, 2])
         
         return f"{y}{m:02d}{day:02d}"
@@ -0,0 +1,366 @@
+"""
+Tally Masters Module
+Local copy of a company's ledgers and stock items, exported from Tally in
+bulk, parsed as it streams in and refreshed in the background, with a
+trigram index for fast fuzzy matching of extracted item names
+"""
+import logging
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from xml.sax.saxutils import escape
+
+import instrumentation
+
+logger = logging.getLogger("ai-tally-agent.tally_masters")
+
+# Names match if their trigram similarity (shared / combined trigrams) is at least this
+MIN_SCORE = 0.5
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(name: str) -> str:
+    """Lowercase name with punctuation and repeated spaces folded to single spaces"""
+    return _NON_ALNUM_RE.sub(" ", name.lower()).strip()
+
+
+def trigrams(name: str) -> set:
+    """
+    Trigrams of a normalized name
+
+    Each word is padded with two leading spaces and one trailing space (as
+    PostgreSQL's pg_trgm does), so word starts weigh more than word ends
+    and short words still produce trigrams.
+    """
+    grams = set()
+    for word in name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Immutable fuzzy-lookup index over a list of names
+
+    Every trigram maps to the positions of the names containing it. A
+    lookup counts the trigrams every name shares with the query in one
+    numpy bincount over the query's posting lists and scores all names at
+    once, with no per-name Python work; an exact match (ignoring case and
+    punctuation) is a dict hit.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names: List[str] = []
+        self._exact: Dict[str, int] = {}
+        postings: Dict[str, List[int]] = {}
+        sizes: List[int] = []
+        for name in names:
+            key = normalize(name)
+            if not key or key in self._exact:
+                continue
+            position = len(self.names)
+            self.names.append(name.strip())
+            self._exact[key] = position
+            grams = trigrams(key)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        # intp, so bincount uses the lists without converting them
+        self._postings = {gram: np.array(ids, dtype=np.intp) for gram, ids in postings.items()}
+        self._sizes = np.array(sizes, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return normalize(name) in self._exact
+
+    def exact(self, query: str) -> Optional[str]:
+        """The name equal to query ignoring case and punctuation, or None"""
+        position = self._exact.get(normalize(query))
+        return self.names[position] if position is not None else None
+
+    def search(self, query: str, limit: int = 5, min_score: float = MIN_SCORE) -> List[Tuple[str, float]]:
+        """
+        Names most similar to query, best first
+
+        Returns:
+            List of (name, score) with score in [0, 1]; an exact match
+            (ignoring case and punctuation) scores 1
+        """
+        key = normalize(query)
+        if not key or not self.names:
+            return []
+        exact = self._exact.get(key)
+        if exact is not None and limit == 1:
+            return [(self.names[exact], 1.0)]
+        grams = trigrams(key)
+        lists = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        scores = shared / (len(grams) + self._sizes - shared)
+        if limit == 1:
+            best = int(np.argmax(scores))
+            return [(self.names[best], float(scores[best]))] if scores[best] >= min_score else []
+        candidates = np.flatnonzero(scores >= min_score)
+        order = np.argsort(-scores[candidates], kind="stable")[:limit]
+        return [(self.names[candidates[i]], float(scores[candidates[i]])) for i in order]
+
+    def match(self, query: str, min_score: float = MIN_SCORE) -> Optional[str]:
+        """The most similar name scoring at least min_score, or None"""
+        best = self.search(query, 1, min_score)
+        return best[0][0] if best else None
+
+
+class Masters:
+    """Ledgers and stock items of one company, as of loaded_at"""
+
+    def __init__(self, ledgers: Iterable[str], stock_items: Iterable[str]):
+        self.ledgers = TrigramIndex(ledgers)
+        self.stock_items = TrigramIndex(stock_items)
+        self.loaded_at = time.time()
+
+
+class _MasterParser:
+    """
+    Incremental parser of a collection export
+
+    Keeps the names of the master elements of one tag and drops each
+    element once read, so memory stays flat however large the export.
+    """
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.names: List[str] = []
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._open: List[ET.Element] = []
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Parse the next piece of the response
+
+        Raises:
+            ET.ParseError: If the export is not well-formed XML
+        """
+        self._parser.feed(chunk)
+        self._read_events()
+
+    def close(self) -> List[str]:
+        self._parser.close()
+        self._read_events()
+        return self.names
+
+    def _read_events(self) -> None:
+        for event, element in self._parser.read_events():
+            if event == "start":
+                self._open.append(element)
+                continue
+            self._open.pop()
+            if element.tag == self.tag:
+                name = element.get("NAME") or element.findtext("NAME")
+                if name and name.strip():
+                    self.names.append(name.strip())
+                if self._open:
+                    self._open[-1].remove(element)
+
+
+class MasterCache:
+    """
+    Masters of every company on one Tally instance
+
+    A company's masters are exported the first time they are needed (the
+    caller waits) and again in the background once refresh_interval has
+    passed, while lookups keep using the previous copy. If an export fails
+    the previous copy is kept and the export is retried after
+    retry_interval.
+    """
+
+    def __init__(self, send_request: Callable[..., Tuple[bool, str]],
+                 refresh_interval: float = 900, retry_interval: float = 60,
+                 min_score: float = MIN_SCORE):
+        """
+        Initialize cache
+
+        Args:
+            send_request: TallyClient.send_request of the instance (called
+                with on_chunk to stream the export)
+            refresh_interval: Seconds before a company's masters are re-exported
+            retry_interval: Seconds before a failed export is tried again
+            min_score: Least trigram similarity for a name to be resolved
+        """
+        self.send_request = send_request
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.min_score = min_score
+        self._masters: Dict[str, Masters] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"refreshes": 0, "refresh_failures": 0, "refresh_seconds_last": 0.0,
+                       "lookups": 0, "matches": 0, "lookup_seconds_total": 0.0}
+
+    def get(self, company_name: str) -> Optional[Masters]:
+        """Current masters of a company, or None if they could not be exported"""
+        with self._lock:
+            masters = self._masters.get(company_name)
+            failed_at = self._failed_at.get(company_name, 0.0)
+        now = time.time()
+        if now - failed_at < self.retry_interval:
+            return masters
+        if masters is None:
+            return self.refresh(company_name)
+        if now - masters.loaded_at >= self.refresh_interval and not self._loading[company_name].locked():
+            threading.Thread(target=self.refresh, args=(company_name, False),
+                             name="tally-masters-refresh", daemon=True).start()
+        return masters
+
+    def refresh(self, company_name: str, wait: bool = True) -> Optional[Masters]:
+        """
+        Export the company's masters now
+
+        Only one export per company runs at a time: with wait set, callers
+        arriving during an export wait for it and get its result; otherwise
+        they return the current copy at once.
+        """
+        with self._lock:
+            loading = self._loading.setdefault(company_name, threading.Lock())
+            started = time.time()
+        if not loading.acquire(blocking=wait):
+            with self._lock:
+                return self._masters.get(company_name)
+        try:
+            with self._lock:
+                masters = self._masters.get(company_name)
+            if masters is not None and masters.loaded_at >= started:
+                # Loaded by the export this caller waited for
+                return masters
+            start = time.perf_counter()
+            with instrumentation.span("tally_masters_export") as span:
+                ledgers = self._export(company_name, "Ledger", "LEDGER")
+                stock_items = self._export(company_name, "StockItem", "STOCKITEM") if ledgers is not None else None
+                if ledgers is None or stock_items is None:
+                    span.outcome = "failed"
+                    with self._lock:
+                        self._failed_at[company_name] = time.time()
+                        self._stats["refresh_failures"] += 1
+                    return masters
+                masters = Masters(ledgers, stock_items)
+            with self._lock:
+                self._masters[company_name] = masters
+                self._failed_at.pop(company_name, None)
+                self._stats["refreshes"] += 1
+                self._stats["refresh_seconds_last"] = round(time.perf_counter() - start, 3)
+            return masters
+        finally:
+            loading.release()
+
+    def resolve_ledger(self, company_name: str, name: str) -> Optional[str]:
+        """
+        Existing ledger with the same name ignoring case and punctuation,
+        or None
+
+        Ledgers are never matched fuzzily: party names that differ by a
+        word ("XYZ Traders", "ABC Traders") are different parties, and
+        posting to the wrong one is worse than creating a ledger.
+        """
+        masters = self.get(company_name)
+        return self._match(masters.ledgers, name, fuzzy=False) if masters is not None else None
+
+    def resolve_stock_items(self, company_name: str, names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Existing stock item each distinct name refers to (None if there is no close match)"""
+        names = set(names)
+        masters = self.get(company_name) if names else None
+        if masters is None:
+            return dict.fromkeys(names)
+        resolved = {name: self._match(masters.stock_items, name) for name in names}
+        for name, item in resolved.items():
+            if item is not None and normalize(item) != normalize(name):
+                # Fuzzy matches are logged so they can be reviewed in Tally
+                logger.info("Stock item '%s' in %s resolved to '%s'", name, company_name, item)
+        return resolved
+
+    def invalidate(self, company_name: Optional[str] = None) -> None:
+        """Forget the masters of one company, or of all companies"""
+        with self._lock:
+            if company_name is None:
+                self._masters.clear()
+                self._failed_at.clear()
+            else:
+                self._masters.pop(company_name, None)
+                self._failed_at.pop(company_name, None)
+
+    def metrics(self) -> Dict[str, float]:
+        """Masters held, exports, and lookup counts and latency"""
+        with self._lock:
+            stats = dict(self._stats)
+            masters = list(self._masters.values())
+        lookups = stats.pop("lookup_seconds_total")
+        stats["lookup_seconds_avg"] = lookups / stats["lookups"] if stats["lookups"] else 0.0
+        stats["companies"] = len(masters)
+        stats["ledgers"] = sum(len(m.ledgers) for m in masters)
+        stats["stock_items"] = sum(len(m.stock_items) for m in masters)
+        return stats
+
+    def _match(self, index: TrigramIndex, name: str, fuzzy: bool = True) -> Optional[str]:
+        start = time.perf_counter()
+        match = index.match(name, self.min_score) if fuzzy else index.exact(name)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["matches"] += match is not None
+            self._stats["lookup_seconds_total"] += elapsed
+        return match
+
+    def _export(self, company_name: str, collection_type: str, tag: str) -> Optional[List[str]]:
+        """Names of all masters of a type, or None if Tally could not be queried"""
+        parser = _MasterParser(tag)
+        try:
+            success, response = self.send_request(
+                build_masters_export_xml(company_name, collection_type), on_chunk=parser.feed
+            )
+            if not success:
+                logger.warning("Tally %s export failed: %s", collection_type, response)
+                return None
+            return parser.close()
+        except ET.ParseError as e:
+            logger.warning("Tally %s export is not valid XML: %s", collection_type, e)
+            return None
+
+
+def build_masters_export_xml(company_name: str, collection_type: str) -> str:
+    """Build XML for exporting the names of all masters of a type (e.g. Ledger, StockItem)"""
+    company_name = escape(company_name)
+    collection = f"TallyAI {collection_type} Names"
+    return f"""
+<ENVELOPE>
+  <HEADER>
+    <VERSION>1</VERSION>
+    <TALLYREQUEST>Export</TALLYREQUEST>
+    <TYPE>Collection</TYPE>
+    <ID>{collection}</ID>
+  </HEADER>
+  <BODY>
+    <DESC>
+      <STATICVARIABLES>
+        <SVCURRENTCOMPANY>{company_name}</SVCURRENTCOMPANY>
+        <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
+      </STATICVARIABLES>
+      <TDL>
+        <TDLMESSAGE>
+          <COLLECTION NAME="{collection}" ISMODIFY="No">
+            <TYPE>{collection_type}</TYPE>
+            <NATIVEMETHOD>Name</NATIVEMETHOD>
+          </COLLECTION>
+        </TDLMESSAGE>
+      </TDL>
+    </DESC>
+  </BODY>
+</ENVELOPE>
+"""
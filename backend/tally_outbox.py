@@ -0,0 +1,518 @@
+"""
+Tally Outbox Module
+Durable SQLite outbox of extracted voucher batches, drained to Tally by a
+background dispatcher, so uploads do not wait for Tally and a Tally that
+is switched off does not lose the extraction
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import instrumentation
+from line_items import LineItemBatch
+from tally_client import ImportResult, TallyClient
+
+logger = logging.getLogger("ai-tally-agent.tally_outbox")
+
+# Entry states
+PENDING = "pending"        # waiting for (another) delivery attempt
+SENDING = "sending"        # claimed by a dispatcher
+DELIVERED = "delivered"    # every voucher accepted (or already in Tally)
+FAILED = "failed"          # Tally rejected vouchers, or the entry expired
+
+_COLUMNS = ("id", "instance", "company", "party_ledger", "contra_ledger", "item_count", "status",
+            "attempts", "next_attempt_at", "created_at", "updated_at", "delivered_at",
+            "imported", "failed", "last_error", "message")
+
+
+class TallyOutbox:
+    """
+    Outbox of voucher batches waiting to be imported into Tally
+
+    enqueue() commits a batch and returns at once. A background thread
+    claims due entries (up to batch_items line items per Tally instance),
+    waiting linger seconds first so entries arriving together are sent
+    together, and coalesces entries for the same Tally instance, company
+    and ledgers into one import. Up to workers instances are delivered to
+    concurrently, each by one worker at a time. Entries whose vouchers could not be sent because
+    Tally was unreachable are retried with exponential backoff, and the
+    instance's other entries are deferred with them; entries that Tally
+    rejected become FAILED until retry() is called. Re-sent vouchers keep
+    their content-derived REMOTEID and are skipped by the voucher index,
+    so replaying an entry never duplicates vouchers.
+
+    The database may be shared by several processes: entries are claimed
+    in a write transaction, and a claim older than lease_seconds (the
+    dispatcher died mid-send) is returned to PENDING.
+    """
+
+    def __init__(self, path: str, client_getter: Callable[[str], Optional[TallyClient]],
+                 batch_items: int = 1000, linger: float = 0.5, backoff_base: float = 5.0,
+                 max_backoff: float = 300.0, max_age: float = 72 * 3600,
+                 retention: float = 7 * 24 * 3600, lease_seconds: float = 600,
+                 poll_interval: float = 5.0, workers: int = 8):
+        """
+        Initialize outbox (the dispatcher starts on the first enqueue)
+
+        Args:
+            path: SQLite database file
+            client_getter: Returns the TallyClient for an instance URL, or
+                None if the instance is not configured (entries stay pending)
+            batch_items: Most line items claimed and imported at once
+            linger: Seconds to wait after a wake-up for more entries to coalesce
+            backoff_base: First retry delay after Tally was unreachable
+            max_backoff: Longest retry delay
+            max_age: Seconds after enqueue (or retry) at which an undelivered
+                entry is given up as FAILED
+            retention: Seconds delivered and failed entries stay queryable
+            lease_seconds: Age at which another dispatcher's claim is taken back
+            poll_interval: Longest sleep between checks for due entries
+                (entries enqueued by other processes are seen this late)
+            workers: Tally instances delivered to concurrently
+        """
+        self.path = path
+        self.client_getter = client_getter
+        self.batch_items = max(1, batch_items)
+        self.linger = linger
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+        self.retention = retention
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.workers = max(1, workers)
+        self._busy: Set[str] = set()
+        self._token = uuid.uuid4().hex
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counters = {"enqueued": 0, "batches": 0, "delivered": 0, "retries": 0, "failed": 0}
+        self._last_prune = 0.0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id TEXT PRIMARY KEY, instance TEXT NOT NULL, company TEXT NOT NULL,"
+            " party_ledger TEXT NOT NULL, contra_ledger TEXT NOT NULL,"
+            " items TEXT, item_count INTEGER NOT NULL, coalesce_key TEXT NOT NULL,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL, expires_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, delivered_at REAL,"
+            " imported INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT, message TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def enqueue(self, instance: str, company: str, party_ledger: str, contra_ledger: str,
+                items: LineItemBatch) -> str:
+        """
+        Commit a voucher batch for delivery
+
+        Returns:
+            Entry id, for get() and retry()
+        """
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        # Rows without a source document get batch-wide voucher keys, which
+        # would change if they were coalesced with other entries
+        coalesce_key = entry_id if "" in items.sources else "\0".join(
+            (instance, company.lower(), party_ledger.lower(), contra_ledger.lower()))
+        self._conn().execute(
+            "INSERT INTO outbox (id, instance, company, party_ledger, contra_ledger, items,"
+            " item_count, coalesce_key, status, next_attempt_at, expires_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry_id, instance, company, party_ledger, contra_ledger, json.dumps(items.to_columns()),
+             len(items), coalesce_key, PENDING, now, now + self.max_age, now, now)
+        )
+        self._count("enqueued")
+        self._start()
+        self._idle.clear()
+        self._wake.set()
+        return entry_id
+
+    def get(self, entry_id: str) -> Optional[dict]:
+        """Status of one entry, or None if unknown or pruned"""
+        row = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM outbox WHERE id = ?", (entry_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def entries(self, status: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """Newest entries, optionally only those in one state"""
+        query = f"SELECT {', '.join(_COLUMNS)} FROM outbox"
+        params: Tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        rows = self._conn().execute(query + " ORDER BY created_at DESC LIMIT ?", (*params, limit))
+        return [self._to_dict(row) for row in rows]
+
+    def retry(self, entry_id: str) -> bool:
+        """
+        Send a FAILED entry again (e.g. after creating the missing ledger)
+
+        Returns:
+            False if the entry is unknown or not FAILED
+        """
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, expires_at = ?,"
+            " updated_at = ? WHERE id = ? AND status = ? AND items IS NOT NULL",
+            (PENDING, now, now + self.max_age, now, entry_id, FAILED)
+        )
+        if cursor.rowcount:
+            self._start()
+            self._idle.clear()
+            self._wake.set()
+        return cursor.rowcount > 0
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until no entry is due or being sent by this process
+
+        Returns:
+            False if timeout expired first
+        """
+        if self._thread is None:
+            return True
+        self._idle.clear()
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Stop the dispatcher after its current batch; undelivered entries stay in the outbox"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self) -> Dict[str, float]:
+        """Entries per state, age of the oldest undelivered entry and dispatcher counters"""
+        conn = self._conn()
+        counts = dict.fromkeys((PENDING, SENDING, DELIVERED, FAILED), 0)
+        counts.update(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status IN (?, ?)", (PENDING, SENDING)
+        ).fetchone()[0]
+        with self._lock:
+            return {
+                **counts,
+                "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+                **{f"{name}_total": value for name, value in self._counters.items()},
+            }
+
+    def _start(self) -> None:
+        with self._lock:
+            # A thread inherited through fork() is not running in this process
+            if (self._thread is None or not self._thread.is_alive()) and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name="tally-outbox", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """
+        Dispatcher loop: claim due entries of idle Tally instances and hand
+        each instance's entries to a worker, so a slow or unreachable Tally
+        only delays its own entries
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tally-outbox") as executor:
+            while not self._stopping:
+                try:
+                    with self._lock:
+                        busy = set(self._busy)
+                    claimed = self._claim(busy) if len(busy) < self.workers else []
+                    if claimed:
+                        instances: "OrderedDict[str, OrderedDict[str, List[dict]]]" = OrderedDict()
+                        for entry in claimed:
+                            groups = instances.setdefault(entry["instance"], OrderedDict())
+                            groups.setdefault(entry["coalesce_key"], []).append(entry)
+                        with self._lock:
+                            self._busy.update(instances)
+                        for instance, groups in instances.items():
+                            executor.submit(self._deliver_instance, instance, list(groups.values()))
+                        continue
+                    if not busy:
+                        self._idle.set()
+                        self._prune()
+                    self._wake.wait(self._next_due(busy))
+                    self._wake.clear()
+                    if not self._stopping and self.linger > 0:
+                        time.sleep(self.linger)
+                except sqlite3.Error as e:
+                    logger.warning("Tally outbox error, retrying: %s", e)
+                    time.sleep(self.poll_interval)
+
+    def _deliver_instance(self, instance: str, groups: List[List[dict]]) -> None:
+        """Deliver one instance's groups in turn (worker thread)"""
+        try:
+            for group in groups:
+                self._deliver(group)
+        except sqlite3.Error as e:
+            # Unsettled entries are taken back when their lease expires
+            logger.error("Tally outbox error while delivering to %s: %s", instance, e)
+        finally:
+            with self._lock:
+                self._busy.discard(instance)
+            self._wake.set()
+
+    def _claim(self, busy: Set[str]) -> List[dict]:
+        """
+        Mark due entries as SENDING for this dispatcher and load them:
+        up to batch_items line items per instance, from at most as many
+        instances as there are free workers, skipping instances in busy
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE outbox SET status = ?, claimed_by = NULL WHERE status = ? AND claimed_at < ?",
+                (PENDING, SENDING, now - self.lease_seconds)
+            )
+            ids: List[str] = []
+            items: Dict[str, int] = {}
+            full: Set[str] = set()
+            for entry_id, instance, count in conn.execute(
+                "SELECT id, instance, item_count FROM outbox WHERE status = ? AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at, created_at", (PENDING, now)
+            ):
+                if instance in busy or instance in full:
+                    continue
+                if instance not in items and len(busy) + len(items) >= self.workers:
+                    continue
+                if items.get(instance) and items[instance] + count > self.batch_items:
+                    full.add(instance)
+                    continue
+                ids.append(entry_id)
+                items[instance] = items.get(instance, 0) + count
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                conn.execute(
+                    f"UPDATE outbox SET status = ?, claimed_by = ?, claimed_at = ? WHERE id IN ({placeholders})",
+                    (SENDING, self._token, now, *ids)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if not ids:
+            return []
+        rows = conn.execute(
+            "SELECT id, instance, company, party_ledger, contra_ledger, items, coalesce_key,"
+            f" attempts, expires_at FROM outbox WHERE id IN ({placeholders})"
+            " ORDER BY created_at", ids
+        ).fetchall()
+        return [dict(zip(("id", "instance", "company", "party_ledger", "contra_ledger", "items",
+                          "coalesce_key", "attempts", "expires_at"), row)) for row in rows]
+
+    def _deliver(self, group: List[dict]) -> None:
+        """Import one group of entries as a single batch and settle each entry"""
+        first = group[0]
+        instance, company = first["instance"], first["company"]
+        party_ledger, contra_ledger = first["party_ledger"], first["contra_ledger"]
+        batches = [LineItemBatch.from_columns(json.loads(entry["items"])) for entry in group]
+        self._count("batches")
+        with instrumentation.span("outbox_deliver", invoices=len(group)) as span:
+            client = self.client_getter(instance)
+            if client is None:
+                span.outcome = "no_client"
+                self._defer(group, f"No Tally client configured for {instance}")
+                return
+            try:
+                success, message = client.ensure_ledger(company, party_ledger)
+                if not success:
+                    span.outcome = "unreachable"
+                    self._defer(group, f"Failed to create ledger: {message}")
+                    return
+                result = client.import_vouchers_detailed(
+                    company, party_ledger, LineItemBatch.concat(batches), contra_ledger
+                )
+            except Exception as e:
+                span.outcome = "error"
+                self._defer(group, f"Unexpected error: {str(e)}")
+                return
+
+        start = 0
+        for entry, batch in zip(group, batches):
+            part = result.slice(start, start + len(batch))
+            start += len(batch)
+            retryable = [o["error"] for o in part.outcomes if o["status"] == ImportResult.ERROR and o["retryable"]]
+            if retryable:
+                self._defer([entry], retryable[0])
+            else:
+                self._settle(entry, part)
+
+    def _settle(self, entry: dict, result: ImportResult) -> None:
+        """Record the final outcome of an entry Tally answered for"""
+        now = time.time()
+        status = DELIVERED if result.success else FAILED
+        imported = result.count(ImportResult.CREATED, ImportResult.ALTERED, ImportResult.IMPORTED,
+                                ImportResult.DUPLICATE)
+        failed = result.count(ImportResult.ERROR, ImportResult.SKIPPED)
+        errors = [o["error"] for o in result.outcomes if o["status"] == ImportResult.ERROR]
+        # Delivered entries no longer need their items
+        self._conn().execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ?, delivered_at = ?,"
+            " imported = ?, failed = ?, last_error = ?, message = ?, claimed_by = NULL,"
+            " items = CASE WHEN ? THEN NULL ELSE items END WHERE id = ?",
+            (status, now, now if status == DELIVERED else None, imported, failed,
+             errors[0] if errors else None, result.message(), status == DELIVERED, entry["id"])
+        )
+        self._count("delivered" if status == DELIVERED else "failed")
+
+    def _defer(self, group: List[dict], error: str) -> None:
+        """
+        Schedule entries for another attempt with backoff, and hold back the
+        instance's other pending entries until then; entries older than
+        max_age are given up
+        """
+        now = time.time()
+        conn = self._conn()
+        latest = now
+        for entry in group:
+            attempts = entry["attempts"] + 1
+            if now >= entry["expires_at"]:
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, updated_at = ?, last_error = ?,"
+                    " message = ?, claimed_by = NULL WHERE id = ?",
+                    (FAILED, attempts, now, error, f"Gave up after {attempts} attempts: {error}", entry["id"])
+                )
+                self._count("failed")
+                continue
+            delay = min(self.max_backoff, self.backoff_base * (2 ** (attempts - 1)))
+            next_attempt = now + random.uniform(0.5, 1.0) * delay
+            latest = max(latest, next_attempt)
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, updated_at = ?,"
+                " last_error = ?, claimed_by = NULL WHERE id = ?",
+                (PENDING, attempts, next_attempt, now, error, entry["id"])
+            )
+            self._count("retries")
+        conn.execute(
+            "UPDATE outbox SET next_attempt_at = MAX(next_attempt_at, ?) WHERE instance = ? AND status = ?",
+            (latest, group[0]["instance"], PENDING)
+        )
+
+    def _next_due(self, busy: Set[str]) -> float:
+        """
+        Seconds until the next pending entry of an instance not in busy is
+        due, at most poll_interval (a worker finishing wakes the loop early)
+        """
+        placeholders = ",".join("?" * len(busy))
+        due = self._conn().execute(
+            f"SELECT MIN(next_attempt_at) FROM outbox WHERE status = ? AND instance NOT IN ({placeholders})",
+            (PENDING, *busy)
+        ).fetchone()[0]
+        if due is None:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, due - time.time()))
+
+    def _prune(self) -> None:
+        """Drop settled entries older than retention (at most once a minute)"""
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        self._conn().execute(
+            "DELETE FROM outbox WHERE status IN (?, ?) AND updated_at < ?",
+            (DELIVERED, FAILED, now - self.retention)
+        )
+
+    @staticmethod
+    def _to_dict(row: tuple) -> dict:
+        """Serialize an entry for the /tally-outbox endpoints"""
+        entry = dict(zip(_COLUMNS, row))
+        return {
+            'outboxId': entry["id"],
+            'tallyUrl': entry["instance"],
+            'company': entry["company"],
+            'ledger': entry["party_ledger"],
+            'contraLedger': entry["contra_ledger"],
+            'items': entry["item_count"],
+            'status': entry["status"],
+            'attempts': entry["attempts"],
+            'nextAttemptAt': entry["next_attempt_at"] if entry["status"] == PENDING else None,
+            'imported': entry["imported"],
+            'failed': entry["failed"],
+            'lastError': entry["last_error"],
+            'message': entry["message"],
+            'createdAt': entry["created_at"],
+            'updatedAt': entry["updated_at"],
+            'deliveredAt': entry["delivered_at"],
+        }
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _conn(self) -> sqlite3.Connection:
+        """Autocommit connection for the current thread (re-opened after fork)"""
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+
+_outbox: Optional[TallyOutbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox(client_getter: Callable[[str], Optional[TallyClient]]) -> TallyOutbox:
+    """
+    Process-wide outbox at TALLY_OUTBOX_PATH configured from
+    TALLY_OUTBOX_BATCH_ITEMS, TALLY_OUTBOX_LINGER, TALLY_OUTBOX_BACKOFF_BASE,
+    TALLY_OUTBOX_MAX_BACKOFF, TALLY_OUTBOX_MAX_AGE_HOURS and
+    TALLY_OUTBOX_WORKERS, stopped at interpreter exit
+
+    There is no default path: accepted uploads live only in the outbox
+    until Tally has them, so it must be on storage that survives restarts
+    (not /tmp on Cloud Run or Railway).
+
+    Raises:
+        ValueError: If TALLY_OUTBOX_PATH is not set
+    """
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                path = os.environ.get("TALLY_OUTBOX_PATH", "")
+                if not path:
+                    raise ValueError("TALLY_OUTBOX_PATH must name a file on persistent storage")
+                _outbox = TallyOutbox(
+                    path,
+                    client_getter,
+                    batch_items=int(os.environ.get("TALLY_OUTBOX_BATCH_ITEMS", "1000")),
+                    linger=float(os.environ.get("TALLY_OUTBOX_LINGER", "0.5")),
+                    backoff_base=float(os.environ.get("TALLY_OUTBOX_BACKOFF_BASE", "5")),
+                    max_backoff=float(os.environ.get("TALLY_OUTBOX_MAX_BACKOFF", "300")),
+                    max_age=float(os.environ.get("TALLY_OUTBOX_MAX_AGE_HOURS", "72")) * 3600,
+                    workers=int(os.environ.get("TALLY_OUTBOX_WORKERS", "8")),
+                )
+                # Restart pending entries left by a previous run
+                _outbox._start()
+                atexit.register(close)
+    return _outbox
+
+
+def metrics() -> Dict[str, float]:
+    """Metrics of the process-wide outbox, empty if it was never created"""
+    return _outbox.metrics() if _outbox is not None else {}
+
+
+def close(timeout: float = 30.0) -> None:
+    """Stop the process-wide outbox dispatcher, if one was created"""
+    if _outbox is not None:
+        _outbox.close(timeout)
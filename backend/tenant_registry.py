@@ -0,0 +1,214 @@
+"""
+Tenant Registry Module
+Maps users and organizations to their Tally server, company, ledgers and
+limits, and keeps one long-lived, pooled TallyClient per Tally server
+"""
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from tally_client import TallyClient
+
+
+class Tenant:
+    """One accounting client: where and how their vouchers are pushed"""
+
+    def __init__(self, tenant_id: str, tally_url: str, company: str,
+                 ledger: str = "Main Ledger", contra_ledger: str = "Cash",
+                 max_concurrency: int = 1, client_options: Optional[dict] = None):
+        """
+        Initialize tenant
+
+        Args:
+            tenant_id: Registry key of the tenant
+            tally_url: URL of the tenant's Tally HTTP Server
+            company: Tally company name (must match exactly)
+            ledger: Party ledger the invoices are booked against
+            contra_ledger: Contra ledger of the receipts
+            max_concurrency: Requests outstanding to the tenant's Tally at once
+                (Tally serves one request at a time)
+            client_options: Further TallyClient arguments (e.g. read_timeout,
+                import_chunk_size) overriding the registry defaults
+        """
+        self.tenant_id = tenant_id
+        self.tally_url = tally_url
+        self.company = company
+        self.ledger = ledger
+        self.contra_ledger = contra_ledger
+        self.max_concurrency = max(1, max_concurrency)
+        self.client_options = client_options or {}
+
+    @classmethod
+    def from_dict(cls, tenant_id: str, data: dict, default: Optional["Tenant"] = None) -> "Tenant":
+        """
+        Build a tenant from its registry file entry
+
+        Fields missing from data are taken from default.
+
+        Raises:
+            ValueError: If tally_url or company is missing
+        """
+        fields = dict(data)
+        fallback = default.to_dict() if default is not None else {}
+        options = {**fallback.get("client_options", {}), **fields.pop("client_options", {})}
+        tally_url = fields.pop("tally_url", fallback.get("tally_url"))
+        company = fields.pop("company", fallback.get("company"))
+        if not tally_url or not company:
+            raise ValueError(f"Tenant '{tenant_id}' needs a tally_url and a company")
+        return cls(
+            tenant_id, tally_url, company,
+            ledger=fields.pop("ledger", fallback.get("ledger", "Main Ledger")),
+            contra_ledger=fields.pop("contra_ledger", fallback.get("contra_ledger", "Cash")),
+            max_concurrency=int(fields.pop("max_concurrency", fallback.get("max_concurrency", 1))),
+            # Any other field is a TallyClient option
+            client_options={**options, **fields},
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "tally_url": self.tally_url,
+            "company": self.company,
+            "ledger": self.ledger,
+            "contra_ledger": self.contra_ledger,
+            "max_concurrency": self.max_concurrency,
+            "client_options": dict(self.client_options),
+        }
+
+
+class TenantRegistry:
+    """
+    Tenants by id, with user and organization assignments
+
+    Users are looked up first, then their organization, then the default
+    tenant. Clients are created on first use and kept for the life of the
+    process, one per Tally server URL: tenants that share a server (e.g.
+    several companies on one Tally) share its connection pool and its
+    concurrency cap, which is taken from the first of them to connect.
+    """
+
+    def __init__(self, default: Tenant, tenants: Optional[Dict[str, Tenant]] = None,
+                 users: Optional[Dict[str, str]] = None,
+                 organizations: Optional[Dict[str, str]] = None,
+                 client_options: Optional[dict] = None,
+                 client_factory: Callable[..., TallyClient] = TallyClient):
+        """
+        Initialize registry
+
+        Args:
+            default: Tenant of users without an assignment
+            tenants: Other tenants by id
+            users: Tenant id of each user id
+            organizations: Tenant id of each organization id
+            client_options: TallyClient arguments shared by every tenant
+            client_factory: Creates a client as client_factory(tally_url, **options)
+
+        Raises:
+            ValueError: If a user or organization names an unknown tenant
+        """
+        self.default = default
+        self._tenants = {default.tenant_id: default, **(tenants or {})}
+        self._users = dict(users or {})
+        self._organizations = dict(organizations or {})
+        for owner, tenant_id in (*self._users.items(), *self._organizations.items()):
+            if tenant_id not in self._tenants:
+                raise ValueError(f"'{owner}' is assigned to unknown tenant '{tenant_id}'")
+        self.client_options = client_options or {}
+        self.client_factory = client_factory
+        self._clients: Dict[str, TallyClient] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, default: Tenant, client_options: Optional[dict] = None) -> "TenantRegistry":
+        """
+        Load tenants from a JSON file of the form
+
+            {"tenants": {"acme": {"tally_url": "http://10.0.0.5:9000", "company": "Acme Ltd",
+                                  "ledger": "Sales", "max_concurrency": 1, "read_timeout": 60}},
+             "users": {"<user id>": "acme"},
+             "organizations": {"<organization id>": "acme"}}
+
+        Raises:
+            OSError, ValueError: If the file cannot be read or is invalid
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        tenants = {tenant_id: Tenant.from_dict(tenant_id, entry, default)
+                   for tenant_id, entry in data.get("tenants", {}).items()}
+        return cls(default, tenants, data.get("users"), data.get("organizations"), client_options)
+
+    def get(self, tenant_id: str) -> Optional[Tenant]:
+        return self._tenants.get(tenant_id)
+
+    def tenants(self) -> List[Tenant]:
+        return list(self._tenants.values())
+
+    def resolve(self, user_id: Optional[str] = None, org_id: Optional[str] = None) -> Tenant:
+        """Tenant of a user, else of their organization, else the default tenant"""
+        tenant_id = self._users.get(user_id or "") or self._organizations.get(org_id or "")
+        return self._tenants.get(tenant_id, self.default) if tenant_id else self.default
+
+    def client(self, tenant: Tenant) -> TallyClient:
+        """The long-lived client of the tenant's Tally server"""
+        with self._lock:
+            client = self._clients.get(tenant.tally_url)
+            if client is None:
+                options = {**self.client_options, **tenant.client_options,
+                           "max_concurrency": tenant.max_concurrency}
+                client = self._clients[tenant.tally_url] = self.client_factory(tenant.tally_url, **options)
+            return client
+
+    def client_for_url(self, tally_url: str) -> Optional[TallyClient]:
+        """Client of a Tally server some tenant uses, or None if no tenant does"""
+        for tenant in self._tenants.values():
+            if tenant.tally_url == tally_url:
+                return self.client(tenant)
+        return None
+
+    def metrics(self) -> Dict[str, float]:
+        """Tenant count, connected Tally servers, and requests queued and in flight across them"""
+        with self._lock:
+            clients = list(self._clients.values())
+        stats = [client.metrics() for client in clients]
+        return {
+            "tenants": len(self._tenants),
+            "tally_servers": len(clients),
+            "queue_depth": sum(s["queue_depth"] for s in stats),
+            "in_flight": sum(s["in_flight"] for s in stats),
+            "busy_servers": sum(1 for s in stats if s["in_flight"]),
+            "wait_seconds_max": max((s["wait_seconds_max"] for s in stats), default=0.0),
+        }
+
+    def masters_metrics(self) -> Dict[str, float]:
+        """Master copies and name lookups, summed over the Tally servers that resolve names"""
+        with self._lock:
+            caches = [client.masters for client in self._clients.values() if client.masters is not None]
+        totals: Dict[str, float] = {}
+        for cache in caches:
+            for key, value in cache.metrics().items():
+                if key.endswith(("_avg", "_last")):
+                    # Latencies: the slowest server
+                    totals[key] = max(totals.get(key, 0.0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self) -> None:
+        """Close every client's pooled connections"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+def load_registry(default: Tenant, client_options: Optional[dict] = None) -> TenantRegistry:
+    """
+    Registry from the JSON file at TALLY_TENANTS_FILE, or one holding only
+    the default tenant if the variable is not set
+    """
+    path = os.environ.get("TALLY_TENANTS_FILE")
+    if not path:
+        return TenantRegistry(default, client_options=client_options)
+    return TenantRegistry.from_file(path, default, client_options)
@@ -0,0 +1,14 @@
+"""Tests for extraction_backends"""
+import extraction_backends
+
+
+def test_stub_backend_not_selectable_by_default(monkeypatch):
+    monkeypatch.delenv("EXTRACTION_TEST_BACKENDS", raising=False)
+    assert not extraction_backends.request_selectable("stub")
+    assert extraction_backends.request_selectable("tesseract_llm")
+    assert not extraction_backends.request_selectable("no_such_backend")
+
+
+def test_stub_backend_selectable_with_test_flag(monkeypatch):
+    monkeypatch.setenv("EXTRACTION_TEST_BACKENDS", "true")
+    assert extraction_backends.request_selectable("stub")
@@ -0,0 +1,194 @@
+"""Tests for firestore_writer, against an in-process fake Firestore client"""
+import importlib.util
+import os
+import threading
+import time
+
+import pytest
+
+import firestore_writer
+from firestore_writer import MAX_BATCH_OPS, FirestoreWriter, WriterBusy
+
+
+class FakeDocument:
+    def __init__(self, path: str):
+        self.path = path
+
+
+class FakeCollection:
+    def __init__(self, path: str):
+        self.path = path
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(f"{self.path}/{doc_id}")
+
+
+class FakeBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference: FakeDocument, data: dict, merge: bool = False) -> None:
+        if len(self.writes) >= MAX_BATCH_OPS:
+            raise ValueError("Firestore batches hold at most 500 writes")
+        self.writes.append((reference.path, data, merge))
+
+    def commit(self) -> None:
+        self.client.commit(self.writes)
+
+
+class FakeFirestore:
+    """
+    Records committed batches; the first fail_commits commits raise, and
+    commits wait while the gate is cleared
+    """
+
+    def __init__(self, fail_commits: int = 0):
+        self.fail_commits = fail_commits
+        self.batches = []
+        self.documents = {}
+        self.commit_attempts = 0
+        self.committing = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def collection(self, path: str) -> FakeCollection:
+        return FakeCollection(path)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def commit(self, writes) -> None:
+        self.committing.set()
+        self.gate.wait(5)
+        with self._lock:
+            self.commit_attempts += 1
+            if self.fail_commits > 0:
+                self.fail_commits -= 1
+                raise RuntimeError("UNAVAILABLE")
+            self.batches.append(list(writes))
+            for path, data, merge in writes:
+                self.documents[path] = {**self.documents.get(path, {}), **data} if merge else data
+
+
+def new_writer(client: FakeFirestore, **options) -> FirestoreWriter:
+    options = {"flush_interval": 0.05, "backoff_base": 0.0, "put_timeout": 0.2, **options}
+    return FirestoreWriter(lambda: client, **options)
+
+
+def test_writes_are_committed_in_batches_of_at_most_500():
+    client = FakeFirestore()
+    writer = new_writer(client, flush_interval=5.0, max_buffered=2000)
+    for i in range(1200):
+        writer.set("invoices", f"doc-{i}", {"n": i})
+
+    assert writer.flush(timeout=5)
+
+    assert [len(batch) for batch in client.batches] == [500, 500, 200]
+    assert len(client.documents) == 1200
+    assert writer.metrics()["written"] == 1200
+    writer.close()
+
+
+def test_batch_size_is_capped_at_firestore_limit():
+    assert new_writer(FakeFirestore(), batch_size=1000).batch_size == MAX_BATCH_OPS
+
+
+def test_partial_batch_is_committed_after_flush_interval():
+    client = FakeFirestore()
+    writer = new_writer(client, flush_interval=0.1)
+    writer.set("invoices", "a", {"n": 1})
+    writer.set("invoices", "b", {"n": 2})
+
+    deadline = time.monotonic() + 2
+    while not client.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert client.batches and len(client.batches[0]) == 2
+    writer.close()
+
+
+def test_set_raises_writer_busy_when_buffer_stays_full():
+    client = FakeFirestore()
+    client.gate.clear()
+    writer = new_writer(client, batch_size=1, max_buffered=2, put_timeout=0.1)
+    writer.set("invoices", "in-commit", {})
+    # The writer thread holds the first write in a blocked commit
+    assert client.committing.wait(2)
+    writer.set("invoices", "queued-1", {})
+    writer.set("invoices", "queued-2", {})
+
+    with pytest.raises(WriterBusy):
+        writer.set("invoices", "rejected", {})
+
+    assert writer.metrics()["rejected"] == 1
+    client.gate.set()
+    assert writer.close(timeout=5)
+    assert sorted(client.documents) == ["invoices/in-commit", "invoices/queued-1", "invoices/queued-2"]
+
+
+def test_failed_batch_is_retried():
+    client = FakeFirestore(fail_commits=2)
+    writer = new_writer(client, max_retries=5)
+    writer.set("invoices", "a", {"n": 1})
+
+    assert writer.flush(timeout=5)
+
+    assert client.commit_attempts == 3
+    assert client.documents == {"invoices/a": {"n": 1}}
+    assert writer.metrics()["retries"] == 2
+    writer.close()
+
+
+def test_batch_is_dropped_after_max_retries():
+    client = FakeFirestore(fail_commits=10)
+    writer = new_writer(client, max_retries=2)
+    writer.set("invoices", "a", {"n": 1})
+
+    assert writer.flush(timeout=5)
+
+    assert client.commit_attempts == 3
+    assert not client.documents
+    assert writer.metrics()["failed"] == 1
+    writer.close()
+
+
+def test_merge_writes_update_existing_document():
+    client = FakeFirestore()
+    writer = new_writer(client)
+    writer.set("invoices", "a", {"n": 1, "status": "new"})
+    writer.set("invoices", "a", {"status": "pushed"}, merge=True)
+
+    writer.flush(timeout=5)
+
+    assert client.documents["invoices/a"] == {"n": 1, "status": "pushed"}
+    writer.close()
+
+
+def test_close_flushes_outstanding_writes_and_rejects_new_ones():
+    client = FakeFirestore()
+    writer = new_writer(client, flush_interval=10.0)
+    for i in range(10):
+        writer.set("invoices", f"doc-{i}", {"n": i})
+
+    assert writer.close(timeout=5)
+
+    assert len(client.documents) == 10
+    with pytest.raises(RuntimeError):
+        writer.set("invoices", "late", {})
+
+
+def test_gunicorn_worker_exit_flushes_process_writer(monkeypatch):
+    client = FakeFirestore()
+    writer = new_writer(client, flush_interval=10.0)
+    monkeypatch.setattr(firestore_writer, "_writer", writer)
+    writer.set("invoices", "a", {"n": 1})
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", path)
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    gunicorn_conf.worker_exit(server=None, worker=None)
+
+    assert client.documents == {"invoices/a": {"n": 1}}
@@ -0,0 +1,79 @@
+"""Tests for image_preprocessing"""
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_preprocessing
+
+
+def ruled_page(width: int = 1000, height: int = 1400) -> np.ndarray:
+    """White page with long horizontal rules and a line of text above each"""
+    page = np.full((height, width), 255, dtype=np.uint8)
+    for y in range(100, height - 100, 40):
+        cv2.line(page, (80, y), (width - 80, y), 0, 3)
+        cv2.putText(page, "Item 12 pcs 450.00", (90, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, 0, 2)
+    return page
+
+
+def rotate(array: np.ndarray, angle: float) -> np.ndarray:
+    height, width = array.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(array, matrix, (width, height), borderValue=255)
+
+
+def rule_angle(array: np.ndarray) -> float:
+    """Angle in degrees of the longest dark line, folded into (-45, 45]"""
+    _, ink = cv2.threshold(array, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(ink, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    (_, _), (w, h), angle = cv2.minAreaRect(max(contours, key=lambda c: max(cv2.minAreaRect(c)[1])))
+    angle %= 90
+    return angle - 90 if angle > 45 else angle
+
+
+@pytest.mark.parametrize("angle", [1.5, 3.0, 5.0, -1.5, -3.0, -5.0])
+def test_deskew_corrects_both_directions(angle):
+    skewed = rotate(ruled_page(), angle)
+    assert abs(rule_angle(skewed)) > 1.0
+
+    straightened = image_preprocessing.deskew(skewed)
+
+    assert abs(rule_angle(straightened)) < 0.5
+
+
+def test_deskew_leaves_straight_page_alone():
+    page = ruled_page()
+    assert np.array_equal(image_preprocessing.deskew(page), page)
+
+
+def test_deskew_ignores_angles_beyond_max():
+    skewed = rotate(ruled_page(), 20.0)
+    assert np.array_equal(image_preprocessing.deskew(skewed, max_angle=15.0), skewed)
+
+
+def test_downscale_ignores_phone_default_dpi():
+    config = image_preprocessing.PreprocessConfig(target_dpi=300, page_width_inches=8.27)
+    photo = np.full((3000, 4000), 255, dtype=np.uint8)
+
+    resized = image_preprocessing.downscale_to_dpi(photo, config, source_dpi=72)
+
+    assert resized.shape == (1860, 2481)
+
+
+def test_downscale_uses_stored_dpi_of_high_resolution_scan():
+    config = image_preprocessing.PreprocessConfig(target_dpi=300, page_width_inches=8.27)
+    scan = np.full((600, 400), 255, dtype=np.uint8)
+
+    resized = image_preprocessing.downscale_to_dpi(scan, config, source_dpi=600)
+
+    assert resized.shape == (300, 200)
+
+
+def test_preprocess_downscales_72_dpi_photo():
+    config = image_preprocessing.PreprocessConfig(deskew=False, binarize=False)
+    photo = Image.new("RGB", (4000, 3000), "white")
+    photo.info["dpi"] = (72, 72)
+
+    array, _ = image_preprocessing.preprocess(photo, config)
+
+    assert array.shape[1] <= 2481
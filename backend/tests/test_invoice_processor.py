@@ -0,0 +1,29 @@
+"""Tests for InvoiceProcessor's Tally settings"""
+from invoice_processor import InvoiceProcessor
+
+
+class FakeTallyClient:
+    def __init__(self):
+        self.imports = []
+
+    def ensure_ledger(self, company_name, ledger_name):
+        return True, "Ledger exists"
+
+    def import_vouchers(self, company_name, party_ledger, items, contra_ledger="Cash"):
+        self.imports.append((company_name, party_ledger, contra_ledger, len(items)))
+        return True, "Imported"
+
+
+def test_tenant_contra_ledger_reaches_import_vouchers():
+    client = FakeTallyClient()
+    processor = InvoiceProcessor(company_name="X", ledger_name="Sales", contra_ledger="HDFC Bank",
+                                 tally_client=client, extraction_backends=["stub"])
+
+    success, _ = processor.process_file(b"Rice|2|kg|50.00|100.00|5.00|105.00")
+
+    assert success
+    assert client.imports == [("X", "Sales", "HDFC Bank", 1)]
+
+
+def test_contra_ledger_defaults_to_cash():
+    assert InvoiceProcessor(tally_client=FakeTallyClient()).contra_ledger == "Cash"
@@ -0,0 +1,65 @@
+"""Tests for job_queue's byte cap and admission of queued uploads"""
+import queue
+import threading
+import time
+
+import pytest
+
+import admission
+from job_queue import JobQueue
+
+
+class BlockingProcessor:
+    """Processor whose process_file waits for release, recording what ran"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.processed = []
+
+    def process_file(self, file, stage_callback=None, backend=None, outbox_callback=None):
+        self.started.set()
+        self.release.wait(5)
+        self.processed.append(file.read())
+        return True, "ok"
+
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_submit_rejects_uploads_beyond_max_pending_bytes():
+    processor = BlockingProcessor()
+    jobs = JobQueue(lambda tenant_id: processor, max_workers=1, max_pending_bytes=100)
+    jobs.submit(None, "a.txt", b"x" * 60)
+    assert processor.started.wait(2)
+
+    with pytest.raises(queue.Full):
+        jobs.submit(None, "b.txt", b"x" * 60)
+    jobs.submit(None, "c.txt", b"x" * 40)
+    assert jobs.pending_bytes() == 100
+
+    processor.release.set()
+    assert wait_for(lambda: jobs.pending_bytes() == 0)
+    assert len(processor.processed) == 2
+
+
+def test_worker_waits_for_admission_budget():
+    processor = BlockingProcessor()
+    processor.release.set()
+    controller = admission.AdmissionController(budget_bytes=1000, queue_timeout=0.05, retry_after=1)
+    jobs = JobQueue(lambda tenant_id: processor, max_workers=1, admission_controller=controller)
+
+    with controller.admit(1000):
+        job = jobs.submit(None, "a.txt", b"not an image")
+        time.sleep(0.2)
+        # Budget is taken: the job stays queued rather than failing
+        assert job.status == "queued"
+        assert not processor.processed
+
+    assert wait_for(lambda: job.status == "done")
+    assert processor.processed == [b"not an image"]
+    assert controller.metrics()["reserved_bytes"] == 0
@@ -0,0 +1,25 @@
+"""Tests for ocr_engine"""
+import ocr_engine
+
+
+def test_pool_stays_off_without_tesserocr(monkeypatch, caplog):
+    monkeypatch.setattr(ocr_engine, "_tesserocr_available", False)
+    monkeypatch.setattr(ocr_engine, "_engine", None)
+    monkeypatch.setattr(ocr_engine, "_in_process_only", False)
+    monkeypatch.setenv("OCR_ENGINE_WORKERS", "2")
+
+    assert ocr_engine.get_engine() is None
+    assert "tesserocr is not installed" in caplog.text
+    assert ocr_engine.metrics() == {"tesserocr": 0}
+
+
+def test_pool_created_with_tesserocr(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "_tesserocr_available", True)
+    monkeypatch.setattr(ocr_engine, "_engine", None)
+    monkeypatch.setattr(ocr_engine, "_in_process_only", False)
+    monkeypatch.setenv("OCR_ENGINE_WORKERS", "2")
+
+    engine = ocr_engine.get_engine()
+
+    assert engine is not None and engine.workers == 2
+    engine.shutdown()
@@ -0,0 +1,63 @@
+"""Tests for subscription_cache's cached user records"""
+from subscription_cache import NOT_FOUND, SubscriptionCache
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeDocument:
+    def __init__(self, client: "FakeFirestore", doc_id: str):
+        self.client = client
+        self.id = doc_id
+
+    def get(self) -> FakeSnapshot:
+        self.client.reads += 1
+        return FakeSnapshot(self.id, self.client.users.get(self.id))
+
+
+class FakeFirestore:
+    def __init__(self, users: dict):
+        self.users = users
+        self.reads = 0
+
+    def collection(self, path: str) -> "FakeFirestore":
+        return self
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self, doc_id)
+
+
+def test_status_and_organization_share_one_read():
+    client = FakeFirestore({"u1": {"subscription_status": "active", "org_id": "acme"}})
+    cache = SubscriptionCache(lambda: client)
+
+    assert cache.organization("u1") == "acme"
+    assert cache.get("u1") == "active"
+    assert client.reads == 1
+
+
+def test_unknown_user_has_no_organization():
+    client = FakeFirestore({"u1": {"subscription_status": "active"}})
+    cache = SubscriptionCache(lambda: client)
+
+    assert cache.organization("u1") is None
+    assert cache.organization("ghost") is None
+    assert cache.get("ghost") == NOT_FOUND
+
+
+def test_invalidate_rereads_organization():
+    client = FakeFirestore({"u1": {"org_id": "acme"}})
+    cache = SubscriptionCache(lambda: client)
+    assert cache.organization("u1") == "acme"
+
+    client.users["u1"] = {"org_id": "globex"}
+    cache.invalidate("u1")
+
+    assert cache.organization("u1") == "globex"
@@ -0,0 +1,26 @@
+"""Tests for tally_masters name resolution"""
+from tally_masters import MasterCache, Masters
+
+
+def cache_with(ledgers, stock_items) -> MasterCache:
+    cache = MasterCache(send_request=None, refresh_interval=3600)
+    cache._masters["Acme"] = Masters(ledgers, stock_items)
+    return cache
+
+
+def test_ledgers_resolve_only_by_exact_name():
+    cache = cache_with(["ABC Traders", "HDFC Bank", "Acme Traders Pvt. Ltd."], [])
+
+    assert cache.resolve_ledger("Acme", "ACME TRADERS PVT LTD") == "Acme Traders Pvt. Ltd."
+    assert cache.resolve_ledger("Acme", "hdfc bank") == "HDFC Bank"
+    assert cache.resolve_ledger("Acme", "XYZ Traders") is None
+    assert cache.resolve_ledger("Acme", "Bank") is None
+
+
+def test_stock_items_resolve_fuzzily():
+    cache = cache_with([], ["Tata Basmati Rice 5kg", "Amul Ghee 1L"])
+
+    resolved = cache.resolve_stock_items("Acme", ["TATA BASMATI RlCE 5kg", "Amul Ghee 1L", "Paneer"])
+
+    assert resolved == {"TATA BASMATI RlCE 5kg": "Tata Basmati Rice 5kg",
+                        "Amul Ghee 1L": "Amul Ghee 1L", "Paneer": None}
@@ -0,0 +1,176 @@
+"""
+Voucher Index Module
+Content-derived voucher identity (GUID and number from the source document
+and the line item) and a local SQLite index of vouchers already pushed to
+each Tally instance and company
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from extraction_cache import content_hash
+from line_items import LineItemBatch
+
+logger = logging.getLogger("ai-tally-agent.voucher_index")
+
+# Namespace of the uuid5 voucher GUIDs
+VOUCHER_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://tallyai.app/voucher")
+
+# Keys looked up per SELECT (below SQLite's bound-parameter limit)
+_LOOKUP_CHUNK = 500
+
+
+def voucher_keys(batch: LineItemBatch) -> List[str]:
+    """
+    Identity key of every row
+
+    A key hashes the row's source document, its normalised values and how
+    many identical rows came before it in that document, so the same
+    invoice always yields the same keys and repeated rows stay distinct.
+    Rows without a source use a hash of all such rows in the batch.
+    """
+    canonical = []
+    for i in range(len(batch)):
+        values = [" ".join(batch.names[i].split()).casefold(), " ".join(batch.units[i].split()).casefold()]
+        for column in (batch.qty, batch.rate, batch.net_worth, batch.vat, batch.gross):
+            values.append(f"{column[i]:.4f}")
+        canonical.append("\x1f".join(values))
+
+    unsourced = [row for row, source in zip(canonical, batch.sources) if not source]
+    fallback = content_hash("\x1e".join(unsourced)) if unsourced else ""
+    seen: Dict[Tuple[str, str], int] = {}
+    keys = []
+    for row, source in zip(canonical, batch.sources):
+        source = source or fallback
+        occurrence = seen.get((source, row), 0)
+        seen[(source, row)] = occurrence + 1
+        keys.append(content_hash("\0".join((source, row, str(occurrence)))))
+    return keys
+
+
+def voucher_guid(key: str) -> str:
+    """Tally GUID (and REMOTEID) for a voucher key"""
+    return str(uuid.uuid5(VOUCHER_NAMESPACE, key)).upper()
+
+
+def voucher_number(key: str) -> str:
+    """Voucher number for a voucher key; 48 bits keep collisions negligible per company"""
+    return f"INV-{key[:12].upper()}"
+
+
+class VoucherIndex:
+    """
+    SQLite record of vouchers Tally accepted, per Tally instance and company
+
+    The index is advisory: TallyClient logs lookup and record errors as
+    warnings and the import goes ahead, and Tally still matches re-sent
+    vouchers by REMOTEID.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS vouchers ("
+            " instance TEXT NOT NULL, company TEXT NOT NULL, key TEXT NOT NULL,"
+            " guid TEXT NOT NULL, number TEXT NOT NULL, pushed_at REAL NOT NULL,"
+            " PRIMARY KEY (instance, company, key)) WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def pushed(self, instance: str, company: str, keys: Sequence[str]) -> Set[str]:
+        """The subset of keys already pushed to this instance and company"""
+        conn = self._conn()
+        found: Set[str] = set()
+        for start in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(row[0] for row in conn.execute(
+                f"SELECT key FROM vouchers WHERE instance = ? AND company = ? AND key IN ({placeholders})",
+                (instance, company.lower(), *chunk)
+            ))
+        return found
+
+    def record(self, instance: str, company: str, vouchers: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Remember pushed vouchers
+
+        Args:
+            vouchers: (key, guid, number) of each voucher Tally accepted
+
+        Returns:
+            Number of vouchers recorded
+        """
+        now = time.time()
+        rows = [(instance, company.lower(), key, guid, number, now) for key, guid, number in vouchers]
+        if rows:
+            conn = self._conn()
+            conn.executemany(
+                "INSERT OR IGNORE INTO vouchers (instance, company, key, guid, number, pushed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.commit()
+        return len(rows)
+
+    def forget(self, instance: str, company: Optional[str] = None) -> int:
+        """
+        Drop the records of an instance (or one of its companies), e.g.
+        after the company data was restored from a backup
+
+        Returns:
+            Number of records removed
+        """
+        conn = self._conn()
+        if company is None:
+            cursor = conn.execute("DELETE FROM vouchers WHERE instance = ?", (instance,))
+        else:
+            cursor = conn.execute("DELETE FROM vouchers WHERE instance = ? AND company = ?",
+                                  (instance, company.lower()))
+        conn.commit()
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return {"vouchers": self._conn().execute("SELECT COUNT(*) FROM vouchers").fetchone()[0]}
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connection for the current thread (re-opened after fork)"""
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+
+_index: Optional[VoucherIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_voucher_index() -> Optional[VoucherIndex]:
+    """
+    Process-wide index at VOUCHER_INDEX_PATH, or None if
+    VOUCHER_INDEX_ENABLED is off or the file cannot be opened
+    """
+    global _index
+    if os.environ.get("VOUCHER_INDEX_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = os.environ.get(
+                    "VOUCHER_INDEX_PATH",
+                    os.path.join(tempfile.gettempdir(), "tallyai_voucher_index.sqlite3")
+                )
+                try:
+                    _index = VoucherIndex(path)
+                except sqlite3.Error as e:
+                    logger.warning("Voucher index unavailable, re-uploads will not be deduplicated: %s", e)
+                    return None
+    return _index
@@ -276,8 +276,11 @@ const App = () => {
     formData.append('file', file);
     
     try {
+      // The backend routes the upload to the user's Tally by this token
+      const idToken = await user.getIdToken();
       const response = await fetch('http://localhost:5000/upload-invoice', {
         method: 'POST',
+        headers: { Authorization: `Bearer ${idToken}` },
         body: formData,
       });
       console.log(response)